@@ -0,0 +1,133 @@
+# bench_recv.py
+# Microbenchmark for the a1 receive path. It pushes a stream of length-prefixed
+# frames through a local socket pair and compares the original 64-byte chunk loop
+# (recv + list of chunks + b''.join + decode) against FrameReader (recv_into a
+# reusable buffer + memoryview) at several read sizes.
+#
+# For each variant it reports, per message:
+#   - recv calls:  receive system calls made
+#   - usec:        wall time, measured in a separate run without tracemalloc
+# and, per run, the peak memory allocated by the receive loop above the baseline
+# (tracemalloc), which shows the cost of collecting chunk objects before joining.
+#
+# Usage: python bench_recv.py [--messages N] [--sizes 10,99,4096,1048576]
+
+import argparse
+import socket
+import threading
+import time
+import tracemalloc
+
+from vlprotocol import LEGACY, WIDE, FrameReader, encode_frame
+
+
+class CountingSocket:
+    """Wraps a socket and counts the receive calls made on it."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.recv_calls = 0
+
+    def recv(self, n):
+        self.recv_calls += 1
+        return self.sock.recv(n)
+
+    def recv_into(self, buffer, n):
+        self.recv_calls += 1
+        return self.sock.recv_into(buffer, n)
+
+
+def chunk_loop_receive(sock, mode, bufsize=64):
+    """
+    The receive loop myvlserver.py and myvlclient.py used before FrameReader:
+    recv() the length prefix, then recv() at most bufsize bytes at a time into a
+    list of chunks that is joined and decoded at the end.
+    """
+    header_size = 4 if mode == WIDE else 2
+    header = sock.recv(header_size)
+    if not header:
+        return None
+    msg_len = int.from_bytes(header, 'big') if mode == WIDE else int(header.decode())
+    message_chunks = []
+    bytes_received = 0
+    while bytes_received < msg_len:
+        chunk = sock.recv(min(msg_len - bytes_received, bufsize))
+        if not chunk:
+            raise ConnectionError("Peer disconnected during message transfer.")
+        message_chunks.append(chunk)
+        bytes_received += len(chunk)
+    return b''.join(message_chunks).decode()
+
+
+def send_frames(sock, frame, count):
+    """Writes count copies of frame, then closes the sending side."""
+    batch = frame * max(1, 65536 // len(frame))
+    per_batch = len(batch) // len(frame)
+    sent = 0
+    while sent < count:
+        n = min(per_batch, count - sent)
+        sock.sendall(batch if n == per_batch else frame * n)
+        sent += n
+    sock.shutdown(socket.SHUT_WR)
+
+
+def run_variant(receive, frame, count, trace):
+    """
+    Receives count frames with the given receive function.
+
+    Returns:
+        tuple: (recv calls, peak allocated bytes or 0, elapsed seconds)
+    """
+    sender_sock, receiver_sock = socket.socketpair()
+    counting = CountingSocket(receiver_sock)
+    receive_one = receive(counting)
+    sender = threading.Thread(target=send_frames, args=(sender_sock, frame, count))
+    sender.start()
+
+    if trace:
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    for _ in range(count):
+        message = receive_one()
+        if message is None:
+            raise ConnectionError("Stream ended early")
+    elapsed = time.perf_counter() - started
+    peak = 0
+    if trace:
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+        tracemalloc.stop()
+
+    sender.join()
+    sender_sock.close()
+    receiver_sock.close()
+    return counting.recv_calls, peak, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the a1 receive paths")
+    parser.add_argument('--messages', type=int, default=2000, help="messages per run (default: 2000)")
+    parser.add_argument('--sizes', default='10,99,4096,1048576',
+                        help="comma-separated payload sizes in bytes (default: 10,99,4096,1048576)")
+    args = parser.parse_args()
+
+    variants = [
+        ("chunk loop, 64 B", lambda mode: lambda sock: lambda: chunk_loop_receive(sock, mode)),
+        ("FrameReader, 64 B", lambda mode: lambda sock: (lambda r: lambda: str(r.read_frame(mode), 'utf-8'))(FrameReader(sock, 64))),
+        ("FrameReader, 64 KiB", lambda mode: lambda sock: (lambda r: lambda: str(r.read_frame(mode), 'utf-8'))(FrameReader(sock))),
+    ]
+
+    print(f"{'payload':>9}  {'variant':<20} {'recv calls/msg':>14} {'usec/msg':>9} {'peak alloc KiB':>14}")
+    for size in (int(s) for s in args.sizes.split(',')):
+        mode = LEGACY if size <= 99 else WIDE
+        frame = encode_frame(b'x' * size, mode)
+        # Fewer messages for large payloads so every size takes a similar time
+        count = max(20, min(args.messages, args.messages * 4096 // max(size, 1)))
+        for name, make in variants:
+            recv_calls, peak, _ = run_variant(make(mode), frame, count, trace=True)
+            _, _, elapsed = run_variant(make(mode), frame, count, trace=False)
+            print(f"{size:>9}  {name:<20} {recv_calls / count:>14.3f} {elapsed / count * 1e6:>9.2f} {peak / 1024:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
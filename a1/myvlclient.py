@@ -2,47 +2,103 @@
 # This client implements a TCP socket that sends variable-length messages to the server
 # and receives responses. It uses the same length-prefix protocol as the server,
 # where the first 2 bytes indicate the length of the following message.
+# With --framing wide (or auto) it instead negotiates the wide framing from
+# vlprotocol.py, where a 4-byte length allows messages of several megabytes.
 
+import argparse
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from socket import *  
 
-def receive_full_response(client_socket, bufsize):
+from vlprotocol import (HELLO_LEN, HELLO_MAGIC, LEGACY, REFUSED, WIDE, WIDE_BUFSIZE,
+                        FrameReader, encode_frame, hello, recv_exact)
+
+HELLO_TIMEOUT = 2.0  # Seconds to wait for the server to answer a framing hello
+
+
+def request_wide_framing(client_socket):
+    """
+    Sends the wide-framing hello and waits for the server's answer.
+    A server that predates wide framing rejects the hello by closing the
+    connection, so any failure here means the caller should fall back to legacy.
+
+    Args:
+        client_socket: A freshly connected socket
+
+    Returns:
+        bool: True if the server agreed to wide framing
+    """
+    try:
+        client_socket.settimeout(HELLO_TIMEOUT)
+        client_socket.sendall(hello())
+        answer = recv_exact(client_socket, HELLO_LEN, HELLO_LEN)
+    except (OSError, ConnectionError):
+        return False
+    finally:
+        client_socket.settimeout(None)
+    return len(answer) == HELLO_LEN and answer[:2] == HELLO_MAGIC and answer[2] != REFUSED
+
+
+def connect_to_server(server_name, server_port, framing):
+    """
+    Connects to the server and settles on a framing mode.
+
+    Args:
+        server_name: Hostname of the server
+        server_port: Port of the server
+        framing: 'legacy', 'wide' (fail if the server cannot do it) or 'auto' (wide, else legacy)
+
+    Returns:
+        tuple: (connected socket, LEGACY or WIDE)
+
+    Raises:
+        ConnectionError: If framing is 'wide' and the server only speaks legacy framing
+    """
+    client_socket = socket(AF_INET, SOCK_STREAM)  # AF_INET for IPv4, SOCK_STREAM for TCP
+    client_socket.connect((server_name, server_port))
+    if framing == LEGACY:
+        return client_socket, LEGACY
+
+    if request_wide_framing(client_socket):
+        return client_socket, WIDE
+
+    # An old server drops the connection on the hello; a new one may answer REFUSED.
+    # Either way start over on a fresh connection and speak legacy framing.
+    client_socket.close()
+    if framing == WIDE:
+        raise ConnectionError("Server does not support wide framing.")
+    client_socket = socket(AF_INET, SOCK_STREAM)
+    client_socket.connect((server_name, server_port))
+    return client_socket, LEGACY
+
+
+def receive_full_response(frame_reader, mode=LEGACY):
     """
-    Receives a response with a 2-byte length prefix from the server.
+    Receives a length-prefixed response from the server: a 2-byte prefix in
+    legacy mode or a 4-byte prefix in wide mode.
     Handles the complete message reception process, including chunking for large messages.
     
     Args:
-        client_socket: The socket connected to the server
-        bufsize: Maximum size of each receive operation
+        frame_reader: The FrameReader wrapping the socket connected to the server
+        mode: The framing negotiated for this connection (LEGACY or WIDE)
         
     Returns:
         str: The decoded response message, or None if an error occurs
     """
     try:
-        # Step 1: Receive the 2-byte length prefix for the server's response
-        # The length is sent as a 2-character string like "10" or "05"
-        response_len_str = client_socket.recv(2).decode()
-        if not response_len_str:
-            return None  # Server closed the connection
+        # Steps 1 and 2: Receive the length prefix and then the complete message
+        # In legacy mode the length is sent as a 2-character string like "10" or "05".
+        # The reader hands back a view of its receive buffer, so nothing is copied before decoding.
         try:
-            response_len = int(response_len_str)
-        except ValueError:
-            print(f"Error: Could not convert received length '{response_len_str}' to integer because length is not provided.")
+            response = frame_reader.read_frame(mode)
+        except ValueError as e:
+            print(f"Error: Could not convert received length to integer because length is not provided: {e}")
             return None # Server closed the connection
-        # Step 2: Receive the complete message in chunks
-        # This loop handles responses larger than the buffer size
-        message_chunks = []
-        bytes_received = 0
-        while bytes_received < response_len:
-            # Calculate how many bytes to receive in this iteration
-            # Either the remaining message length or the buffer size, whichever is smaller
-            chunk = client_socket.recv(min(response_len - bytes_received, bufsize))
-            if not chunk:
-                raise ConnectionError("Server disconnected during message transfer.")
-            message_chunks.append(chunk)
-            bytes_received += len(chunk)
+        if response is None:
+            return None  # Server closed the connection
         
-        # Step 3: Combine all chunks and decode the complete message
-        return b''.join(message_chunks).decode()
+        # Step 3: Decode the complete message
+        return str(response, 'utf-8')
 
     except (ValueError, ConnectionError) as e:
         # Handle errors in message reception or decoding
@@ -50,33 +106,221 @@ def receive_full_response(client_socket, bufsize):
         return None
 
 
+class VLClient:
+    """
+    Keeps persistent connections to the server and pipelines requests over them,
+    so a batch of messages costs one TCP handshake per pooled connection instead
+    of one per message.
+
+    Example:
+        with VLClient(pool_size=4) as client:
+            upper = client.send_many(["hello", "world"])
+    """
+    PIPELINE_DEPTH = 64          # Maximum requests in flight on one connection
+    PIPELINE_BYTES = 256 * 1024  # Maximum request bytes in flight, so neither side's socket buffer fills up
+
+    def __init__(self, server_name='localhost', server_port=12000, framing='auto', pool_size=1):
+        """
+        Args:
+            server_name: Hostname of the server
+            server_port: Port of the server
+            framing: 'legacy', 'wide' or 'auto', as for connect_to_server()
+            pool_size: Number of connections send_many() spreads a batch across
+        """
+        self.server_name = server_name
+        self.server_port = server_port
+        self.framing = framing
+        self.pool_size = max(1, pool_size)
+        self.connections = [None] * self.pool_size  # (socket, mode, FrameReader), opened on first use
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Closes every pooled connection."""
+        for index, connection in enumerate(self.connections):
+            if connection:
+                connection[0].close()
+                self.connections[index] = None
+
+    def send(self, message):
+        """
+        Sends one message over a kept-alive connection.
+
+        Args:
+            message: The text to uppercase
+
+        Returns:
+            str: The server's response
+        """
+        return self.send_many([message])[0]
+
+    def send_many(self, messages):
+        """
+        Sends a batch of messages and returns the responses in the same order.
+        The batch is split into contiguous slices, one per pooled connection, and
+        each slice is pipelined over its connection.
+
+        Args:
+            messages: The texts to uppercase
+
+        Returns:
+            list[str]: The server's responses
+
+        Raises:
+            ConnectionError: If a connection fails twice in a row
+            ValueError: If a message does not fit the negotiated framing
+        """
+        messages = list(messages)
+        if len(messages) <= 1 or self.pool_size == 1:
+            return self._send_on(0, messages)
+
+        slice_len = -(-len(messages) // self.pool_size)  # Ceiling division
+        slices = [messages[i:i + slice_len] for i in range(0, len(messages), slice_len)]
+        with ThreadPoolExecutor(max_workers=len(slices)) as executor:
+            results = executor.map(self._send_on, range(len(slices)), slices)
+            return [response for responses in results for response in responses]
+
+    def _send_on(self, index, messages):
+        """
+        Pipelines messages over pooled connection number index. A dead connection
+        (e.g. the server restarted, or an old server that closes after every answer)
+        is replaced and the unanswered messages are resent, as long as each fresh
+        connection answers at least one of them.
+        """
+        responses = []
+        while True:
+            fresh = self.connections[index] is None
+            if fresh:
+                client_socket, mode = connect_to_server(self.server_name, self.server_port, self.framing)
+                read_size = WIDE_BUFSIZE if mode == WIDE else FrameReader.DEFAULT_READ_SIZE
+                self.connections[index] = (client_socket, mode, FrameReader(client_socket, read_size))
+            client_socket, mode, frame_reader = self.connections[index]
+            answered_before = len(responses)
+            try:
+                self._pipeline(client_socket, mode, frame_reader, messages[answered_before:], responses)
+                return responses
+            except (OSError, ConnectionError):
+                client_socket.close()
+                self.connections[index] = None
+                if fresh and len(responses) == answered_before:
+                    raise
+
+    def _pipeline(self, client_socket, mode, frame_reader, messages, responses):
+        """
+        Writes requests ahead of the responses, up to PIPELINE_DEPTH requests or
+        PIPELINE_BYTES bytes in flight, and appends each response as it arrives.
+        """
+        frames = [encode_frame(message.encode(), mode) for message in messages]
+        answered = 0
+        sent = 0
+        in_flight_bytes = 0
+        while answered < len(frames):
+            # Top up the window of unanswered requests; always allow at least one
+            window_end = sent
+            while (window_end < len(frames) and window_end - answered < self.PIPELINE_DEPTH
+                   and (window_end == answered or in_flight_bytes + len(frames[window_end]) <= self.PIPELINE_BYTES)):
+                in_flight_bytes += len(frames[window_end])
+                window_end += 1
+            if window_end > sent:
+                client_socket.sendall(b''.join(frames[sent:window_end]))
+                sent = window_end
+
+            response = receive_full_response(frame_reader, mode)
+            if response is None:
+                raise ConnectionError("Server closed the connection before answering every request.")
+            responses.append(response)
+            in_flight_bytes -= len(frames[answered])
+            answered += 1
+
+
+def parse_args():
+    """
+    Parses the command line options.
+
+    Returns:
+        argparse.Namespace: The parsed options
+    """
+    parser = argparse.ArgumentParser(description="Variable-length message uppercase client")
+    parser.add_argument('--host', default='localhost', help="server hostname (default: localhost)")
+    parser.add_argument('--port', type=int, default=12000, help="server port (default: 12000)")
+    parser.add_argument('--framing', choices=[LEGACY, WIDE, 'auto'], default=LEGACY,
+                        help="legacy 2-digit lengths typed by the user, or 4-byte lengths added by "
+                             "the client ('auto' falls back to legacy on old servers)")
+    parser.add_argument('--file', help="send the contents of this file (use - for stdin) instead of prompting")
+    parser.add_argument('--batch', help="send every line of this file (use - for stdin) as its own message "
+                                        "over persistent, pipelined connections")
+    parser.add_argument('--pool-size', type=int, default=1,
+                        help="--batch: number of connections to spread the messages across (default: 1)")
+    return parser.parse_args()
+
+
 def main():
     """
     Main function to set up the client, send a message, and receive the response.
     The client connects to the server, sends a single message, and then terminates.
     """
+    args = parse_args()
+
     # Server configuration
-    server_name = 'localhost'  # Server is running on the same machine
-    server_port = 12000       # Must match the server's port
+    server_name = args.host  # Server is running on the same machine by default
+    server_port = args.port  # Must match the server's port
     bufsize = 64             # Maximum size of each receive operation, as required by assignment
 
-    # Create and connect the socket
-    client_socket = socket(AF_INET, SOCK_STREAM)  # AF_INET for IPv4, SOCK_STREAM for TCP
-    client_socket.connect((server_name, server_port))
+    if args.batch:
+        # Batch mode: one message per line, pipelined over kept-alive connections
+        with (sys.stdin if args.batch == '-' else open(args.batch, encoding='utf-8')) as f:
+            lines = f.read().splitlines()
+        try:
+            with VLClient(server_name, server_port, args.framing, args.pool_size) as client:
+                for modified_sentence in client.send_many(lines):
+                    print('From Server:', modified_sentence)
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}")
+        return
 
-    # Get user input
-    # The user must provide the length manually as part of the input
-    # Format: [length][message]             
-    # Example: "10helloworld" means "send 'helloworld' which is 10 characters long"
-    sentence = input('Input lowercase sentence: ')
+    # Create and connect the socket, negotiating the framing if asked to
+    try:
+        client_socket, mode = connect_to_server(server_name, server_port, args.framing)
+    except ConnectionError as e:
+        print(f"Error: {e}")
+        return
+    if mode == WIDE:
+        bufsize = WIDE_BUFSIZE  # Wide responses can be megabytes long
+
+    if args.file:
+        # Bulk text goes out as a single message, so it needs wide framing
+        with (sys.stdin if args.file == '-' else open(args.file, encoding='utf-8')) as f:
+            sentence = f.read()
+    else:
+        # Get user input
+        # In legacy mode the user must provide the length manually as part of the input
+        # Format: [length][message]             
+        # Example: "10helloworld" means "send 'helloworld' which is 10 characters long"
+        sentence = input('Input lowercase sentence: ')
+
+    if args.framing == LEGACY and not args.file:
+        # Send exactly what the user typed, length prefix included
+        request = sentence.encode()
+    else:
+        # The client adds the length prefix itself
+        try:
+            request = encode_frame(sentence.encode(), mode)
+        except ValueError as e:
+            print(f"Error: {e}")
+            client_socket.close()
+            return
 
     # Send the complete message to the server
     # sendall() ensures the entire message is sent, even if it's larger than the buffer
-    client_socket.sendall(sentence.encode())
+    client_socket.sendall(request)
 
     # Receive and process the server's response
     # The response will be the same message in uppercase
-    modified_sentence = receive_full_response(client_socket, bufsize)
+    modified_sentence = receive_full_response(FrameReader(client_socket, read_size=bufsize), mode)
 
     # Display the response if received successfully
     if modified_sentence:
@@ -88,4 +332,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,49 +1,84 @@
 # myvlserver.py
 # This server implements a TCP socket that handles variable-length messages
 # using a custom length-prefix protocol as the application layer protocl. The first 2 bytes of each message indicate
-# the length of the following message content.
+# the length of the following message content. Clients may instead negotiate wide framing,
+# where a 4-byte big-endian length allows messages of several megabytes (see vlprotocol.py).
 
+import argparse
+import asyncio
+import json
+import math
+import os
+import selectors
+import signal
+import sys
+import time
 from socket import *  # Import all socket-related functions and constants
 
-def receive_full_message(cn_socket, bufsize):
+from vlprotocol import (HELLO_LEN, HELLO_MAGIC, LEGACY, LEGACY_HEADER_LEN, WIDE, WIDE_BUFSIZE, FrameReader,
+                        choose_version, decode_length, encode_frame, header_len, hello)
+
+GRACEFUL_TIMEOUT = 30.0    # Seconds busy connections get to finish when the server stops or reloads
+STATS_PUSH_INTERVAL = 1.0  # Seconds between stats exports from a prefork worker to the master
+FAST_FAILURE = 10.0        # A prefork worker exiting sooner than this after it started has failed fast
+RESPAWN_DELAY = 0.5        # Seconds before replacing a worker that failed fast, doubled for each failure in a row
+MAX_RESPAWN_DELAY = 30.0   # Longest wait before replacing a worker
+MAX_FAST_FAILURES = 5      # Fast failures in a row after which a worker slot is left empty
+
+
+def negotiate_framing(frame_reader):
+    """
+    Peeks at the first 2 bytes of a connection to find out which framing the client speaks.
+    A wide-framing hello is consumed and answered right away; anything else is the
+    length prefix of a legacy message and is left in the reader to be parsed as such.
+
+    Args:
+        frame_reader: The FrameReader wrapping the client connection socket
+
+    Returns:
+        str: LEGACY or WIDE, or None if the client closed the connection
+    """
+    first_bytes = frame_reader.peek(LEGACY_HEADER_LEN)
+    if not first_bytes:
+        return None
+    if first_bytes != HELLO_MAGIC:
+        return LEGACY
+
+    # The client asked for wide framing; answer with the version we agree to speak
+    version = choose_version(frame_reader.read_exact(HELLO_LEN)[-1])
+    frame_reader.sock.sendall(hello(version))
+    print(f"Negotiated framing: {'wide v' + str(version) if version else 'legacy'}")
+    return WIDE if version else LEGACY
+
+
+def receive_full_message(frame_reader, mode=LEGACY):
     """
-    Receives a message with a 2-byte length prefix.
+    Receives a message with a length prefix: 2 ASCII digits in legacy mode,
+    or a 4-byte big-endian integer in wide mode.
     Keeps receiving data until the full message is received.
     
     Args:
-        cn_socket: The client connection socket
-        bufsize: Maximum size of each receive operation
+        frame_reader: The FrameReader wrapping the client connection socket
+        mode: The framing negotiated for this connection (LEGACY or WIDE)
         
     Returns:
         tuple: (decoded_message, message_length) or (None, None) if error
     """
     try:
-        # Step 1: Receive the 2-byte length prefix
-        # The length is sent as a 2-character string like "10" or "05"
-        # This allows for messages up to 99 characters long
-        msg_len_str = cn_socket.recv(2).decode()
-        if not msg_len_str:
+        # Steps 1 and 2: Receive the length prefix and then the complete message
+        # In legacy mode the length is sent as a 2-character string like "10" or "05",
+        # which allows for messages up to 99 characters long.
+        # The reader receives straight into its buffer and hands back a view of the
+        # message, so nothing is copied before decoding.
+        message = frame_reader.read_frame(mode)
+        if message is None:
             return None, None  # Connection closed by client
-        msg_len = int(msg_len_str)
+        msg_len = len(message)
         print(f"Length of message received: {msg_len}")
-
-        # Step 2: Receive the complete message in chunks
-        # This loop handles messages larger than the buffer size
-        message_chunks = []
-        bytes_received = 0
-        while bytes_received < msg_len:
-            # Calculate how many bytes to receive in this iteration
-            # Either the remaining message length or the buffer size, whichever is smaller
-            chunk = cn_socket.recv(min(msg_len - bytes_received, bufsize))
-            if not chunk:
-                # This would happen if the client disconnects mid-message
-                raise ConnectionError("Client disconnected during message transfer.")
-            message_chunks.append(chunk)
-            bytes_received += len(chunk)
         
-        # Step 3: Combine all chunks and decode the complete message
-        full_message = b''.join(message_chunks).decode()
-        print(f"processed: {full_message}")
+        # Step 3: Decode the complete message
+        full_message = str(message, 'utf-8')
+        print(f"processed: {full_message if mode == LEGACY else full_message[:80]}")
         return full_message, msg_len
 
     except (ValueError, ConnectionError) as e:
@@ -54,7 +89,9 @@ def receive_full_message(cn_socket, bufsize):
 
 def handle_client(cn_socket, addr, bufsize):
     """
-    Handles a single client connection: receive, process, send back.
+    Handles a client connection: negotiate framing, then receive, process and send
+    back each message in turn until the client closes the connection. Clients may
+    pipeline several requests without waiting; responses go out in the same order.
     
     Args:
         cn_socket: The client connection socket
@@ -62,38 +99,814 @@ def handle_client(cn_socket, addr, bufsize):
         bufsize: Maximum size of each receive operation
     """
     print(f"Connected from {addr[0]}:{addr[1]}")
-    
-    # Receive the variable-length message from the client
-    received_message, msg_len = receive_full_message(cn_socket, bufsize)
+    frame_reader = FrameReader(cn_socket, read_size=bufsize)
+
+    try:
+        mode = negotiate_framing(frame_reader)
+    except ConnectionError as e:
+        print(f"Error receiving message: {e}")
+        mode = None
+
+    # Wide messages can be megabytes long; the assignment's 64-byte reads would crawl
+    if mode == WIDE:
+        frame_reader.read_size = max(bufsize, WIDE_BUFSIZE)
+
+    # Keep serving requests on this connection until the client closes it
+    while mode is not None:
+        # Receive the variable-length message from the client
+        received_message, msg_len = receive_full_message(frame_reader, mode)
+
+        # Stop once the client closed the connection or sent something malformed
+        if received_message is None:
+            break
 
-    # Process and respond only if message was received successfully
-    if received_message:
         # Convert the message to uppercase as per protocol requirements
         capitalized_message = received_message.upper()
 
-        # Prepare response in the same format: 2-byte length + message
-        # Format the length to be a 2-digit string with leading zero if needed
-        # Example: 5 -> "05", 10 -> "10"
-        response_len_str = f"{len(capitalized_message):02d}"
-        response = response_len_str + capitalized_message
-        
+        # Prepare response in the same framing as the request
+        # Legacy example: 5 -> "05", 10 -> "10"
+        try:
+            response = encode_frame(capitalized_message.encode(), mode)
+        except ValueError as e:
+            # Uppercasing can lengthen some characters (e.g. "ß" -> "SS") past 99 bytes.
+            # Skipping the response would misalign every pipelined answer after it.
+            print(f"Error sending message: {e}")
+            break
+
         # Send the complete response
         # sendall() ensures the entire message is sent, even if it's larger than the buffer
-        cn_socket.sendall(response.encode())
-        print(f"Length of message sent: {len(capitalized_message)}")
-        print(f"Message sent: {capitalized_message}")
+        try:
+            cn_socket.sendall(response)
+        except OSError as e:
+            print(f"Error sending message: {e}")
+            break
+        print(f"Length of message sent: {len(response) - header_len(mode)}")
+        print(f"Message sent: {capitalized_message if mode == LEGACY else capitalized_message[:80]}")
 
     print("Connection closed\n")
     cn_socket.close()
 
 
+class ServerStats:
+    """
+    Collects request counters and latency percentiles for the asyncio serving mode.
+    Latencies are kept in a fixed set of log-scale buckets (4 per power of two,
+    in microseconds), so memory use stays constant no matter how many requests
+    are served and p50/p99 are accurate to within ~20%.
+    """
+    BUCKETS_PER_OCTAVE = 4
+    NUM_BUCKETS = 30 * BUCKETS_PER_OCTAVE  # 1us up to ~18 minutes
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.requests = 0
+        self.errors = 0
+        self.active_connections = 0
+        self.waiting_connections = 0
+        self.total_connections = 0
+        self.latency_buckets = [0] * self.NUM_BUCKETS
+        self.max_latency = 0.0
+        # Values at the previous report, used to compute the interval request rate
+        self._last_report_at = self.started_at
+        self._last_report_requests = 0
+
+    def record_latency(self, seconds):
+        """
+        Records one completed request.
+
+        Args:
+            seconds: Time taken to serve the request
+        """
+        self.requests += 1
+        if seconds > self.max_latency:
+            self.max_latency = seconds
+        micros = seconds * 1_000_000
+        index = int(math.log2(micros) * self.BUCKETS_PER_OCTAVE) + 1 if micros >= 1 else 0
+        self.latency_buckets[min(index, self.NUM_BUCKETS - 1)] += 1
+
+    def percentile(self, fraction):
+        """
+        Estimates a latency percentile from the histogram.
+
+        Args:
+            fraction: The percentile as a fraction, e.g. 0.99 for p99
+
+        Returns:
+            float: The upper bound of the matching bucket in seconds, or 0.0 if no requests were served
+        """
+        total = sum(self.latency_buckets)
+        if total == 0:
+            return 0.0
+        threshold = fraction * total
+        seen = 0
+        for index, count in enumerate(self.latency_buckets):
+            seen += count
+            if seen >= threshold:
+                # Bucket i holds latencies below 2 ** (i / BUCKETS_PER_OCTAVE) microseconds
+                upper = 2 ** (index / self.BUCKETS_PER_OCTAVE) / 1_000_000
+                return min(upper, self.max_latency)
+        return self.max_latency
+
+    def export(self):
+        """
+        Returns the cumulative counters in a JSON-friendly form, so a prefork
+        master can add up the stats of all its workers.
+
+        Returns:
+            dict: Counters, connection gauges and the raw latency histogram
+        """
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "active_connections": self.active_connections,
+            "waiting_connections": self.waiting_connections,
+            "total_connections": self.total_connections,
+            "latency_buckets": self.latency_buckets,
+            "max_latency": self.max_latency,
+        }
+
+    def load_totals(self, exports):
+        """
+        Replaces the cumulative counters with the sums of several export() results.
+        Histograms with identical buckets add up exactly, so the merged p50/p99
+        are as accurate as a single worker's.
+
+        Args:
+            exports: Iterable of dicts as returned by export()
+        """
+        self.requests = self.errors = 0
+        self.active_connections = self.waiting_connections = self.total_connections = 0
+        self.latency_buckets = [0] * self.NUM_BUCKETS
+        self.max_latency = 0.0
+        for exported in exports:
+            self.requests += exported["requests"]
+            self.errors += exported["errors"]
+            self.active_connections += exported["active_connections"]
+            self.waiting_connections += exported["waiting_connections"]
+            self.total_connections += exported["total_connections"]
+            self.max_latency = max(self.max_latency, exported["max_latency"])
+            for index, count in enumerate(exported["latency_buckets"]):
+                self.latency_buckets[index] += count
+
+    def snapshot(self):
+        """
+        Returns the current counters and resets the interval request rate.
+
+        Returns:
+            dict: Request counts, connection counts, requests per second and latency percentiles
+        """
+        now = time.monotonic()
+        interval = now - self._last_report_at
+        interval_requests = self.requests - self._last_report_requests
+        self._last_report_at = now
+        self._last_report_requests = self.requests
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "active_connections": self.active_connections,
+            "waiting_connections": self.waiting_connections,
+            "total_connections": self.total_connections,
+            "rps": interval_requests / interval if interval > 0 else 0.0,
+            "lifetime_rps": self.requests / (now - self.started_at) if now > self.started_at else 0.0,
+            "p50_ms": self.percentile(0.50) * 1000,
+            "p99_ms": self.percentile(0.99) * 1000,
+            "max_ms": self.max_latency * 1000,
+        }
+
+
+def format_stats(stats):
+    """
+    Formats a stats snapshot as a single log line.
+
+    Args:
+        stats: A dict as returned by ServerStats.snapshot()
+
+    Returns:
+        str: The formatted line
+    """
+    return (f"[STATS] requests={stats['requests']} errors={stats['errors']} "
+            f"active={stats['active_connections']} waiting={stats['waiting_connections']} "
+            f"rps={stats['rps']:.1f} p50={stats['p50_ms']:.3f}ms "
+            f"p99={stats['p99_ms']:.3f}ms max={stats['max_ms']:.3f}ms")
+
+
+async def negotiate_framing_async(reader, writer):
+    """
+    Asyncio counterpart of negotiate_framing().
+
+    Args:
+        reader: The asyncio StreamReader for the client connection
+        writer: The asyncio StreamWriter for the client connection
+
+    Returns:
+        tuple: (mode, pending_header), or (None, None) if the client closed the connection
+    """
+    try:
+        first_bytes = await reader.readexactly(LEGACY_HEADER_LEN)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None, None
+        raise ConnectionError("Client disconnected while sending the length prefix.")
+    if first_bytes != HELLO_MAGIC:
+        return LEGACY, first_bytes
+
+    try:
+        requested = await reader.readexactly(1)
+    except asyncio.IncompleteReadError:
+        raise ConnectionError("Client disconnected during the framing hello.")
+    version = choose_version(requested[0])
+    writer.write(hello(version))
+    return (WIDE if version else LEGACY), None
+
+
+async def receive_full_message_async(reader, stats, verbose, mode=LEGACY, header=None):
+    """
+    Asyncio counterpart of receive_full_message(): reads a length prefix
+    and then exactly that many bytes of message content.
+
+    Args:
+        reader: The asyncio StreamReader for the client connection
+        stats: The ServerStats instance; receive errors are counted there
+        verbose: Whether to print the same per-message lines as the sequential server
+        mode: The framing negotiated for this connection (LEGACY or WIDE)
+        header: The length prefix if it was already read during negotiation
+
+    Returns:
+        tuple: (decoded_message, message_length) or (None, None) if error
+    """
+    try:
+        # Step 1: Receive the length prefix
+        if header is None:
+            try:
+                header = await reader.readexactly(header_len(mode))
+            except asyncio.IncompleteReadError as e:
+                if not e.partial:
+                    return None, None  # Connection closed by client
+                raise ConnectionError("Client disconnected while sending the length prefix.")
+        msg_len = decode_length(header, mode)
+        if verbose:
+            print(f"Length of message received: {msg_len}")
+
+        # Step 2: Receive the complete message; the StreamReader does the chunking for us
+        try:
+            full_message = (await reader.readexactly(msg_len)).decode()
+        except asyncio.IncompleteReadError:
+            raise ConnectionError("Client disconnected during message transfer.")
+        if verbose:
+            print(f"processed: {full_message if mode == LEGACY else full_message[:80]}")
+        return full_message, msg_len
+
+    except (ValueError, ConnectionError) as e:
+        stats.errors += 1
+        print(f"Error receiving message: {e}")
+        return None, None
+
+
+class ConnectionTracker:
+    """
+    Keeps track of the connections an asyncio server is serving, so it can shut
+    down gracefully: stop accepting, close connections that sit idle between
+    requests, and let the ones in the middle of a request finish it.
+
+    A connection counts as idle from the moment it is accepted until its first
+    request (or framing hello) arrives, and again between requests, so neither
+    a client that connects and sends nothing nor one queued for a slot holds up
+    a shutdown.
+    """
+
+    def __init__(self):
+        self.stopping = False
+        self.tasks = set()    # One handler task per open connection
+        self.idle = set()     # Writers of connections waiting for their next request
+        self.waiting = set()  # Handler tasks of connections waiting for a slot
+
+    def stop(self):
+        """Stops every connection at its next request boundary."""
+        self.stopping = True
+        for writer in list(self.idle):
+            writer.close()  # The pending read sees EOF and the handler exits
+        for task in list(self.waiting):
+            task.cancel()   # Nothing was read from it yet, so there's nothing to finish
+
+
+async def handle_client_async(reader, writer, stats, limiter, tracker, verbose):
+    """
+    Asyncio counterpart of handle_client(): receive, process, send back until the
+    client closes the connection. Many of these run concurrently on one event loop,
+    one per connection.
+
+    Args:
+        reader: The asyncio StreamReader for the client connection
+        writer: The asyncio StreamWriter for the client connection
+        stats: The ServerStats instance shared by all connections
+        limiter: Semaphore capping the number of connections served at once
+        tracker: The ConnectionTracker used for graceful shutdown
+        verbose: Whether to print the same per-message lines as the sequential server
+    """
+    if tracker.stopping:
+        writer.close()  # Accepted just before the server stopped listening
+        return
+    task = asyncio.current_task()
+    tracker.tasks.add(task)
+    tracker.idle.add(writer)
+    tracker.waiting.add(task)
+    stats.total_connections += 1
+    stats.waiting_connections += 1
+    waiting = True
+    try:
+        # Connections beyond the cap stay open but wait here until a slot frees up
+        try:
+            await limiter.acquire()
+        except asyncio.CancelledError:
+            if tracker.stopping:
+                return  # Cancelled by tracker.stop(): nothing was read from it, so nothing is lost
+            raise
+        tracker.waiting.discard(task)
+        stats.waiting_connections -= 1
+        waiting = False
+        stats.active_connections += 1
+        try:
+            await serve_connection_async(reader, writer, stats, tracker, verbose)
+        finally:
+            stats.active_connections -= 1
+            limiter.release()
+    finally:
+        if waiting:
+            stats.waiting_connections -= 1  # Stopped before getting a slot
+        tracker.tasks.discard(task)
+        tracker.waiting.discard(task)
+        tracker.idle.discard(writer)
+        writer.close()
+
+
+async def serve_connection_async(reader, writer, stats, tracker, verbose):
+    """
+    Serves every request on an accepted connection, in order, until the client
+    closes it. Pipelined requests are answered back to back.
+
+    Args:
+        reader: The asyncio StreamReader for the client connection
+        writer: The asyncio StreamWriter for the client connection
+        stats: The ServerStats instance shared by all connections
+        tracker: The ConnectionTracker used for graceful shutdown
+        verbose: Whether to print the same per-message lines as the sequential server
+    """
+    if verbose:
+        addr = writer.get_extra_info('peername')
+        print(f"Connected from {addr[0]}:{addr[1]}")
+
+    # Still idle (handle_client_async() registered it) until the first bytes arrive
+    try:
+        mode, header = await negotiate_framing_async(reader, writer)
+    except ConnectionError as e:
+        stats.errors += 1
+        print(f"Error receiving message: {e}")
+        mode = None
+    finally:
+        tracker.idle.discard(writer)
+
+    while mode is not None and not tracker.stopping:
+        # Wait for the next request header before starting the clock, so idle time
+        # between requests on a kept-alive connection does not count as latency
+        if header is None:
+            tracker.idle.add(writer)
+            try:
+                header = await reader.readexactly(header_len(mode))
+            except asyncio.IncompleteReadError as e:
+                if e.partial:
+                    stats.errors += 1
+                break  # Connection closed by client (or by a graceful shutdown)
+            except ConnectionError:
+                break
+            finally:
+                tracker.idle.discard(writer)
+        started = time.perf_counter()
+
+        received_message, msg_len = await receive_full_message_async(reader, stats, verbose, mode, header)
+        header = None
+        if received_message is None:
+            break
+
+        capitalized_message = received_message.upper()
+
+        # Same framing as the sequential server, so existing myvlclient.py
+        # users do not notice which mode the server runs in
+        try:
+            response = encode_frame(capitalized_message.encode(), mode)
+        except ValueError as e:
+            stats.errors += 1
+            print(f"Error sending message: {e}")
+            break
+        writer.write(response)
+        try:
+            # Only waits when the client is not reading fast enough
+            await writer.drain()
+        except ConnectionError:
+            stats.errors += 1
+            break
+        stats.record_latency(time.perf_counter() - started)
+        if verbose:
+            print(f"Length of message sent: {len(response) - header_len(mode)}")
+            print(f"Message sent: {capitalized_message if mode == LEGACY else capitalized_message[:80]}")
+
+    if verbose:
+        print("Connection closed\n")
+
+
+async def report_stats(stats, interval):
+    """
+    Prints a stats line every interval seconds until cancelled.
+
+    Args:
+        stats: The ServerStats instance to report on
+        interval: Seconds between reports
+    """
+    while True:
+        await asyncio.sleep(interval)
+        print(format_stats(stats.snapshot()))
+
+
+async def push_stats(stats, stats_fd, interval):
+    """
+    Writes a stats export to the prefork master every interval seconds until cancelled.
+    Each export is one JSON line, well under PIPE_BUF, so writes are never torn.
+
+    Args:
+        stats: The ServerStats instance to export
+        stats_fd: Write end of the pipe to the master
+        interval: Seconds between exports
+    """
+    while True:
+        await asyncio.sleep(interval)
+        write_stats_line(stats, stats_fd)
+
+
+def write_stats_line(stats, stats_fd):
+    """
+    Writes one stats export line to the prefork master, dropping it if the pipe is full.
+
+    Args:
+        stats: The ServerStats instance to export
+        stats_fd: Write end of the pipe to the master
+    """
+    try:
+        os.write(stats_fd, (json.dumps(stats.export()) + "\n").encode())
+    except (BlockingIOError, BrokenPipeError):
+        pass  # The master is busy or gone; the next export carries the same totals
+
+
+async def run_async_server(server_port, max_connections, stats_interval, verbose,
+                           listen_socket=None, stats_fd=None):
+    """
+    Serves clients concurrently on a single asyncio event loop until SIGTERM,
+    then shuts down gracefully: stops accepting, closes idle connections and
+    gives busy ones up to GRACEFUL_TIMEOUT seconds to finish their request.
+
+    Args:
+        server_port: Port number for the server
+        max_connections: Maximum number of connections served at the same time
+        stats_interval: Seconds between stats reports, or 0 to disable them
+        verbose: Whether to print per-message lines like the sequential server
+        listen_socket: An already listening socket to accept on (prefork workers), or None to bind server_port
+        stats_fd: Pipe to send stats exports to instead of printing them (prefork workers), or None
+    """
+    stats = ServerStats()
+    limiter = asyncio.Semaphore(max_connections)
+    tracker = ConnectionTracker()
+    stop_requested = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, stop_requested.set)
+
+    client_connected = lambda reader, writer: handle_client_async(reader, writer, stats, limiter, tracker, verbose)
+    if listen_socket is not None:
+        server = await asyncio.start_server(client_connected, sock=listen_socket)
+    else:
+        server = await asyncio.start_server(
+            client_connected, host='', port=server_port,
+            backlog=max(128, max_connections),  # Let bursts of connects queue in the kernel
+        )
+    if stats_fd is None:
+        print(f"The server is ready to receive messages (asyncio mode, up to {max_connections} concurrent connections)")
+        reporter = asyncio.create_task(report_stats(stats, stats_interval)) if stats_interval > 0 else None
+    else:
+        reporter = asyncio.create_task(push_stats(stats, stats_fd, STATS_PUSH_INTERVAL))
+
+    try:
+        await stop_requested.wait()
+
+        # Graceful shutdown: no new connections, idle ones closed, busy ones finish
+        server.close()
+        tracker.stop()
+        if tracker.tasks:
+            done, pending = await asyncio.wait(set(tracker.tasks), timeout=GRACEFUL_TIMEOUT)
+            for task in pending:
+                task.cancel()
+    finally:
+        server.close()
+        if reporter:
+            reporter.cancel()
+        if stats_fd is None:
+            print(format_stats(stats.snapshot()))
+        else:
+            write_stats_line(stats, stats_fd)  # Final totals, so the master does not lose them
+
+
+def run_worker(listen_socket, server_port, max_connections, stats_fd, verbose):
+    """
+    Body of a prefork worker process: serves connections on its own event loop
+    and never returns.
+
+    Args:
+        listen_socket: The listening socket inherited from the master, or None to bind
+                       a fresh SO_REUSEPORT socket on server_port
+        server_port: Port number for the server
+        max_connections: Maximum number of connections this worker serves at the same time
+        stats_fd: Write end of the stats pipe to the master
+        verbose: Whether to print per-message lines like the sequential server
+    """
+    # Ctrl+C and reloads are the master's business; it tells workers to stop with SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    exit_code = 0
+    try:
+        if listen_socket is None:
+            listen_socket = create_listening_socket(server_port, max_connections, reuse_port=True)
+        os.set_blocking(stats_fd, False)
+        asyncio.run(run_async_server(server_port, max_connections, 0, verbose, listen_socket, stats_fd))
+    except Exception as e:
+        print(f"[WORKER {os.getpid()}] Error: {e}")
+        exit_code = 1
+    finally:
+        # Skip the interpreter's normal exit path, which would run the master's cleanup too
+        sys.stdout.flush()
+        os._exit(exit_code)
+
+
+def create_listening_socket(server_port, backlog, reuse_port=False):
+    """
+    Creates a listening TCP socket on all interfaces.
+
+    Args:
+        server_port: Port number for the server
+        backlog: Length of the kernel's accept queue
+        reuse_port: Set SO_REUSEPORT so every worker can bind its own socket to the port
+
+    Returns:
+        socket: The listening socket
+    """
+    listen_socket = socket(AF_INET, SOCK_STREAM)
+    listen_socket.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+    if reuse_port:
+        listen_socket.setsockopt(SOL_SOCKET, SO_REUSEPORT, 1)
+    listen_socket.bind(('', server_port))
+    listen_socket.listen(max(128, backlog))
+    return listen_socket
+
+
+class PreforkMaster:
+    """
+    Runs N asyncio worker processes that all accept connections on the same port,
+    so throughput scales with the number of cores instead of being capped by one
+    interpreter's GIL.
+
+    Workers either share the master's listening socket (inherited across fork) or,
+    with reuse_port, each bind their own socket with SO_REUSEPORT and let the kernel
+    spread connections between them. Each worker sends its stats to the master over
+    a pipe, and the master prints the totals.
+
+    A worker that exits unexpectedly is replaced. If it exits within FAST_FAILURE
+    seconds of starting (a bad setting, a port it can't bind), the replacement
+    waits, twice as long after each failure in a row, and after MAX_FAST_FAILURES
+    of them its slot is left empty instead of forking workers that die at once.
+
+    Signals:
+        SIGHUP:          graceful reload - start a new set of workers, then stop the old ones
+        SIGTERM/SIGINT:  graceful shutdown of all workers, then exit
+    """
+
+    def __init__(self, server_port, workers, max_connections, stats_interval, reuse_port, verbose):
+        self.server_port = server_port
+        self.num_workers = workers
+        self.max_connections = max_connections
+        self.stats_interval = stats_interval
+        self.reuse_port = reuse_port
+        self.verbose = verbose
+        self.listen_socket = None
+        self.workers = {}       # pid -> worker record
+        self.respawns = {}      # slot -> time.monotonic() at which to start its replacement worker
+        self.fast_failures = [0] * workers  # Fast failures in a row, per slot
+        self.retired_exports = []  # Final stats of workers that have exited
+        self.stats = ServerStats()
+        self.selector = selectors.DefaultSelector()
+        self.reload_requested = False
+        self.stop_requested = False
+        self.exit_status = 0
+
+    def spawn_worker(self, slot):
+        """
+        Forks one worker process and starts listening to its stats pipe.
+
+        Args:
+            slot (int): Which of the num_workers workers it is
+        """
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            self.selector.close()
+            for worker in self.workers.values():
+                os.close(worker["stats_fd"])  # Not this worker's business
+            run_worker(self.listen_socket, self.server_port, self.max_connections, write_fd, self.verbose)
+        os.close(write_fd)
+        os.set_blocking(read_fd, False)
+        self.workers[pid] = {"stats_fd": read_fd, "buffer": b"", "export": None, "retiring": False,
+                             "slot": slot, "started": time.monotonic()}
+        self.selector.register(read_fd, selectors.EVENT_READ, pid)
+        print(f"[MASTER] Started worker {pid}")
+
+    def read_stats(self, pid):
+        """Reads whatever stats lines a worker has sent and keeps the latest one."""
+        worker = self.workers[pid]
+        try:
+            data = os.read(worker["stats_fd"], 65536)
+        except BlockingIOError:
+            return
+        worker["buffer"] += data
+        *lines, worker["buffer"] = worker["buffer"].split(b"\n")
+        if lines:
+            worker["export"] = json.loads(lines[-1])
+
+    def reap_workers(self):
+        """Collects exited workers, keeps their final stats and replaces unexpected exits."""
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if pid not in self.workers:
+                continue
+            # Drain the pipe: the worker's final totals were written just before it exited
+            self.read_stats(pid)
+            worker = self.workers.pop(pid)
+            self.selector.unregister(worker["stats_fd"])
+            os.close(worker["stats_fd"])
+            if worker["export"]:
+                # Exited workers no longer hold connections open
+                worker["export"].update(active_connections=0, waiting_connections=0)
+                self.retired_exports.append(worker["export"])
+            print(f"[MASTER] Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}")
+            if not worker["retiring"] and not self.stop_requested:
+                self.schedule_respawn(worker)
+
+    def schedule_respawn(self, worker):
+        """
+        Replaces a worker that exited unexpectedly: at once if it had been running
+        a while, after a growing delay if it failed fast, or not at all once its
+        slot has failed fast MAX_FAST_FAILURES times in a row.
+        """
+        slot = worker["slot"]
+        if time.monotonic() - worker["started"] >= FAST_FAILURE:
+            self.fast_failures[slot] = 0
+            self.spawn_worker(slot)
+            return
+        self.fast_failures[slot] += 1
+        if self.fast_failures[slot] >= MAX_FAST_FAILURES:
+            print(f"[MASTER] Worker slot {slot} failed {self.fast_failures[slot]} times in a row right after "
+                  f"starting; leaving it empty (SIGHUP tries again)")
+            return
+        delay = min(MAX_RESPAWN_DELAY, RESPAWN_DELAY * 2 ** (self.fast_failures[slot] - 1))
+        print(f"[MASTER] Worker slot {slot} failed right after starting; restarting it in {delay:g} s")
+        self.respawns[slot] = time.monotonic() + delay
+
+    def spawn_due(self):
+        """Starts the replacement workers whose delay is up."""
+        now = time.monotonic()
+        for slot, when in list(self.respawns.items()):
+            if when <= now:
+                del self.respawns[slot]
+                self.spawn_worker(slot)
+
+    def reload(self):
+        """Starts a fresh set of workers, then asks the old ones to finish up and exit."""
+        print("[MASTER] Reloading workers...")
+        old_pids = list(self.workers)
+        self.respawns.clear()
+        self.fast_failures = [0] * self.num_workers  # A reload gives every slot a fresh start
+        for slot in range(self.num_workers):
+            self.spawn_worker(slot)
+        for pid in old_pids:
+            self.workers[pid]["retiring"] = True
+            os.kill(pid, signal.SIGTERM)
+
+    def report(self):
+        """Prints the stats of all workers added together."""
+        exports = self.retired_exports + [w["export"] for w in self.workers.values() if w["export"]]
+        self.stats.load_totals(exports)
+        per_worker = " ".join(f"{pid}:{w['export']['requests'] if w['export'] else 0}"
+                              for pid, w in self.workers.items())
+        print(f"{format_stats(self.stats.snapshot())} workers={len(self.workers)} per_worker=[{per_worker}]")
+
+    def run(self):
+        """
+        Starts the workers and supervises them until asked to stop.
+
+        Returns:
+            int: The exit status: 1 if every worker slot was given up on, otherwise 0
+        """
+        if not self.reuse_port:
+            self.listen_socket = create_listening_socket(self.server_port, self.max_connections)
+        signal.signal(signal.SIGHUP, lambda signum, frame: setattr(self, 'reload_requested', True))
+        signal.signal(signal.SIGTERM, lambda signum, frame: setattr(self, 'stop_requested', True))
+        signal.signal(signal.SIGINT, lambda signum, frame: setattr(self, 'stop_requested', True))
+
+        for slot in range(self.num_workers):
+            self.spawn_worker(slot)
+        print(f"The server is ready to receive messages ({self.num_workers} workers, "
+              f"{'SO_REUSEPORT' if self.reuse_port else 'shared listening socket'})")
+
+        next_report = time.monotonic() + self.stats_interval
+        while not self.stop_requested:
+            for key, _ in self.selector.select(timeout=0.2):
+                self.read_stats(key.data)
+            self.reap_workers()
+            self.spawn_due()
+            if self.reload_requested:
+                self.reload_requested = False
+                self.reload()
+            if self.stats_interval > 0 and time.monotonic() >= next_report:
+                next_report += self.stats_interval
+                self.report()
+            if not self.workers and not self.respawns:
+                print("[MASTER] Every worker slot failed; exiting")
+                self.stop_requested = True
+                self.exit_status = 1
+
+        # Graceful shutdown: let every worker finish its in-flight requests
+        print("[MASTER] Stopping workers...")
+        for pid in self.workers:
+            os.kill(pid, signal.SIGTERM)
+        while self.workers:
+            for key, _ in self.selector.select(timeout=0.2):
+                self.read_stats(key.data)
+            self.reap_workers()
+        if self.listen_socket:
+            self.listen_socket.close()
+        self.report()
+        return self.exit_status
+
+
+def parse_args():
+    """
+    Parses the command line options for choosing and tuning the serving mode.
+
+    Returns:
+        argparse.Namespace: The parsed options
+    """
+    parser = argparse.ArgumentParser(description="Variable-length message uppercase server")
+    parser.add_argument('--port', type=int, default=12000,
+                        help="port to listen on (default: 12000)")
+    parser.add_argument('--mode', choices=['sequential', 'async'], default='sequential',
+                        help="serve one client at a time, or many at once on an asyncio event loop")
+    parser.add_argument('--max-connections', type=int, default=1000,
+                        help="asyncio mode: maximum connections served at the same time (default: 1000)")
+    parser.add_argument('--stats-interval', type=float, default=10.0,
+                        help="asyncio mode: seconds between stats reports, 0 disables them (default: 10)")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="run N asyncio worker processes sharing the port (implies asyncio mode); "
+                             "SIGHUP reloads them gracefully")
+    parser.add_argument('--reuseport', action='store_true',
+                        help="--workers: give each worker its own SO_REUSEPORT socket instead of "
+                             "sharing the master's listening socket")
+    parser.add_argument('--verbose', action='store_true',
+                        help="asyncio mode: print per-message lines like the sequential server")
+    return parser.parse_args()
+
+
 def main():
     """
     Main function to set up the server and listen for clients.
     Creates a TCP socket, binds it to a port, and continuously accepts client connections.
     """
+    args = parse_args()
+
+    if args.workers > 0:
+        if not hasattr(os, 'fork'):
+            print("Error: --workers needs os.fork(), which this platform does not have.")
+            return
+        sys.exit(PreforkMaster(args.port, args.workers, args.max_connections, args.stats_interval,
+                               args.reuseport, args.verbose).run())
+
+    if args.mode == 'async':
+        try:
+            asyncio.run(run_async_server(args.port, args.max_connections, args.stats_interval, args.verbose))
+        except KeyboardInterrupt:
+            pass
+        return
+
     # Server configuration
-    server_port = 12000  # Port number for the server
+    server_port = args.port  # Port number for the server
     bufsize = 64  # Maximum size of each receive operation, as required by assignment
 
     # Create and configure the server socket
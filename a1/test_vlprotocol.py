@@ -0,0 +1,96 @@
+# test_vlprotocol.py
+# Tests for the framing helpers in vlprotocol.py, run with:
+#     python -m unittest test_vlprotocol      (or python -m pytest)
+# FrameReader is fed through a socket pair, so it reads from a real socket.
+
+import socket
+import struct
+import unittest
+
+from vlprotocol import (LEGACY, MAX_WIDE_PAYLOAD, REFUSED, WIDE, WIDE_VERSION, FrameReader, choose_version,
+                        decode_length, encode_frame, hello)
+
+
+class FramingTest(unittest.TestCase):
+    def test_legacy_frame_has_two_digit_length(self):
+        self.assertEqual(encode_frame(b'hello', LEGACY), b'05hello')
+
+    def test_legacy_frame_refuses_more_than_99_bytes(self):
+        with self.assertRaises(ValueError):
+            encode_frame(b'x' * 100, LEGACY)
+
+    def test_wide_frame_has_four_byte_length(self):
+        self.assertEqual(encode_frame(b'hello', WIDE), b'\x00\x00\x00\x05hello')
+
+    def test_decode_length(self):
+        self.assertEqual(decode_length(b'42', LEGACY), 42)
+        self.assertEqual(decode_length(struct.pack('!I', 70000), WIDE), 70000)
+
+    def test_decode_length_rejects_malformed_and_oversized_headers(self):
+        for header, mode in ((b'ab', LEGACY), (b'-5', LEGACY), (struct.pack('!I', MAX_WIDE_PAYLOAD + 1), WIDE)):
+            with self.subTest(header=header):
+                with self.assertRaises(ValueError):
+                    decode_length(header, mode)
+
+    def test_choose_version(self):
+        self.assertEqual(choose_version(WIDE_VERSION + 5), WIDE_VERSION)
+        self.assertEqual(choose_version(1), 1)
+        self.assertEqual(choose_version(0), REFUSED)
+        self.assertEqual(hello(1), b'#W\x01')
+
+
+class FrameReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.sender, receiver = socket.socketpair()
+        self.addCleanup(self.sender.close)
+        self.addCleanup(receiver.close)
+        self.reader = FrameReader(receiver, read_size=64)
+
+    def test_reads_a_legacy_frame(self):
+        self.sender.sendall(encode_frame(b'hello', LEGACY))
+        self.assertEqual(bytes(self.reader.read_frame(LEGACY)), b'hello')
+
+    def test_pipelined_frames_need_one_receive(self):
+        self.sender.sendall(b''.join(encode_frame(b'msg%d' % i, WIDE) for i in range(5)))
+        frames = [bytes(self.reader.read_frame(WIDE)) for _ in range(5)]
+        self.assertEqual(frames, [b'msg%d' % i for i in range(5)])
+        self.assertEqual(self.reader.recv_calls, 1)
+
+    def test_frame_split_across_sends(self):
+        frame = encode_frame(b'abcdefgh', WIDE)
+        self.sender.sendall(frame[:3])
+        self.sender.sendall(frame[3:6])
+        self.sender.sendall(frame[6:])
+        self.assertEqual(bytes(self.reader.read_frame(WIDE)), b'abcdefgh')
+
+    def test_grows_for_a_frame_larger_than_its_buffer(self):
+        payload = bytes(range(256)) * 40
+        self.sender.sendall(encode_frame(payload, WIDE) + encode_frame(b'next', WIDE))
+        self.assertEqual(bytes(self.reader.read_frame(WIDE)), payload)
+        self.assertEqual(bytes(self.reader.read_frame(WIDE)), b'next')
+
+    def test_peek_does_not_consume(self):
+        self.sender.sendall(b'#W\x01')
+        self.assertEqual(bytes(self.reader.peek(2)), b'#W')
+        self.assertEqual(bytes(self.reader.read_exact(3)), b'#W\x01')
+
+    def test_close_between_frames_returns_none(self):
+        self.sender.sendall(encode_frame(b'last', LEGACY))
+        self.sender.close()
+        self.assertEqual(bytes(self.reader.read_frame(LEGACY)), b'last')
+        self.assertIsNone(self.reader.read_frame(LEGACY))
+
+    def test_close_inside_a_frame_raises(self):
+        self.sender.sendall(encode_frame(b'truncated', WIDE)[:7])
+        self.sender.close()
+        with self.assertRaises(ConnectionError):
+            self.reader.read_frame(WIDE)
+
+    def test_malformed_header_raises(self):
+        self.sender.sendall(b'xxhello')
+        with self.assertRaises(ValueError):
+            self.reader.read_frame(LEGACY)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,280 @@
+# vlprotocol.py
+# Framing helpers shared by myvlclient.py and myvlserver.py.
+# Two framing modes are supported on the same port:
+#   - legacy: the length is sent as a 2-character ASCII number ("05hello"),
+#             which caps each message at 99 bytes
+#   - wide:   the length is sent as a 4-byte big-endian unsigned integer,
+#             which allows messages of up to MAX_WIDE_PAYLOAD bytes
+# A client that wants wide framing opens the connection with a 3-byte hello
+# (HELLO_MAGIC followed by the highest version it speaks). Legacy messages
+# always start with two ASCII digits, so the server can tell the two apart
+# from the first 2 bytes it receives and old clients keep working unchanged.
+# The server answers the hello with HELLO_MAGIC and the version it picked,
+# or version 0 to ask the client to stay on legacy framing.
+# FrameReader is the receive path both sides use on blocking sockets.
+
+import struct
+
+LEGACY = 'legacy'
+WIDE = 'wide'
+
+LEGACY_HEADER_LEN = 2
+LEGACY_MAX_PAYLOAD = 99
+
+WIDE_HEADER = struct.Struct('!I')  # Big-endian unsigned 32-bit length
+MAX_WIDE_PAYLOAD = 64 * 1024 * 1024  # Refuse anything larger to bound memory per connection
+WIDE_BUFSIZE = 64 * 1024  # Receive size for wide frames; 64-byte reads would crawl through megabytes
+
+HELLO_MAGIC = b'#W'  # Can never be mistaken for a 2-digit legacy length
+WIDE_VERSION = 1  # Highest wide framing version this code speaks
+REFUSED = 0  # Version sent back by a server that wants the client to stay on legacy framing
+HELLO_LEN = len(HELLO_MAGIC) + 1
+
+
+def header_len(mode):
+    """
+    Returns the size of the length prefix for a framing mode.
+
+    Args:
+        mode: LEGACY or WIDE
+
+    Returns:
+        int: Number of header bytes in front of every message
+    """
+    return WIDE_HEADER.size if mode == WIDE else LEGACY_HEADER_LEN
+
+
+def encode_frame(payload, mode):
+    """
+    Prefixes a payload with its length in the given framing mode.
+
+    Args:
+        payload: The message bytes
+        mode: LEGACY or WIDE
+
+    Returns:
+        bytes: The length prefix followed by the payload
+
+    Raises:
+        ValueError: If the payload is too long for the framing mode
+    """
+    if mode == WIDE:
+        if len(payload) > MAX_WIDE_PAYLOAD:
+            raise ValueError(f"Message of {len(payload)} bytes exceeds the {MAX_WIDE_PAYLOAD}-byte limit.")
+        return WIDE_HEADER.pack(len(payload)) + payload
+    if len(payload) > LEGACY_MAX_PAYLOAD:
+        raise ValueError(f"Message of {len(payload)} bytes does not fit a 2-digit length prefix.")
+    # Format the length to be a 2-digit string with leading zero if needed
+    return f"{len(payload):02d}".encode() + payload
+
+
+def decode_length(header, mode):
+    """
+    Parses a length prefix.
+
+    Args:
+        header: The header bytes, header_len(mode) long
+        mode: LEGACY or WIDE
+
+    Returns:
+        int: The length of the message that follows
+
+    Raises:
+        ValueError: If the header is malformed or announces an oversized message
+    """
+    if mode == WIDE:
+        (length,) = WIDE_HEADER.unpack(header)
+        if length > MAX_WIDE_PAYLOAD:
+            raise ValueError(f"Announced message of {length} bytes exceeds the {MAX_WIDE_PAYLOAD}-byte limit.")
+        return length
+    length = int(bytes(header).decode())
+    if length < 0:
+        raise ValueError(f"Received negative message length {length}.")
+    return length
+
+
+def hello(version=WIDE_VERSION):
+    """
+    Builds the hello a client sends (or the answer a server sends back).
+
+    Args:
+        version: The wide framing version being requested or accepted
+
+    Returns:
+        bytes: HELLO_MAGIC followed by the version byte
+    """
+    return HELLO_MAGIC + bytes([version])
+
+
+def choose_version(requested):
+    """
+    Picks the wide framing version a server answers a hello with.
+
+    Args:
+        requested: The version byte sent by the client
+
+    Returns:
+        int: The highest version both sides speak, or REFUSED
+    """
+    return min(requested, WIDE_VERSION) if requested >= 1 else REFUSED
+
+
+def recv_exact(sock, n, bufsize):
+    """
+    Receives exactly n bytes from a blocking socket.
+
+    Args:
+        sock: The connected socket
+        n: Number of bytes to receive
+        bufsize: Maximum size of each receive operation
+
+    Returns:
+        bytes: The n bytes, or b'' if the peer closed the connection before sending anything
+
+    Raises:
+        ConnectionError: If the peer disconnects partway through
+    """
+    chunks = []
+    bytes_received = 0
+    while bytes_received < n:
+        chunk = sock.recv(min(n - bytes_received, bufsize))
+        if not chunk:
+            if bytes_received == 0:
+                return b''
+            raise ConnectionError("Peer disconnected during message transfer.")
+        chunks.append(chunk)
+        bytes_received += len(chunk)
+    return b''.join(chunks)
+
+
+class FrameReader:
+    """
+    Buffered reader for length-prefixed frames on a blocking socket.
+    Bytes are received with recv_into() straight into one reusable bytearray,
+    which only grows when a frame does not fit, and frames are handed out as
+    memoryview slices of that buffer instead of being copied into new bytes
+    objects. A single recv_into() may pick up several pipelined frames at once.
+
+    The memoryviews returned by read_exact() and read_frame() point into the
+    internal buffer and are only valid until the next call on the reader;
+    decode or copy them before reading again.
+    """
+    DEFAULT_READ_SIZE = 64 * 1024
+
+    def __init__(self, sock, read_size=DEFAULT_READ_SIZE):
+        """
+        Args:
+            sock: The connected blocking socket to read from
+            read_size: Maximum number of bytes requested from each recv_into() call
+        """
+        self.sock = sock
+        self.read_size = read_size
+        self.buffer = bytearray(read_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # Index of the first byte not yet handed out
+        self.end = 0    # Index one past the last byte received
+        self.recv_calls = 0  # Number of receive system calls made, for benchmarking
+
+    def _make_room(self, n):
+        """
+        Ensures n bytes starting at self.start fit in the buffer, by moving the
+        unread bytes to the front or, if the buffer is too small, growing it.
+        """
+        available = self.end - self.start
+        if self.start + n <= len(self.buffer):
+            return
+        if n <= len(self.buffer):
+            # Compact: the unread tail is usually a partial header, so this copy is tiny
+            self.buffer[:available] = bytes(self.view[self.start:self.end])
+        else:
+            # Grow: at least double so a stream of growing frames costs O(log n) resizes.
+            # Views handed out earlier keep the old buffer alive, so they stay readable.
+            new_buffer = bytearray(max(n, 2 * len(self.buffer)))
+            new_buffer[:available] = self.view[self.start:self.end]
+            self.buffer = new_buffer
+            self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = available
+
+    def _fill(self, n):
+        """
+        Receives until at least n unread bytes are buffered.
+
+        Returns:
+            bool: False if the peer closed the connection before sending anything more
+
+        Raises:
+            ConnectionError: If the peer disconnects partway through
+        """
+        if self.end - self.start >= n:
+            return True
+        self._make_room(n)
+        while self.end - self.start < n:
+            # Ask for at least the rest of the frame so large frames arrive in as few
+            # calls as the kernel allows, and at most what the buffer has room for
+            missing = n - (self.end - self.start)
+            space = len(self.buffer) - self.end
+            received = self.sock.recv_into(self.view[self.end:], min(space, max(missing, self.read_size)))
+            self.recv_calls += 1
+            if received == 0:
+                if self.end == self.start:
+                    return False
+                raise ConnectionError("Peer disconnected during message transfer.")
+            self.end += received
+        return True
+
+    def peek(self, n):
+        """
+        Returns the next n bytes without consuming them.
+
+        Args:
+            n: Number of bytes to look at
+
+        Returns:
+            memoryview: The bytes, or an empty view if the peer closed the connection first
+        """
+        if not self._fill(n):
+            return self.view[0:0]
+        return self.view[self.start:self.start + n]
+
+    def read_exact(self, n):
+        """
+        Consumes and returns exactly n bytes.
+
+        Args:
+            n: Number of bytes to read
+
+        Returns:
+            memoryview: The bytes, or an empty view if the peer closed the connection first
+
+        Raises:
+            ConnectionError: If the peer disconnects partway through
+        """
+        if n == 0 or not self._fill(n):
+            return self.view[0:0]
+        data = self.view[self.start:self.start + n]
+        self.start += n
+        return data
+
+    def read_frame(self, mode):
+        """
+        Reads one length-prefixed frame.
+
+        Args:
+            mode: LEGACY or WIDE
+
+        Returns:
+            memoryview: The payload, or None if the peer closed the connection between frames
+
+        Raises:
+            ConnectionError: If the peer disconnects partway through
+            ValueError: If the length prefix is malformed or too large
+        """
+        header = self.read_exact(header_len(mode))
+        if not header:
+            return None
+        length = decode_length(header, mode)
+        payload = self.read_exact(length)
+        if len(payload) < length:
+            raise ConnectionError("Peer disconnected during message transfer.")
+        return payload
@@ -0,0 +1,230 @@
+# chatclient.py
+# Headless asyncio chat client, usable as a library by bots and test harnesses
+# and by "python mychatclient.py --async".
+#
+#     async with ChatClient('127.0.0.1', 12345) as client:
+#         await client.send("hello")
+#         async for message in client.messages():
+#             print(message)
+#
+# It speaks the CHAT/2 line protocol (see chatprotocol.py) with the seq option, so
+# it knows the sequence number of the last message it received. When the connection
+# drops it reconnects with jittered exponential backoff and asks the server to resume
+# after that message, so nothing is missed as long as the server still has it in its
+# history. Lines sent while the previous write was in progress are coalesced into one
+# write, so a burst of messages costs one system call instead of one per line.
+# Thousands of clients can share one event loop; none of them needs a thread.
+
+import asyncio
+import collections
+import random
+
+from chatprotocol import LineParser, encode_line, make_hello, parse_hello, split_seq
+
+HOST = '127.0.0.1'
+PORT = 12345
+READ_SIZE = 64 * 1024
+HELLO_TIMEOUT = 5.0        # Seconds to wait for the server to answer the hello
+BACKOFF_INITIAL = 0.1      # Upper bound of the first reconnect delay, in seconds
+BACKOFF_MAX = 10.0         # Largest upper bound the delay grows to
+OUTBOUND_LIMIT = 1024      # Unsent lines queued before send() waits
+
+
+class ChatClient:
+    """
+    A chat connection that survives disconnects.
+
+    send() queues a message and returns at once (it only waits when OUTBOUND_LIMIT
+    messages are already queued); messages() yields every message received, in
+    order, until the client is closed. Messages sent while disconnected are kept
+    and sent after reconnecting.
+    """
+
+    def __init__(self, host=HOST, port=PORT, reconnect=True,
+                 backoff_initial=BACKOFF_INITIAL, backoff_max=BACKOFF_MAX, inbox_size=0):
+        """
+        Args:
+            host: The server's hostname or IP address
+            port: The server's port
+            reconnect: Whether to reconnect after the connection is lost
+            backoff_initial: Upper bound of the first reconnect delay, in seconds
+            backoff_max: Largest upper bound of the reconnect delay, in seconds
+            inbox_size: Received messages buffered before the client stops reading
+                        from the server (0 for no limit)
+        """
+        self.host = host
+        self.port = port
+        self.reconnect = reconnect
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.last_seq = 0         # Sequence number of the newest message received
+        self.reconnects = 0       # Times the connection was re-established
+        self.connected = asyncio.Event()
+        self._writer = None
+        self._outbound = collections.deque()
+        self._has_outbound = asyncio.Event()
+        self._has_room = asyncio.Event()
+        self._has_room.set()
+        self._inbox = asyncio.Queue(inbox_size)
+        self._ended = False       # No more messages will be received
+        self._closing = False
+        self._task = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def connect(self):
+        """
+        Connects to the server and starts the background task that keeps the
+        connection up.
+
+        Raises:
+            OSError: If the first connection attempt fails
+            ConnectionError: If the server does not speak CHAT/2
+        """
+        reader = await self._open()
+        self._task = asyncio.create_task(self._run(reader))
+
+    async def send(self, text):
+        """Queues a message to be sent, waiting only if too many are already queued."""
+        while len(self._outbound) >= OUTBOUND_LIMIT:
+            self._has_room.clear()
+            await self._has_room.wait()
+        self._outbound.append(encode_line(text))
+        self._has_outbound.set()
+
+    async def messages(self):
+        """Yields each received message as a str until the client is closed."""
+        while not (self._ended and self._inbox.empty()):
+            message = await self._inbox.get()
+            if message is None:
+                return
+            yield message
+
+    async def close(self):
+        """Sends what is still queued, says goodbye to the server and disconnects."""
+        if self._closing:
+            return
+        self._closing = True
+        if self.connected.is_set() and self._writer is not None:
+            self._outbound.append(encode_line('exit'))
+            try:
+                self._write_queued()
+                await self._writer.drain()
+            except (ConnectionError, RuntimeError):
+                pass
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._disconnect()
+        self._end_messages()
+
+    async def _open(self):
+        """
+        Opens a connection and negotiates CHAT/2, asking to resume after the
+        last message received.
+
+        Returns:
+            asyncio.StreamReader: The reader, positioned after the server's answer
+        """
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        options = ['seq']
+        if self.last_seq:
+            options.append(f"resume={self.last_seq}")
+        writer.write(make_hello(*options))
+        try:
+            line = await asyncio.wait_for(reader.readline(), HELLO_TIMEOUT)
+        except (asyncio.TimeoutError, ValueError):
+            line = b''
+        answer = parse_hello(line.rstrip(b'\n'))
+        if answer is None or 'OK' not in answer:
+            writer.close()
+            raise ConnectionError(f"{self.host}:{self.port} did not accept the CHAT/2 protocol.")
+        self._writer = writer
+        self.connected.set()
+        return reader
+
+    def _end_messages(self):
+        """
+        Makes messages() stop once it has yielded what is already in the inbox.
+        The None it waits for only goes in if there is room; a full inbox can't be
+        waited on, and messages() sees _ended when it has emptied it.
+        """
+        self._ended = True
+        if not self._inbox.full():
+            self._inbox.put_nowait(None)
+
+    def _disconnect(self):
+        self.connected.clear()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    async def _run(self, reader):
+        """Keeps the client connected: serves each connection, then reconnects with backoff."""
+        attempt = 0
+        while True:
+            if reader is not None:
+                attempt = 0
+                sender = asyncio.create_task(self._send_loop())
+                try:
+                    await self._receive_loop(reader)
+                except (ConnectionError, ValueError):
+                    pass
+                finally:
+                    sender.cancel()
+                    self._disconnect()
+                reader = None
+            if self._closing or not self.reconnect:
+                self._end_messages()
+                return
+
+            # Full jitter: a random delay up to an exponentially growing bound, so
+            # clients dropped at the same moment do not all come back at the same moment
+            bound = min(self.backoff_max, self.backoff_initial * 2 ** attempt)
+            await asyncio.sleep(random.uniform(0, bound))
+            attempt += 1
+            try:
+                reader = await self._open()
+                self.reconnects += 1
+            except OSError:
+                pass
+
+    async def _receive_loop(self, reader):
+        """Reads lines until the server closes the connection."""
+        parser = LineParser()
+        while True:
+            data = await reader.read(READ_SIZE)
+            if not data:
+                return
+            for line in parser.feed(data):
+                seq, text = split_seq(line)
+                if seq:
+                    self.last_seq = seq
+                await self._inbox.put(text.decode('utf-8', errors='replace'))
+
+    async def _send_loop(self):
+        """Writes queued lines, coalescing everything queued since the last write."""
+        try:
+            while True:
+                await self._has_outbound.wait()
+                self._write_queued()
+                await self._writer.drain()
+        except (ConnectionError, RuntimeError):
+            self._writer.close()
+
+    def _write_queued(self):
+        """Hands every queued line to the transport in a single write."""
+        batch = list(self._outbound)
+        self._outbound.clear()
+        self._has_outbound.clear()
+        self._has_room.set()
+        if batch:
+            self._writer.writelines(batch)
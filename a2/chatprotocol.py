@@ -0,0 +1,154 @@
+# chatprotocol.py
+# Message framing shared by mychatclient.py and mychatserver.py.
+#
+# The original protocol sends each message as raw bytes and the receiver treats
+# a recv() shorter than BUFSIZE as the end of a message. TCP is free to merge
+# or split sends, so under load messages get glued together or torn apart.
+#
+# The framed protocol (CHAT/2) sends every message as one UTF-8 line ending in
+# "\n", so the receiver can cut the stream into messages no matter how it was
+# split, and a sender can put many messages into a single write.
+#
+# A framed client opens the connection with a hello line that starts with a NUL
+# byte, which nobody can type at the old client's input() prompt:
+#     "\0CHAT/2[ option ...]\n"
+# and the server answers with
+#     "\0CHAT/2 OK[ option ...]\n"
+# Options are single words or key=value pairs; unknown ones are ignored.
+# The server answers with "last=<n>", the sequence number of the newest
+# message it has relayed. Client options:
+#     seq          prefix every message line with its sequence number and a
+#                  space ("42 1234: hi"); server notices use sequence number 0
+#     resume=<n>   replay the retained history after message <n> instead of
+#                  all of it, so a reconnecting client gets exactly what it missed
+# A connection whose first byte is not NUL is an old client, and the server
+# keeps talking the original unframed protocol with it.
+
+HELLO_MARKER = b'\x00'
+PROTOCOL = b'CHAT/2'
+MAX_LINE = 64 * 1024  # Longest message accepted, so a client cannot make us buffer without limit
+
+
+def make_hello(*options, protocol=PROTOCOL):
+    """
+    Builds a hello line (or, with 'OK' as the first option, the server's answer).
+
+    Args:
+        options: Words or key=value strings to include
+        protocol: The protocol name to greet with
+
+    Returns:
+        bytes: The hello line, newline included
+    """
+    return HELLO_MARKER + b' '.join([protocol] + [str(option).encode() for option in options]) + b'\n'
+
+
+def parse_hello(line, protocol=PROTOCOL):
+    """
+    Parses a hello line without its trailing newline.
+
+    Args:
+        line: The first line received on a connection
+        protocol: The protocol name the hello must carry
+
+    Returns:
+        dict: The options (words map to True, key=value pairs to the value string),
+              or None if the line is not a hello for that protocol
+    """
+    if not line.startswith(HELLO_MARKER + protocol):
+        return None
+    options = {}
+    for word in line[len(HELLO_MARKER + protocol):].decode('utf-8', errors='replace').split():
+        key, sep, value = word.partition('=')
+        options[key] = value if sep else True
+    return options
+
+
+def encode_line(text):
+    """
+    Frames one message as a line. Newlines inside the message would end it
+    early, so they are turned into spaces.
+
+    Args:
+        text: The message as a str or UTF-8 bytes
+
+    Returns:
+        bytes: The message followed by "\\n"
+    """
+    if isinstance(text, str):
+        text = text.encode('utf-8')
+    return text.replace(b'\r', b' ').replace(b'\n', b' ') + b'\n'
+
+
+def encode_seq_line(seq, text):
+    """
+    Frames one message as a line prefixed with its sequence number, for
+    clients that asked for the seq option.
+
+    Args:
+        seq: The message's sequence number (0 for notices)
+        text: The message as a str or UTF-8 bytes
+
+    Returns:
+        bytes: "<seq> <message>\\n"
+    """
+    return b'%d ' % seq + encode_line(text)
+
+
+def split_seq(line):
+    """
+    Splits a line received with the seq option into its sequence number and message.
+
+    Args:
+        line: The line without its trailing newline
+
+    Returns:
+        tuple: (seq, message bytes)
+
+    Raises:
+        ValueError: If the line has no sequence number
+    """
+    seq, _, text = line.partition(b' ')
+    return int(seq), text
+
+
+class LineParser:
+    """
+    Incremental parser that turns a stream of received chunks into complete lines.
+    It keeps any partial line until the rest of it arrives, and only scans the
+    bytes it has not looked at before, so feeding it is linear in the input.
+    """
+
+    def __init__(self, max_line=MAX_LINE):
+        self.buffer = bytearray()
+        self.scanned = 0  # Bytes of buffer already known to contain no newline
+        self.max_line = max_line
+
+    def feed(self, data):
+        """
+        Adds received bytes and returns every line they complete.
+
+        Args:
+            data: The bytes just received
+
+        Returns:
+            list[bytes]: Complete lines, without their "\\n", in order
+
+        Raises:
+            ValueError: If a line grows longer than max_line
+        """
+        self.buffer += data
+        lines = []
+        start = 0
+        while True:
+            end = self.buffer.find(b'\n', max(start, self.scanned))
+            if end == -1:
+                break
+            lines.append(bytes(self.buffer[start:end]))
+            start = end + 1
+        if start:
+            del self.buffer[:start]
+        self.scanned = len(self.buffer)
+        if len(self.buffer) > self.max_line:
+            raise ValueError(f"Message longer than {self.max_line} bytes without a newline.")
+        return lines
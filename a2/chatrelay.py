@@ -0,0 +1,192 @@
+# chatrelay.py
+# Relay broker that links several mychatserver.py processes ("shards") into one chat.
+# Each shard owns a subset of the client connections and sends every message its
+# clients type to the broker; the broker numbers it and forwards it to every shard,
+# the sender's included, and each shard delivers it to its own clients.
+# Because the broker numbers every message, all shards see the same messages in the
+# same order with the same sequence numbers, so their room histories match and a
+# client can resume on whichever shard it reconnects to.
+#
+# The broker listens on TCP ("host:port") or on a Unix socket (a path), so shards can
+# run on one machine or on several. Wire protocol, one message per line:
+#     shard -> broker (hello):    "\0RELAY/1 last=<seq>\n"
+#     broker -> shard (answer):   "\0RELAY/1 OK shard=<id> last=<seq>\n"
+#     shard -> broker (publish):  "<sender> <room> <message>\n"
+#     broker -> shards (deliver): "<seq> <shard> <sender> <room> <message>\n"
+# <seq> in the shard's hello is the newest number the shard has used. A shard that
+# lost the broker numbers the messages it delivers by itself meanwhile, so the broker
+# carries on after the highest such number; every shard then keeps one sequence of
+# numbers that only goes up, and a resuming client never mixes up two messages.
+# <sender> is the shard's own id for the client connection, so the shard it came
+# from can skip the sender when delivering.
+#
+# Run it on its own with
+#     python chatrelay.py --listen 127.0.0.1:12400
+# and start each shard with "python mychatserver.py --relay 127.0.0.1:12400", or let
+# "python mychatserver.py --shards N" run a broker and N shards on one machine.
+
+import argparse
+import asyncio
+import socket
+
+from chatprotocol import LineParser, MAX_LINE, encode_line, make_hello, parse_hello
+
+RELAY_PROTOCOL = b'RELAY/1'
+DEFAULT_ADDRESS = '127.0.0.1:12400'
+RELAY_READ_SIZE = 64 * 1024
+MAX_RECORD = MAX_LINE + 256  # A message plus the numbers and room name in front of it
+
+
+def is_unix_address(address):
+    """Tells a Unix socket path from a host:port address."""
+    return '/' in address
+
+
+def split_address(address):
+    """
+    Splits a host:port address.
+
+    Returns:
+        tuple: (host, port)
+
+    Raises:
+        ValueError: If the address has no port
+    """
+    host, sep, port = address.rpartition(':')
+    if not sep:
+        raise ValueError(f"Relay address {address!r} is neither host:port nor a socket path.")
+    return host, int(port)
+
+
+async def open_relay_connection(address):
+    """Connects to a broker at a host:port address or Unix socket path."""
+    if is_unix_address(address):
+        return await asyncio.open_unix_connection(address, limit=MAX_RECORD)
+    host, port = split_address(address)
+    return await asyncio.open_connection(host, port, limit=MAX_RECORD)
+
+
+def encode_publish(sender, room, text):
+    """Builds the line a shard sends to publish one of its clients' messages."""
+    return b'%d %s ' % (sender, room.encode('utf-8')) + encode_line(text)
+
+
+def parse_delivery(line):
+    """
+    Splits a line delivered by the broker.
+
+    Returns:
+        tuple: (seq, shard, sender, room, message bytes)
+
+    Raises:
+        ValueError: If the line is malformed
+    """
+    seq, shard, sender, room, text = line.split(b' ', 4)
+    return int(seq), int(shard), int(sender), room.decode('utf-8'), text
+
+
+class RelayBroker:
+    """
+    Numbers the messages published by the shards and forwards them to every shard.
+    Everything a shard sends in one read is forwarded as one write per shard, so
+    the broker's cost per message stays small however many clients the shards hold.
+    """
+
+    def __init__(self):
+        self.shards = {}  # Shard id -> stream writer
+        self.next_shard = 1
+        self.last_seq = 0
+
+    async def handle_shard(self, reader, writer):
+        """Serves one shard's connection until it goes away."""
+        parser = LineParser(max_line=MAX_RECORD)
+        shard_id = None
+        try:
+            lines = []
+            while not lines:
+                data = await reader.read(RELAY_READ_SIZE)
+                if not data:
+                    return
+                lines = parser.feed(data)
+            options = parse_hello(lines[0], protocol=RELAY_PROTOCOL)
+            if options is None:
+                print("[RELAY] Rejected a connection without a relay hello.")
+                return
+            last = options.get('last')
+            if isinstance(last, str) and last.isdigit():
+                self.last_seq = max(self.last_seq, int(last))
+            shard_id = self.next_shard
+            self.next_shard += 1
+            writer.write(make_hello('OK', f"shard={shard_id}", f"last={self.last_seq}", protocol=RELAY_PROTOCOL))
+            self.shards[shard_id] = writer
+            print(f"[RELAY] Shard {shard_id} joined ({len(self.shards)} connected).")
+            lines = lines[1:]
+
+            while True:
+                if lines:
+                    await self.forward(shard_id, lines)
+                data = await reader.read(RELAY_READ_SIZE)
+                if not data:
+                    return
+                lines = parser.feed(data)
+        except (ConnectionError, ValueError) as e:
+            print(f"[RELAY] Shard {shard_id}: {e}")
+        finally:
+            if shard_id is not None:
+                del self.shards[shard_id]
+                print(f"[RELAY] Shard {shard_id} left ({len(self.shards)} connected).")
+            writer.close()
+
+    async def forward(self, shard_id, lines):
+        """Numbers a batch of published lines and sends it to every shard."""
+        records = []
+        for line in lines:
+            if line.count(b' ') < 2:
+                raise ValueError(f"Malformed publish line {line[:64]!r}.")
+            self.last_seq += 1
+            records.append(b'%d %d %s\n' % (self.last_seq, shard_id, line))
+        batch = b''.join(records)
+        writers = list(self.shards.values())
+        for writer in writers:
+            writer.write(batch)
+        # Wait for slow shards here, which in turn slows down the shards that publish
+        await asyncio.gather(*(writer.drain() for writer in writers), return_exceptions=True)
+
+
+async def run_broker(address=DEFAULT_ADDRESS, sock=None):
+    """
+    Runs a broker until cancelled.
+
+    Args:
+        address: host:port or Unix socket path to listen on
+        sock: An already listening socket to use instead of address
+    """
+    broker = RelayBroker()
+    if sock is not None:
+        if sock.family == getattr(socket, 'AF_UNIX', None):
+            server = await asyncio.start_unix_server(broker.handle_shard, sock=sock, limit=MAX_RECORD)
+        else:
+            server = await asyncio.start_server(broker.handle_shard, sock=sock, limit=MAX_RECORD)
+    elif is_unix_address(address):
+        server = await asyncio.start_unix_server(broker.handle_shard, address, limit=MAX_RECORD)
+    else:
+        host, port = split_address(address)
+        server = await asyncio.start_server(broker.handle_shard, host, port, limit=MAX_RECORD)
+    print(f"[RELAY] Relay broker listening on {address if sock is None else sock.getsockname()}")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Relay broker linking mychatserver.py shards")
+    parser.add_argument('--listen', default=DEFAULT_ADDRESS,
+                        help=f"host:port or Unix socket path to listen on (default: {DEFAULT_ADDRESS})")
+    args = parser.parse_args()
+    try:
+        asyncio.run(run_broker(args.listen))
+    except KeyboardInterrupt:
+        print("\n[RELAY] Broker stopped.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,73 @@
 # mychatclient.py (Corrected Version)
 
+import argparse
+import asyncio
 import socket
+import sys
 import threading
 
+from chatclient import ChatClient
+from chatprotocol import HELLO_MARKER, LineParser, encode_line, make_hello, parse_hello
+
 # --- Configuration ---
 HOST = '127.0.0.1'  # The server's hostname or IP address
-PORT = 12000        # The port used by the server
+PORT = 12345        # The port used by the server
 BUFSIZE = 1024      # Buffer size for receiving data, as per instructions.
+FRAMED_BUFSIZE = 4 * BUFSIZE  # Framed messages end at a newline, so bigger reads are safe
+HELLO_TIMEOUT = 2.0  # Seconds to wait for the server to answer the hello
+
+def negotiate_framing(client_socket):
+    """
+    Asks the server for the CHAT/2 line protocol.
+    An old server never answers the hello (it just relays it to the other
+    clients as a message), so no answer within HELLO_TIMEOUT means compat mode.
+
+    Returns:
+        tuple: (framed, parser, early) - whether the server agreed, the LineParser
+               to keep using, and any messages received while waiting for the answer
+    """
+    client_socket.sendall(make_hello())
+    parser = LineParser()
+    lines = []
+    client_socket.settimeout(HELLO_TIMEOUT)
+    try:
+        while not lines:
+            chunk = client_socket.recv(FRAMED_BUFSIZE)
+            if not chunk or not chunk.startswith(HELLO_MARKER) and not parser.buffer:
+                # An old server relaying someone else's message; show it in compat mode
+                return False, None, [chunk] if chunk else []
+            lines = parser.feed(chunk)
+    except socket.timeout:
+        pass
+    finally:
+        client_socket.settimeout(None)
+    if lines and parse_hello(lines[0]) is not None:
+        return True, parser, lines[1:]
+    return False, None, []
+
+def receive_framed_messages(client_socket, parser, pending):
+    """
+    Receives CHAT/2 lines and prints one message per line, however the
+    server's writes were split or merged on the way.
+    """
+    while True:
+        for line in pending:
+            # Control lines start with a NUL byte and are not chat messages
+            if not line.startswith(HELLO_MARKER):
+                print(line.decode('utf-8', errors='replace'))
+        try:
+            chunk = client_socket.recv(FRAMED_BUFSIZE)
+        except OSError:
+            # The socket was closed by the main thread after typing 'exit'
+            break
+        if not chunk:
+            print("\n[DISCONNECTED] Server connection lost.")
+            return
+        try:
+            pending = parser.feed(chunk)
+        except ValueError as e:
+            print(f"An unexpected error occurred: {e}")
+            break
 
 def receive_messages(client_socket):
     """
@@ -40,25 +101,28 @@ def receive_messages(client_socket):
             print(f"An unexpected error occurred: {e}")
             break
 
-def send_messages(client_socket):
+def send_messages(client_socket, framed):
     """
     This function runs in the main thread and handles sending user input
-    to the server.
+    to the server. With framing, each message goes out as one line.
     """
+    def encode(message):
+        return encode_line(message) if framed else message.encode('utf-8')
+
     print("Connected to chat server. Type 'exit' to leave.")
     while True:
         try:
             message = input()
 
             if message.strip().lower() == 'exit':
-                client_socket.send(message.encode('utf-8'))
+                client_socket.sendall(encode(message))
                 break 
 
-            client_socket.send(message.encode('utf-8'))
+            client_socket.sendall(encode(message))
         
         except (EOFError, KeyboardInterrupt):
             print("\nExiting...")
-            client_socket.send('exit'.encode('utf-8'))
+            client_socket.sendall(encode('exit'))
             break
             
         except Exception as e:
@@ -69,23 +133,93 @@ def send_messages(client_socket):
     print("Disconnected from server")
 
 
+async def run_async_client(host, port):
+    """
+    Async mode: one event loop reads stdin and the socket, with no threads.
+    Lines typed or pasted while the previous write was in progress go out in
+    a single write, and a lost connection is re-established automatically.
+    """
+    loop = asyncio.get_running_loop()
+    stdin = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(stdin), sys.stdin)
+
+    try:
+        client = ChatClient(host, port)
+        await client.connect()
+    except (OSError, ConnectionError) as e:
+        print(f"[ERROR] Could not connect to {host}:{port}: {e}")
+        return
+
+    async def print_messages():
+        async for message in client.messages():
+            print(message)
+
+    printer = asyncio.create_task(print_messages())
+    print("Connected to chat server. Type 'exit' to leave.")
+    while True:
+        line = await stdin.readline()
+        if not line:
+            print("\nExiting...")
+            break
+        message = line.decode('utf-8', errors='replace').rstrip('\r\n')
+        if message.strip().lower() == 'exit':
+            break
+        await client.send(message)
+
+    await client.close()
+    await printer
+    print("Disconnected from server")
+
+
+def parse_args():
+    """
+    Parses command line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Chat client")
+    parser.add_argument('--host', default=HOST, help=f"Server host (default: {HOST})")
+    parser.add_argument('--port', type=int, default=PORT, help=f"Server port (default: {PORT})")
+    parser.add_argument('--legacy', action='store_true',
+                        help="Skip the CHAT/2 hello and use the original unframed protocol")
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help="Use one asyncio event loop instead of threads, and reconnect "
+                             "automatically if the connection is lost")
+    args = parser.parse_args()
+    if args.use_async and args.legacy:
+        parser.error("--async needs the CHAT/2 protocol and cannot be combined with --legacy")
+    return args
+
+
 def start_client():
     """
     Main function to initialize and run the client.
     """
+    args = parse_args()
+    if args.use_async:
+        try:
+            asyncio.run(run_async_client(args.host, args.port))
+        except KeyboardInterrupt:
+            print("\nExiting...")
+        return
+
     client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     try:
-        client_socket.connect((HOST, PORT))
+        client_socket.connect((args.host, args.port))
     except ConnectionRefusedError:
-        print(f"[ERROR] Connection refused. Is the server running on {HOST}:{PORT}?")
+        print(f"[ERROR] Connection refused. Is the server running on {args.host}:{args.port}?")
         return
 
-    receive_thread = threading.Thread(target=receive_messages, args=(client_socket,))
+    framed, parser, pending = (False, None, []) if args.legacy else negotiate_framing(client_socket)
+    if framed:
+        receive_thread = threading.Thread(target=receive_framed_messages, args=(client_socket, parser, pending))
+    else:
+        for message in pending:
+            print(message.decode('utf-8', errors='replace'))
+        receive_thread = threading.Thread(target=receive_messages, args=(client_socket,))
     receive_thread.daemon = True
     receive_thread.start()
 
-    send_messages(client_socket)
+    send_messages(client_socket, framed)
 
 
 if __name__ == "__main__":
-    start_client()
\ No newline at end of file
+    start_client()
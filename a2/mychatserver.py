@@ -1,115 +1,1154 @@
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import math
+import os
+import random
+import signal
 import socket
-import threading
+import sys
+import tempfile
+import time
+from urllib.parse import parse_qsl
 
-# Configuration 
+from chatprotocol import HELLO_MARKER, LineParser, encode_line, encode_seq_line, make_hello, parse_hello
+from chatrelay import (RELAY_PROTOCOL, RELAY_READ_SIZE, MAX_RECORD, encode_publish, open_relay_connection,
+                       parse_delivery, run_broker)
+
+# Configuration
 HOST = '127.0.0.1'  # Localhost
 PORT = 12345        # Port to listen on (non-privileged ports are > 1023)
 BUFSIZE = 1024      # Buffer size for receiving data, as per instructions, set to 1024 bytes.
+BACKLOG = 4096      # Pending connections the kernel may queue, so connection storms are not refused
+# Incoming data buffered per client before the server stops reading from it.
+# Together with the empty-until-used stream buffers this keeps an idle client to a few KB.
+READ_LIMIT = 8 * BUFSIZE
+FRAMED_READ_SIZE = 4 * BUFSIZE  # Framed clients can be read in bigger chunks since lines mark message ends
+
+
+# Slow-consumer handling
+# Every client has a bounded queue of outgoing messages that its own writer task drains.
+# When a client's queue is full, the policy decides what happens to the next message:
+#   drop-oldest: discard the oldest queued message to make room
+#   disconnect:  disconnect the client right away
+#   block:       the sender waits up to BLOCK_TIMEOUT seconds for room, then the client is disconnected
+OUTBOUND_QUEUE_SIZE = 256
+SLOW_CONSUMER_POLICY = 'drop-oldest'
+SLOW_CONSUMER_POLICIES = ('drop-oldest', 'disconnect', 'block')
+BLOCK_TIMEOUT = 1.0
+# Bytes the transport may buffer per client before the writer task waits for the socket.
+# Kept small so a stalled client's backlog shows up in its (bounded) queue instead.
+TRANSPORT_HIGH_WATER = 16 * 1024
+HELLO_WAIT = 0.5  # Seconds a new client has to send the CHAT/2 hello before it is treated as an old client
+
+# Rooms
+# Clients chat in named rooms, managed with /join <room>, /leave [<room>] and /rooms.
+# A client can be in several rooms; what it types goes to the room it joined last.
+DEFAULT_ROOM = 'lobby'  # Every client starts here, so plain chat works as before
+MAX_ROOM_NAME = 64
+
+# History
+# Each room keeps its most recent messages in a fixed-size ring buffer. Framed clients
+# are sent a room's retained history when they connect (lobby) or /join a room, or only
+# what came after a given sequence number if they ask to resume. Catch-up is written in
+# batches of CATCHUP_BATCH messages, and at most CATCHUP_CONCURRENCY clients catch up at
+# once, so a reconnect storm is spread out instead of flooding the event loop.
+HISTORY_SIZE = 256       # Messages kept per room (0 disables history)
+HISTORY_AGE = 3600.0     # Seconds a message is kept (0 keeps messages until they are overwritten)
+HISTORY_SWEEP_INTERVAL = 60.0  # Seconds between sweeps that drop expired history of empty rooms
+CATCHUP_BATCH = 64
+CATCHUP_CONCURRENCY = 32
+
+# Observability
+# Counters are always kept (see ChatStats) and can be read as JSON from a small HTTP
+# endpoint on 127.0.0.1:--admin-port. Printing every relayed message and connection
+# is slow under load, so only a random --log-sample fraction of them is printed.
+LOG_SAMPLE = 1.0
+ADMIN_PORT = None  # Port of the stats endpoint; shards use ADMIN_PORT + 1, + 2, ...
+ADMIN_TIMEOUT = 5.0  # Seconds an admin client has to send its request
+
+# Sharding
+# With --relay, this server is one shard of a bigger chat: it sends its clients' messages
+# to a relay broker (see chatrelay.py), which numbers them and hands them to every shard.
+# --shards N runs a broker and N shard processes sharing one listening socket.
+RELAY_RETRY_DELAY = 1.0  # Seconds between attempts to reach the broker
+RELAY_CONNECT_WAIT = 5.0  # Seconds a starting shard waits for the broker before accepting clients anyway
+
+
+class ChatStats:
+    """
+    Counters for traffic, fan-out and slow consumers. Fan-out latency, the time
+    from a message reaching this server until a copy is handed to a receiver's
+    socket, is kept in a fixed set of log-scale buckets (4 per power of two, in
+    microseconds), so recording it costs the same however long the server runs.
+    """
+    BUCKETS_PER_OCTAVE = 4
+    NUM_BUCKETS = 30 * BUCKETS_PER_OCTAVE  # 1us up to ~18 minutes
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.total_connections = 0     # Clients that have connected since startup
+        self.messages_received = 0     # Lines or messages received from clients, commands included
+        self.bytes_received = 0
+        self.messages_relayed = 0      # Messages received from clients and broadcast
+        self.deliveries_queued = 0     # Copies queued for receiving clients
+        self.deliveries_sent = 0       # Copies handed to receivers' sockets
+        self.bytes_sent = 0
+        self.queued = 0                # Copies currently waiting in outbound queues
+        self.max_queue_depth = 0       # Deepest any single client's queue has been
+        self.dropped = 0               # Copies discarded by the drop-oldest policy
+        self.blocked = 0               # Times a sender had to wait for room (block policy)
+        self.slow_disconnects = 0      # Clients disconnected for not keeping up
+        self.replayed = 0              # History messages sent to catching-up clients
+        self.fanout_buckets = [0] * self.NUM_BUCKETS
+        self.max_fanout = 0.0
+
+    def record_sent(self, entries, byte_count):
+        """
+        Records a batch of copies handed to one receiver's socket.
+
+        Args:
+            entries: The ChatEntry objects sent
+            byte_count: Bytes written for them
+        """
+        self.deliveries_sent += len(entries)
+        self.bytes_sent += byte_count
+        now = time.monotonic()
+        for entry in entries:
+            seconds = now - entry.time
+            if seconds > self.max_fanout:
+                self.max_fanout = seconds
+            micros = seconds * 1_000_000
+            index = int(math.log2(micros) * self.BUCKETS_PER_OCTAVE) + 1 if micros >= 1 else 0
+            self.fanout_buckets[min(index, self.NUM_BUCKETS - 1)] += 1
+
+    def percentile(self, fraction):
+        """
+        Estimates a fan-out latency percentile from the histogram.
+
+        Args:
+            fraction: The percentile as a fraction, e.g. 0.99 for p99
+
+        Returns:
+            float: The upper bound of the matching bucket in seconds, or 0.0 if nothing was sent
+        """
+        total = sum(self.fanout_buckets)
+        if total == 0:
+            return 0.0
+        threshold = fraction * total
+        seen = 0
+        for index, count in enumerate(self.fanout_buckets):
+            seen += count
+            if seen >= threshold:
+                # Bucket i holds latencies below 2 ** (i / BUCKETS_PER_OCTAVE) microseconds
+                upper = 2 ** (index / self.BUCKETS_PER_OCTAVE) / 1_000_000
+                return min(upper, self.max_fanout)
+        return self.max_fanout
+
+    def snapshot(self, top=None):
+        """
+        Returns the counters and current gauges in a JSON-friendly form, as
+        served by the admin endpoint, followed by each connected client's own
+        counters, the most backed-up clients first.
+
+        Args:
+            top: List only this many clients, or None for all of them
+
+        Returns:
+            dict: Counters, gauges, fan-out latency percentiles in seconds and connections
+        """
+        connections = sorted(clients.values(), key=lambda c: (len(c.outbound), c.max_queue_depth), reverse=True)
+        return {
+            "uptime_s": round(time.monotonic() - self.started_at, 3),
+            "connected_clients": len(clients),
+            "total_connections": self.total_connections,
+            "rooms": len(rooms),
+            "last_seq": last_seq,
+            "messages_received": self.messages_received,
+            "bytes_received": self.bytes_received,
+            "messages_relayed": self.messages_relayed,
+            "deliveries_queued": self.deliveries_queued,
+            "deliveries_sent": self.deliveries_sent,
+            "bytes_sent": self.bytes_sent,
+            "queued_now": self.queued,
+            "max_queue_depth": self.max_queue_depth,
+            "dropped": self.dropped,
+            "blocked": self.blocked,
+            "slow_disconnects": self.slow_disconnects,
+            "replayed": self.replayed,
+            "fanout_latency_s": {
+                "p50": round(self.percentile(0.50), 6),
+                "p90": round(self.percentile(0.90), 6),
+                "p99": round(self.percentile(0.99), 6),
+                "max": round(self.max_fanout, 6),
+            },
+            "connections": [connection.snapshot() for connection in connections[:top]],
+        }
+
+    def summary(self):
+        """Returns the counters as one log line."""
+        return (f"received={self.messages_received} relayed={self.messages_relayed} "
+                f"queued_total={self.deliveries_queued} sent={self.deliveries_sent} "
+                f"bytes_in={self.bytes_received} bytes_out={self.bytes_sent} "
+                f"queued_now={self.queued} max_queue_depth={self.max_queue_depth} "
+                f"dropped={self.dropped} blocked={self.blocked} slow_disconnects={self.slow_disconnects} "
+                f"replayed={self.replayed} fanout_p50={self.percentile(0.5) * 1000:.3f}ms "
+                f"fanout_p99={self.percentile(0.99) * 1000:.3f}ms")
+
+
+class ChatEntry:
+    """
+    One message as relayed to clients. Its framed wire forms are built the first
+    time a client needs them and then shared by every receiver and by replays.
+    """
+    __slots__ = ('seq', 'time', 'text', '_line', '_seq_line')
+
+    def __init__(self, seq, text):
+        self.seq = seq              # Sequence number, or 0 for notices that are not kept
+        self.time = time.monotonic()
+        self.text = text            # The formatted message, as sent to old clients
+        self._line = None
+        self._seq_line = None
+
+    def encode(self, framed, sequenced):
+        """Returns the bytes to send to a client speaking the given protocol."""
+        if not framed:
+            return self.text
+        if sequenced:
+            if self._seq_line is None:
+                self._seq_line = encode_seq_line(self.seq, self.text)
+            return self._seq_line
+        if self._line is None:
+            self._line = encode_line(self.text)
+        return self._line
+
+
+class MessageHistory:
+    """
+    A room's recent messages in a ring buffer: a list of HISTORY_SIZE slots
+    allocated once, with the oldest entry overwritten when it is full.
+    Entries are in sequence order, so finding where to resume is a binary search.
+    """
+
+    def __init__(self, size, max_age):
+        self.slots = [None] * size
+        self.max_age = max_age
+        self.first = 0  # Slot of the oldest entry
+        self.count = 0
+
+    def _at(self, i):
+        """Returns the i-th oldest entry."""
+        return self.slots[(self.first + i) % len(self.slots)]
+
+    def append(self, entry):
+        """Adds the newest entry, overwriting the oldest one if the buffer is full."""
+        size = len(self.slots)
+        self.slots[(self.first + self.count) % size] = entry
+        if self.count == size:
+            self.first = (self.first + 1) % size
+        else:
+            self.count += 1
+
+    def expire(self, now):
+        """Drops entries older than max_age seconds."""
+        if not self.max_age:
+            return
+        while self.count and now - self.slots[self.first].time > self.max_age:
+            self.slots[self.first] = None
+            self.first = (self.first + 1) % len(self.slots)
+            self.count -= 1
+
+    def oldest_seq(self):
+        """Returns the sequence number of the oldest retained entry, or None if empty."""
+        return self._at(0).seq if self.count else None
+
+    def since(self, after_seq, upto_seq):
+        """
+        Returns the retained entries with after_seq < seq <= upto_seq, oldest first.
+        """
+        self.expire(time.monotonic())
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._at(middle).seq <= after_seq:
+                low = middle + 1
+            else:
+                high = middle
+        entries = []
+        for i in range(low, self.count):
+            entry = self._at(i)
+            if entry.seq > upto_seq:
+                break
+            entries.append(entry)
+        return entries
+
+
+class ClientConnection:
+    """
+    A connected client: its stream writer and a bounded queue of outgoing messages.
+    Queued messages are shared ChatEntry objects, so a broadcast costs one
+    deque append per receiver. A writer task runs only while the queue has
+    something in it, so idle clients cost no task at all.
+    """
+
+    def __init__(self, writer, addr):
+        self.writer = writer
+        self.addr = addr
+        self.id = next(connection_ids)  # Names the sender in messages passed through the relay
+        self.framed = False      # True if the client speaks the CHAT/2 line protocol
+        self.sequenced = False   # True if the client asked for sequence numbers
+        self.resume_from = 0     # Replay only history after this sequence number
+        # Queued messages are held back while we find out which protocol the client
+        # speaks and while history is being replayed to it, so nothing overtakes them
+        self.held = True
+        self.parser = None       # The client's LineParser, for framed clients
+        self.rooms = {}          # Rooms the client is in, as an insertion-ordered set
+        self.room = None         # The room the client's messages go to
+        self.outbound = collections.deque()
+        self.flush_task = None
+        # This client's share of the counters in ChatStats, so /stats can show which client is slow
+        self.connected_at = time.monotonic()
+        self.messages_in = 0
+        self.bytes_in = 0
+        self.messages_out = 0
+        self.bytes_out = 0
+        self.max_queue_depth = 0
+        self.dropped = 0
+        self.blocked = 0          # Times a sender had to wait for this client's queue (block policy)
+        self.has_room = asyncio.Event()
+        self.has_room.set()
+        writer.transport.set_write_buffer_limits(high=TRANSPORT_HIGH_WATER)
+
+    def is_full(self):
+        return len(self.outbound) >= OUTBOUND_QUEUE_SIZE
+
+    def snapshot(self):
+        """
+        Returns this client's counters in a JSON-friendly form.
+
+        Returns:
+            dict: Who the client is and its traffic, queue and drop counters
+        """
+        return {
+            "id": self.id,
+            "address": f"{self.addr[0]}:{self.addr[1]}",
+            "room": self.room,
+            "framed": self.framed,
+            "connected_s": round(time.monotonic() - self.connected_at, 3),
+            "messages_in": self.messages_in,
+            "bytes_in": self.bytes_in,
+            "messages_out": self.messages_out,
+            "bytes_out": self.bytes_out,
+            "queue_depth": len(self.outbound),
+            "max_queue_depth": self.max_queue_depth,
+            "dropped": self.dropped,
+            "blocked": self.blocked,
+        }
+
+    def offer(self, entry):
+        """
+        Queues a message, applying the slow-consumer policy if the queue is full:
+        drop-oldest makes room, disconnect drops the client. Under the block
+        policy a full queue is left alone for the caller to wait on.
+
+        Returns:
+            bool: False if the caller must await enqueue_when_room() (block policy, queue full)
+        """
+        if not self.is_full() or SLOW_CONSUMER_POLICY == 'drop-oldest':
+            self.enqueue(entry)
+        elif SLOW_CONSUMER_POLICY == 'disconnect':
+            self.disconnect_slow()
+        else:
+            return False
+        return True
+
+    async def enqueue_when_room(self, entry):
+        """Block policy: waits up to BLOCK_TIMEOUT for room, then queues the message or drops the client."""
+        self.blocked += 1
+        stats.blocked += 1
+        try:
+            await asyncio.wait_for(self.has_room.wait(), BLOCK_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.disconnect_slow()
+            return
+        if not self.writer.is_closing():
+            self.enqueue(entry)
+
+    def enqueue(self, message):
+        """
+        Queues a message without waiting. The caller must have checked is_full()
+        or be applying the drop-oldest policy.
+        """
+        if self.is_full():
+            self.outbound.popleft()
+            self.dropped += 1
+            stats.dropped += 1
+            stats.queued -= 1
+        self.outbound.append(message)
+        stats.deliveries_queued += 1
+        stats.queued += 1
+        if len(self.outbound) > self.max_queue_depth:
+            self.max_queue_depth = len(self.outbound)
+            if self.max_queue_depth > stats.max_queue_depth:
+                stats.max_queue_depth = self.max_queue_depth
+        if self.is_full():
+            if not self.held and self.writer.transport.get_write_buffer_size() < TRANSPORT_HIGH_WATER:
+                # The client keeps up; its writer task just has not had a turn yet because
+                # one burst filled the queue, so write the queue out now instead of dropping
+                self.write_queued()
+            else:
+                self.has_room.clear()
+        if self.flush_task is None and not self.held and self.outbound:
+            self.flush_task = asyncio.create_task(self.flush())
+
+    def release(self):
+        """Starts sending the messages queued while the client was held."""
+        self.held = False
+        if self.outbound and self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush())
+
+    def write_queued(self):
+        """Hands every queued message to the transport in a single write."""
+        entries = list(self.outbound)
+        batch = [entry.encode(self.framed, self.sequenced) for entry in entries]
+        self.outbound.clear()
+        stats.queued -= len(batch)
+        self.has_room.set()
+        self.writer.writelines(batch)
+        byte_count = sum(map(len, batch))
+        self.messages_out += len(batch)
+        self.bytes_out += byte_count
+        stats.record_sent(entries, byte_count)
+
+    async def flush(self):
+        """Writes queued messages out, in batches, until the queue is empty."""
+        try:
+            while self.outbound and not self.held and not self.writer.is_closing():
+                self.write_queued()
+                # Returns at once unless the client is slower than we are
+                await self.writer.drain()
+        except (ConnectionError, RuntimeError):
+            # The client is gone; handle_client notices and removes it
+            self.writer.close()
+        finally:
+            self.flush_task = None
+            if self.writer.is_closing():
+                # Nobody will read these any more; also wake any sender blocked on this client
+                stats.queued -= len(self.outbound)
+                self.outbound.clear()
+                self.has_room.set()
+
+    async def notify(self, text):
+        """Queues a server notice for this client only, under the same slow-consumer policy as messages."""
+        entry = ChatEntry(0, f"* {text}".encode('utf-8'))
+        if not self.writer.is_closing() and not self.offer(entry):
+            await self.enqueue_when_room(entry)
+
+    def disconnect_slow(self):
+        """Drops a client that cannot keep up with the messages sent to it."""
+        stats.slow_disconnects += 1
+        print(f"[SLOW CONSUMER] {self.addr} disconnected with {len(self.outbound)} messages queued.")
+        self.writer.transport.abort()  # close() would wait for the client to read what is already buffered
+
+
+def should_log():
+    """Decides whether to print one per-message or per-connection log line."""
+    return LOG_SAMPLE >= 1.0 or (LOG_SAMPLE > 0.0 and random.random() < LOG_SAMPLE)
+
+
+#  State
+#  the connection of each connected client will be stored, and each room maps to the
+#  set of connections in it, so joining, leaving and disconnecting are O(1) per room
+#  and a broadcast only touches the members of one room.
+#  Every client is served by the same event loop thread, so these need no lock:
+#  nothing else can run between two statements that do not await.
+clients = {}  # Connection id -> connection
+connection_ids = itertools.count(1)
+rooms = {}  # Room name -> set of connections
+histories = {}  # Room name -> MessageHistory, kept a while after the room empties
+last_seq = 0  # Sequence number of the newest message
+catchup_slots = None  # Semaphore limiting concurrent catch-ups, created on the server's loop
+relay = None  # RelayLink when running as a shard
+stats = ChatStats()
+
+
+def record_message(room, text, seq=None):
+    """
+    Numbers a message and adds it to its room's history.
+
+    Args:
+        room: The room the message was sent to
+        text: The formatted message
+        seq: The number the relay broker gave the message, or None to number it here
+
+    Returns:
+        ChatEntry: The entry to broadcast
+    """
+    global last_seq
+    last_seq = last_seq + 1 if seq is None else seq
+    entry = ChatEntry(last_seq, text)
+    if HISTORY_SIZE:
+        history = histories.get(room)
+        if history is None:
+            history = histories[room] = MessageHistory(HISTORY_SIZE, HISTORY_AGE)
+        history.expire(entry.time)
+        history.append(entry)
+    return entry
+
+
+async def catch_up(connection, room, upto_seq):
+    """
+    Replays a room's history to a framed client, from after its resume point up
+    to upto_seq (the newest message when it joined; later ones are in its queue).
+    The client's queue is held meanwhile so live messages cannot overtake the replay.
+    Old clients get no replay, since they cannot tell where one message ends.
+    """
+    history = histories.get(room)
+    if history is None or not connection.framed:
+        return
+    entries = history.since(connection.resume_from, upto_seq)
+    if not entries:
+        return
+    connection.held = True
+    # Messages queued before the replay point (such as the notice answering /join) go first
+    earlier = []
+    while connection.outbound and connection.outbound[0].seq <= upto_seq:
+        earlier.append(connection.outbound.popleft())
+    stats.queued -= len(earlier)
+    entries = earlier + entries
+    try:
+        async with catchup_slots:
+            for start in range(0, len(entries), CATCHUP_BATCH):
+                if connection.writer.is_closing():
+                    break
+                batch = entries[start:start + CATCHUP_BATCH]
+                data = [entry.encode(True, connection.sequenced) for entry in batch]
+                connection.writer.writelines(data)
+                connection.messages_out += len(data)
+                connection.bytes_out += sum(map(len, data))
+                stats.bytes_sent += sum(map(len, data))
+                stats.replayed += sum(1 for entry in batch if entry.seq)
+                # Let the client (and everyone else on the loop) keep up between batches
+                await connection.writer.drain()
+    except (ConnectionError, RuntimeError):
+        connection.writer.close()
+    finally:
+        connection.release()
+
+
+async def sweep_histories():
+    """Periodically drops the history of empty rooms once all of it has expired."""
+    while True:
+        await asyncio.sleep(HISTORY_SWEEP_INTERVAL)
+        now = time.monotonic()
+        for room, history in list(histories.items()):
+            history.expire(now)
+            if not history.count and room not in rooms:
+                del histories[room]
+
+
+def join_room(connection, room):
+    """
+    Adds a client to a room, creating the room if needed, and makes it the client's current room.
+
+    Returns:
+        bool: True if the client was not in the room before
+    """
+    members = rooms.setdefault(room, set())
+    is_new = connection not in members
+    members.add(connection)
+    connection.rooms.pop(room, None)  # Re-insert so it becomes the most recently joined
+    connection.rooms[room] = None
+    connection.room = room
+    return is_new
+
+
+def leave_room(connection, room):
+    """
+    Removes a client from a room, deleting the room once it is empty. If it was
+    the client's current room, the room it joined before that becomes current.
+    """
+    members = rooms.get(room)
+    if members is not None:
+        members.discard(connection)
+        if not members:
+            del rooms[room]
+    connection.rooms.pop(room, None)
+    if connection.room == room:
+        connection.room = next(reversed(connection.rooms), None)
+
+
+async def handle_command(connection, text):
+    """
+    Carries out a room command typed by a client and answers it with a notice.
+
+    Args:
+        connection: The client's ClientConnection
+        text: The message, which starts with '/'
+    """
+    command, _, argument = text.strip().partition(' ')
+    argument = argument.strip()
+    command = command.lower()
+    if command == '/join':
+        if not argument or len(argument) > MAX_ROOM_NAME or any(c.isspace() for c in argument):
+            await connection.notify(f"Usage: /join <room>, with a room name of up to {MAX_ROOM_NAME} characters and no spaces")
+            return
+        is_new = join_room(connection, argument)
+        await connection.notify(f"Joined {argument} ({len(rooms[argument])} members)")
+        if is_new:
+            await catch_up(connection, argument, last_seq)
+    elif command == '/leave':
+        room = argument or connection.room
+        if room not in connection.rooms:
+            await connection.notify(f"You are not in {room}" if room else "You are not in any room")
+            return
+        leave_room(connection, room)
+        current = f"now talking in {connection.room}" if connection.room else "/join a room to keep chatting"
+        await connection.notify(f"Left {room}; {current}")
+    elif command == '/rooms':
+        joined = ', '.join(f"{room} ({len(rooms[room])})" for room in connection.rooms) or "none"
+        await connection.notify(f"Your rooms: {joined}; talking in {connection.room or 'no room'}")
+    else:
+        await connection.notify("Commands: /join <room>, /leave [<room>], /rooms")
+
+
+def format_message(client_port, room, text):
+    """
+    Formats a message as other clients see it. Lobby messages keep the
+    original "port: message" form; other rooms are named in front.
+    """
+    if room == DEFAULT_ROOM:
+        return f"{client_port}: {text}".encode('utf-8')
+    return f"[{room}] {client_port}: {text}".encode('utf-8')
+
+async def publish(connection, room, text):
+    """
+    Sends a client's message to the rest of its room. As a shard, the message
+    goes through the relay broker and is delivered when the broker hands it
+    back; otherwise (or while the broker is unreachable) it is delivered here.
+    """
+    if relay is not None and relay.connected:
+        relay.publish(connection.id, room, text)
+        try:
+            # Returns at once unless the broker is slower than we are
+            await relay.writer.drain()
+            return
+        except ConnectionError:
+            # The broker went away, not the client: deliver the message here instead
+            relay.lost()
+    entry = record_message(room, text)
+    await broadcast(entry, connection, room)
+
+
+class RelayLink:
+    """
+    A shard's connection to the relay broker. Messages published during one pass
+    of the event loop go to the broker in a single write, and every message the
+    broker delivers is numbered, recorded and broadcast to this shard's clients.
+    """
+
+    def __init__(self, address):
+        self.address = address
+        self.writer = None
+        self.connected = False
+        self.ready = asyncio.Event()  # Set the first time the broker answers
+        self.shard_id = None
+        self.pending = []  # Publish lines waiting for the next write
+        self.flush_scheduled = False
+
+    def publish(self, sender, room, text):
+        """Queues a message for the broker, to be written once this pass of the loop is done."""
+        self.pending.append(encode_publish(sender, room, text))
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self.flush)
+
+    def flush(self):
+        self.flush_scheduled = False
+        if self.connected and self.pending:
+            self.writer.writelines(self.pending)
+        self.pending = []
+
+    def lost(self):
+        """
+        Marks the broker as unreachable, so messages are delivered locally until
+        run() has reconnected. Publish lines not written yet are dropped; their
+        senders deliver them locally.
+        """
+        if self.connected:
+            print("[RELAY] Lost the relay broker; delivering locally until it is back.")
+        self.connected = False
+        self.pending = []
+        if self.writer is not None:
+            self.writer.close()
+
+    async def run(self):
+        """Stays connected to the broker, reconnecting whenever the connection is lost."""
+        while True:
+            try:
+                await self.serve()
+            except (OSError, ValueError) as e:
+                print(f"[RELAY] {self.address}: {e}")
+            self.lost()
+            await asyncio.sleep(RELAY_RETRY_DELAY)
+
+    async def serve(self):
+        """Connects to the broker and delivers what it sends until the connection ends."""
+        reader, self.writer = await open_relay_connection(self.address)
+        # The broker numbers messages after the newest one numbered here, including
+        # those delivered locally while it was unreachable
+        hello_seq = last_seq
+        self.writer.write(make_hello(f"last={hello_seq}", protocol=RELAY_PROTOCOL))
+        parser = LineParser(max_line=MAX_RECORD)
+        lines = []
+        while not lines:
+            data = await reader.read(RELAY_READ_SIZE)
+            if not data:
+                return
+            lines = parser.feed(data)
+        options = parse_hello(lines[0], protocol=RELAY_PROTOCOL)
+        if options is None or 'OK' not in options:
+            raise ValueError("Relay broker refused the connection.")
+        if last_seq != hello_seq:
+            # Messages were numbered here during the handshake, which the broker
+            # did not hear about; say hello again with the newest number
+            raise ValueError("Numbered messages locally while connecting; reconnecting.")
+        self.shard_id = int(options['shard'])
+        self.connected = True
+        self.ready.set()
+        print(f"[RELAY] Connected to the relay broker at {self.address} as shard {self.shard_id}.")
+        lines = lines[1:]
+
+        while True:
+            for line in lines:
+                seq, shard_id, sender_id, room, text = parse_delivery(line)
+                entry = record_message(room, text, seq)
+                sender = clients.get(sender_id) if shard_id == self.shard_id else None
+                await broadcast(entry, sender, room)
+            data = await reader.read(RELAY_READ_SIZE)
+            if not data:
+                return
+            lines = parser.feed(data)
+
+
+async def broadcast(entry, sender, room):
+    """
+    Queues a message for every member of a room except the sender.
+    The cost is proportional to the room's size, not the number of clients.
+    Queuing never waits on a client's socket; each client's writer task sends
+    its own queue, so one slow receiver cannot hold up everyone else.
+    Only the block policy makes the sender wait, and only for full queues.
+    Framed clients get the message as a line, old clients get the raw bytes;
+    each form is built once and shared by every receiver.
+    """
+    stats.messages_relayed += 1
+    full = []
+    for client in rooms.get(room, ()):
+        # Don't send the message back to the original sender
+        if client is sender or client.writer.is_closing():
+            continue
+        if not client.offer(entry):
+            full.append(client)
+
+    # Block policy: wait (with a timeout) for each full queue to make room
+    for client in full:
+        await client.enqueue_when_room(entry)
+
 
+async def receive_message(reader, first_chunk=b''):
+    """
+    Receives one message from an old (unframed) client.
+    Chunks are accumulated until a read returns fewer than BUFSIZE bytes,
+    which is taken as the end of the message.
+
+    Args:
+        reader: The client's stream reader
+        first_chunk: Bytes of this message that were already read, if any
+
+    Returns:
+        bytes: The message, or b'' if the client disconnected.
+    """
+    chunks = [first_chunk] if first_chunk else []
+    if first_chunk and len(first_chunk) < BUFSIZE:
+        return first_chunk
+    while True:
+        chunk = await reader.read(BUFSIZE)
+        if not chunk:
+            # If read returns an empty bytes object, the client has disconnected.
+            break
+        chunks.append(chunk)
+        # If the chunk is less than BUFSIZE, assume end of message
+        if len(chunk) < BUFSIZE:
+            break
+    return b''.join(chunks)
 
-#  State 
-#  the socket object will be stored for each connected client.
-clients = []
-# Lock is used to prevent race conditions when multiple threads
-# try to modify the clients list at the same time.
-clients_lock = threading.Lock()
 
-def broadcast(message, sender_conn):
+async def negotiate(reader, connection):
     """
-    Sends a message to all connected clients except the sender.
+    Reads the start of a new connection to tell framed clients from old ones.
+    A framed client sends its hello as soon as it connects, which is answered;
+    an old client may stay silent, so after HELLO_WAIT it is taken to be old.
+    For an old client the bytes read so far are the start of its first message.
+
+    Returns:
+        tuple: (pending, first_chunk) - the framed messages already received
+               after the hello, and the old client's first bytes; (None, b'')
+               if the client left before saying anything.
+
+    Raises:
+        ValueError: If the hello is malformed or too long, or asks to resume from a non-number
     """
-    with clients_lock:
-        for client_conn in clients:
-            # Don't send the message back to the original sender 
-            if client_conn != sender_conn:
-                try:
-                    total_sent = 0
-                    while total_sent < len(message):
-                        sent = client_conn.send(message[total_sent:])
-                        if sent == 0:
-                            raise RuntimeError("Socket connection broken")
-                        total_sent += sent
-                except socket.error:
-                    # If sending fails, assume the client has disconnected.
-                    # Will remove them in the handle_client function.
-                    pass
+    try:
+        first_chunk = await asyncio.wait_for(reader.read(BUFSIZE), HELLO_WAIT)
+    except asyncio.TimeoutError:
+        return [], b''
+    if not first_chunk:
+        return None, b''
+    if not first_chunk.startswith(HELLO_MARKER):
+        return [], first_chunk
+
+    connection.parser = LineParser()
+    lines = connection.parser.feed(first_chunk)
+    while not lines:
+        data = await reader.read(BUFSIZE)
+        if not data:
+            return None, b''
+        lines = connection.parser.feed(data)
+    options = parse_hello(lines[0])
+    if options is None:
+        raise ValueError("Malformed hello.")
+    connection.framed = True
+    connection.sequenced = 'seq' in options
+    if 'resume' in options:
+        connection.resume_from = int(options['resume'])
+    # The answer must be the first thing the client receives
+    connection.writer.write(make_hello('OK', f"last={last_seq}"))
+    return lines[1:], b''
 
 
-def handle_client(conn, addr):
+async def read_messages(reader, connection, pending, first_chunk):
     """
-    This function runs in a dedicated thread for each connected client. 
+    Yields each message a client sends until it disconnects.
+    Framed clients are read in large chunks and cut into lines, so a burst of
+    messages that arrived in one TCP segment is handled in one go.
+    """
+    if not connection.framed:
+        while True:
+            message = await receive_message(reader, first_chunk)
+            first_chunk = b''
+            if not message:
+                return
+            yield message
+
+    while True:
+        for line in pending:
+            if line:
+                yield line
+        data = await reader.read(FRAMED_READ_SIZE)
+        if not data:
+            return
+        pending = connection.parser.feed(data)
+
+
+async def handle_client(reader, writer):
+    """
+    This coroutine runs for each connected client on the server's event loop.
     It handles receiving messages from a client and broadcasting them.
     """
-    print(f"[NEW CONNECTION] {addr} connected.")
+    addr = writer.get_extra_info('peername')
+    if should_log():
+        print(f"[NEW CONNECTION] {addr} connected.")
+    stats.total_connections += 1
     client_port = addr[1] # Get the client's port number
 
-    with clients_lock:
-        clients.append(conn)
+    connection = ClientConnection(writer, addr)
 
     try:
-        while True:
-            # Accumulate chunks until the full message is received
-            chunks = []
-            while True:
-                chunk = conn.recv(BUFSIZE)
-                if not chunk:
-                    # If recv returns an empty bytes object, the client has disconnected.
-                    break
-                chunks.append(chunk)
-                # If the chunk is less than BUFSIZE, assume end of message
-                if len(chunk) < BUFSIZE:
-                    break
-            if not chunks:
-                break
+        # Broadcasts are queued while we find out which protocol the client speaks
+        clients[connection.id] = connection
+        join_room(connection, DEFAULT_ROOM)
+        joined_seq = last_seq
+        pending, first_chunk = await negotiate(reader, connection)
+        if pending is None:
+            return
+        # Send what the client missed, then what was queued for it since it connected
+        await catch_up(connection, DEFAULT_ROOM, joined_seq)
+        connection.release()
 
-            message = b''.join(chunks)
-            decoded_message = message.decode('utf-8')
+        async for message in read_messages(reader, connection, pending, first_chunk):
+            connection.messages_in += 1
+            connection.bytes_in += len(message)
+            stats.messages_received += 1
+            stats.bytes_received += len(message)
+            decoded_message = message.decode('utf-8', errors='replace')
 
-            # Handle the 'exit' command from a client 
+            # Handle the 'exit' command from a client
             if decoded_message.strip().lower() == 'exit':
-                print(f"[{addr}] Sent exit command.")
+                if should_log():
+                    print(f"[{addr}] Sent exit command.")
                 break
 
-            # Format the message to include the sender's port number 
+            if decoded_message.startswith('/'):
+                await handle_command(connection, decoded_message)
+                continue
+            if connection.room is None:
+                await connection.notify("You are not in any room; /join one to chat")
+                continue
+
+            # Format the message to include the sender's port number
             # This is the format required for other clients to see.
-            formatted_message = f"{client_port}: {decoded_message}".encode('utf-8')
-            print(f"[{addr}] Relaying message: {formatted_message.decode('utf-8')}")
+            formatted_message = format_message(client_port, connection.room, decoded_message)
+            if should_log():
+                print(f"[{addr}] Relaying message: {formatted_message.decode('utf-8')}")
 
-            # Broadcast the message to all other clients
-            broadcast(formatted_message, conn)
+            # Keep it in the room's history and broadcast it to the other clients in the room
+            await publish(connection, connection.room, formatted_message)
 
-    except ConnectionResetError:
+    except ConnectionError:
         print(f"[CONNECTION LOST] {addr} disconnected unexpectedly.")
+    except ValueError as e:
+        print(f"[PROTOCOL ERROR] {addr}: {e}")
     finally:
         # This block executes whether the client typed 'exit' or disconnected abruptly.
-        # It ensures the client is properly removed from the server's list.
-        print(f"[DISCONNECTED] {addr} has been removed.")
-        with clients_lock:
-            if conn in clients:
-                clients.remove(conn)
-        conn.close()
+        # It ensures the client is properly removed from the server's list and its rooms.
+        if should_log():
+            print(f"[DISCONNECTED] {addr} has been removed.")
+        for room in list(connection.rooms):
+            leave_room(connection, room)
+        clients.pop(connection.id, None)
+        writer.close()
 
 
-def start_server():
+async def handle_admin(reader, writer):
     """
-    The main function to start the chat server.
+    Answers one HTTP request on the admin port: GET / or /stats returns the
+    server's counters as JSON, and /stats?top=N lists only the N most
+    backed-up connections instead of all of them.
     """
-    # Create a TCP socket 
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.bind((HOST, PORT))
-    server_socket.listen()
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), ADMIN_TIMEOUT)
+        while True:
+            # The headers do not matter; read up to the blank line that ends them
+            header = await asyncio.wait_for(reader.readline(), ADMIN_TIMEOUT)
+            if header in (b'\r\n', b'\n', b''):
+                break
+        parts = request_line.split()
+        path, _, query = parts[1].partition(b'?') if len(parts) > 1 else (b'/', b'', b'')
+        top = dict(parse_qsl(query.decode('latin-1'))).get('top', '')
+        if path in (b'/', b'/stats'):
+            snapshot = stats.snapshot(int(top) if top.isdigit() else None)
+            status, body = '200 OK', json.dumps(snapshot, indent=2).encode() + b'\n'
+        else:
+            status, body = '404 Not Found', b'{"error": "not found"}\n'
+        writer.write(f"HTTP/1.0 {status}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+def raise_file_limit():
+    """
+    Raises this process's open-file limit to the hard limit, since every client
+    connection uses a file descriptor and the default soft limit is often 1024.
+    """
+    try:
+        import resource
+    except ImportError:
+        return  # Not available on Windows
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+
+
+async def run_server(listen_socket=None, relay_address=None, admin_port=None):
+    """
+    Creates the listening socket and serves every client on one event loop.
+
+    Args:
+        listen_socket: An already listening socket to accept on (shards), or None to bind HOST:PORT
+        relay_address: The relay broker to join as a shard, or None to run on its own
+        admin_port: Port for the stats endpoint on 127.0.0.1, or None for no endpoint
+    """
+    global catchup_slots, relay
+    catchup_slots = asyncio.Semaphore(CATCHUP_CONCURRENCY)
+    if relay_address is not None:
+        relay = RelayLink(relay_address)
+        relay_task = asyncio.create_task(relay.run())  # Referenced so the task is not garbage collected
+        # Give the broker a moment, so the first messages are already numbered by it
+        try:
+            await asyncio.wait_for(relay.ready.wait(), RELAY_CONNECT_WAIT)
+        except asyncio.TimeoutError:
+            print(f"[RELAY] No relay broker at {relay_address} yet; delivering locally until it is reachable.")
+    if listen_socket is None:
+        server = await asyncio.start_server(handle_client, HOST, PORT, backlog=BACKLOG, limit=READ_LIMIT)
+    else:
+        server = await asyncio.start_server(handle_client, sock=listen_socket, limit=READ_LIMIT)
     print(f"[LISTENING] Server is listening on {HOST}:{PORT}")
+    if admin_port is not None:
+        admin = await asyncio.start_server(handle_admin, '127.0.0.1', admin_port)  # Closed with the loop
+        print(f"[ADMIN] Stats at http://127.0.0.1:{admin_port}/stats")
+    sweeper = asyncio.create_task(sweep_histories())  # Referenced so the task is not garbage collected
+
+    # The server waits for new clients indefinitely until manually stopped
+    async with server:
+        await server.serve_forever()
+
+
+def run_shard(listen_socket, relay_address, admin_port):
+    """
+    Body of a shard process started by --shards: serves its share of the clients
+    until the master sends SIGTERM, prints its stats and exits.
+    """
+    # Only the master stops shards. SIGINT is ignored explicitly: a Ctrl+C in the
+    # terminal reaches the whole process group, and the master stops the shards
+    # itself, in order. Its inherited disposition can't be relied on anyway; a
+    # server started in the background or under nohup already has it ignored.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        asyncio.run(run_server(listen_socket, relay_address, admin_port))
+    except KeyboardInterrupt:
+        pass
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)  # The master may signal us again
+    print(f"[STATS] shard {os.getpid()}: {stats.summary()}")
+    sys.stdout.flush()
+    os._exit(0)
+
+
+async def serve_shards(pids, relay_path, broker_socket):
+    """
+    Runs the relay broker until SIGINT or SIGTERM, then stops the shards before
+    the broker so none of them sees the broker disappear.
+    """
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    broker = asyncio.create_task(run_broker(relay_path, sock=broker_socket))
+    await stop.wait()
+
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    for pid in pids:
+        await loop.run_in_executor(None, os.waitpid, pid, 0)
+    broker.cancel()
+    try:
+        await broker
+    except asyncio.CancelledError:
+        pass
+
+
+def run_sharded(shards):
+    """
+    Runs a relay broker in this process and forks shard processes that accept
+    clients on one shared listening socket. The kernel hands each new connection
+    to one shard, and the broker passes messages between the shards, so clients
+    on different shards still chat with each other.
+    """
+    listen_socket = socket.create_server((HOST, PORT), backlog=BACKLOG)
+    relay_dir = tempfile.mkdtemp(prefix='chatrelay-')
+    relay_path = os.path.join(relay_dir, 'relay.sock')
+    # Listening before forking, so shards can connect before the broker's loop is running
+    broker_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    broker_socket.bind(relay_path)
+    broker_socket.listen(shards)
+
+    pids = []
+    for index in range(1, shards + 1):
+        pid = os.fork()
+        if pid == 0:
+            broker_socket.close()
+            run_shard(listen_socket, relay_path, ADMIN_PORT + index if ADMIN_PORT is not None else None)
+        pids.append(pid)
+    listen_socket.close()
+    print(f"[MASTER] Started {shards} shards: {', '.join(map(str, pids))}")
+
+    try:
+        asyncio.run(serve_shards(pids, relay_path, broker_socket))
+    finally:
+        os.unlink(relay_path)
+        os.rmdir(relay_dir)
+    print("\n[SHUTDOWN] Server stopped.")
 
-    # The server waits for new clients indefinitely until manually stopped 
-    while True:
-        # Accept a new connection. This is a blocking call.
-        conn, addr = server_socket.accept()
 
-        # Create a new thread to handle this client.
-        # This allows the server to handle multiple clients simultaneously.
-        thread = threading.Thread(target=handle_client, args=(conn, addr))
-        thread.start() # Start the thread's activity 
+def parse_args():
+    """
+    Parses the command line options.
+
+    Returns:
+        argparse.Namespace: The parsed options
+    """
+    parser = argparse.ArgumentParser(description="Multi-client chat server")
+    parser.add_argument('--host', default=HOST, help=f"address to listen on (default: {HOST})")
+    parser.add_argument('--port', type=int, default=PORT, help=f"port to listen on (default: {PORT})")
+    parser.add_argument('--queue-size', type=int, default=OUTBOUND_QUEUE_SIZE,
+                        help=f"messages queued per client before the slow-consumer policy applies "
+                             f"(default: {OUTBOUND_QUEUE_SIZE})")
+    parser.add_argument('--slow-consumer-policy', choices=SLOW_CONSUMER_POLICIES, default=SLOW_CONSUMER_POLICY,
+                        help=f"what to do when a client's queue is full (default: {SLOW_CONSUMER_POLICY})")
+    parser.add_argument('--block-timeout', type=float, default=BLOCK_TIMEOUT,
+                        help=f"block policy: seconds a sender waits for room before the receiver is "
+                             f"disconnected (default: {BLOCK_TIMEOUT})")
+    parser.add_argument('--history-size', type=int, default=HISTORY_SIZE,
+                        help=f"messages of history kept per room, 0 to disable (default: {HISTORY_SIZE})")
+    parser.add_argument('--history-age', type=float, default=HISTORY_AGE,
+                        help=f"seconds a message stays in history, 0 for no limit (default: {HISTORY_AGE:g})")
+    parser.add_argument('--relay', metavar='ADDRESS',
+                        help="run as one shard of a bigger chat, linked by the relay broker at "
+                             "host:port or Unix socket path ADDRESS (see chatrelay.py)")
+    parser.add_argument('--admin-port', type=int,
+                        help="serve the server's counters as JSON at http://127.0.0.1:PORT/stats "
+                             "(with --shards, shard i uses PORT + i)")
+    parser.add_argument('--log-sample', type=float, default=LOG_SAMPLE, metavar='FRACTION',
+                        help=f"fraction of relayed messages and connections to log, 0 for none "
+                             f"(default: {LOG_SAMPLE:g})")
+    parser.add_argument('--shards', type=int, default=1,
+                        help="run a relay broker and this many shard processes on one port (default: 1)")
+    args = parser.parse_args()
+    if args.shards > 1 and args.relay:
+        parser.error("--shards runs its own relay broker; use --relay only for single shards")
+    if args.shards > 1 and not (hasattr(os, 'fork') and hasattr(socket, 'AF_UNIX')):
+        parser.error("--shards needs os.fork() and Unix sockets, which this platform does not have")
+    return args
+
+
+def start_server():
+    """
+    The main function to start the chat server.
+    A single asyncio event loop multiplexes all client connections, so thousands of
+    mostly idle clients cost a few KB each instead of a thread and its stack each.
+    """
+    global HOST, PORT, OUTBOUND_QUEUE_SIZE, SLOW_CONSUMER_POLICY, BLOCK_TIMEOUT, HISTORY_SIZE, HISTORY_AGE
+    global ADMIN_PORT, LOG_SAMPLE
+    args = parse_args()
+    HOST, PORT = args.host, args.port
+    OUTBOUND_QUEUE_SIZE = args.queue_size
+    SLOW_CONSUMER_POLICY = args.slow_consumer_policy
+    BLOCK_TIMEOUT = args.block_timeout
+    HISTORY_SIZE, HISTORY_AGE = args.history_size, args.history_age
+    ADMIN_PORT, LOG_SAMPLE = args.admin_port, args.log_sample
+
+    raise_file_limit()
+    if args.shards > 1:
+        run_sharded(args.shards)
+        return
+    try:
+        asyncio.run(run_server(relay_address=args.relay, admin_port=ADMIN_PORT))
+    except KeyboardInterrupt:
+        print("\n[SHUTDOWN] Server stopped.")
+    print(f"[STATS] {stats.summary()}")
 
 
 if __name__ == "__main__":
-    start_server()
\ No newline at end of file
+    start_server()
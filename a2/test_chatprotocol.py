@@ -0,0 +1,65 @@
+# test_chatprotocol.py
+# Tests for the CHAT/2 framing helpers in chatprotocol.py, run with:
+#     python -m unittest test_chatprotocol      (or python -m pytest)
+
+import unittest
+
+from chatprotocol import LineParser, encode_line, encode_seq_line, make_hello, parse_hello, split_seq
+
+
+class LineParserTest(unittest.TestCase):
+    def test_splits_lines_received_together(self):
+        self.assertEqual(LineParser().feed(b'one\ntwo\nthree\n'), [b'one', b'two', b'three'])
+
+    def test_keeps_a_partial_line_until_it_ends(self):
+        parser = LineParser()
+        self.assertEqual(parser.feed(b'hel'), [])
+        self.assertEqual(parser.feed(b'lo\nwor'), [b'hello'])
+        self.assertEqual(parser.feed(b'ld'), [])
+        self.assertEqual(parser.feed(b'\n'), [b'world'])
+
+    def test_one_byte_at_a_time(self):
+        parser = LineParser()
+        lines = []
+        for byte in b'a\n\nbc\n':
+            lines += parser.feed(bytes([byte]))
+        self.assertEqual(lines, [b'a', b'', b'bc'])
+
+    def test_rejects_a_line_longer_than_max_line(self):
+        parser = LineParser(max_line=8)
+        self.assertEqual(parser.feed(b'12345678'), [])
+        with self.assertRaises(ValueError):
+            parser.feed(b'9')
+
+    def test_long_lines_are_fine_once_they_end(self):
+        parser = LineParser(max_line=8)
+        self.assertEqual(parser.feed(b'1234567\n1234567\n'), [b'1234567', b'1234567'])
+
+
+class FramingTest(unittest.TestCase):
+    def test_encode_line_replaces_newlines(self):
+        self.assertEqual(encode_line("a\nb\r\nc"), b'a b  c\n')
+        self.assertEqual(encode_line(b'raw'), b'raw\n')
+
+    def test_seq_lines_round_trip(self):
+        line = encode_seq_line(42, "1234: hi there")
+        self.assertEqual(line, b'42 1234: hi there\n')
+        self.assertEqual(split_seq(line.rstrip(b'\n')), (42, b'1234: hi there'))
+
+    def test_split_seq_needs_a_number(self):
+        with self.assertRaises(ValueError):
+            split_seq(b'hello world')
+
+    def test_hello_round_trip(self):
+        line = make_hello('seq', 'resume=17')
+        self.assertEqual(line, b'\x00CHAT/2 seq resume=17\n')
+        self.assertEqual(parse_hello(line.rstrip(b'\n')), {'seq': True, 'resume': '17'})
+
+    def test_answer_and_other_protocols(self):
+        self.assertEqual(parse_hello(make_hello('OK', 'last=3').rstrip(b'\n')), {'OK': True, 'last': '3'})
+        self.assertIsNone(parse_hello(b'hello'))
+        self.assertIsNone(parse_hello(make_hello(protocol=b'RELAY/1').rstrip(b'\n')))
+
+
+if __name__ == '__main__':
+    unittest.main()
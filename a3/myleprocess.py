@@ -1,6 +1,9 @@
 # myleprocess.py
 # CS 158A, Assignment 3: Leader Election
 
+import argparse
+import queue
+import random
 import socket
 import threading
 import time
@@ -9,6 +12,16 @@ import json
 import sys
 import os
 
+# Log levels. MESSAGE lines ("Received: ...", "Sent: ...", ignored messages) are
+# written once or more per message, so on a busy ring they are most of the log;
+# EVENT lines (leader changes) are the ones that matter, and are never dropped.
+MESSAGE = 10
+INFO = 20
+EVENT = 30
+LOG_LEVELS = {'message': MESSAGE, 'info': INFO, 'event': EVENT}
+LOG_FLUSH_BYTES = 64 * 1024  # Write the pending lines once they add up to this much
+LOG_FLUSH_INTERVAL = 0.1     # ... or once the oldest has waited this many seconds
+
 class Message:
     """Defines the structure for messages passed between nodes."""
     def __init__(self, sender_uuid, flag=0):
@@ -26,15 +39,101 @@ class Message:
         return Message(data['uuid'], data['flag'])
 
 
+class NodeLogger:
+    """
+    Writes a node's log lines from a background thread, so logging never makes
+    the threads handling messages wait for the disk or the terminal. log() just
+    puts the line on a queue.SimpleQueue, which takes no Python-level lock; the
+    writer keeps the file open and writes (and echoes to stdout) everything
+    queued in one go, whenever LOG_FLUSH_BYTES have piled up or the oldest line
+    has waited LOG_FLUSH_INTERVAL seconds.
+    """
+    _CLOSE = object()
+
+    def __init__(self, file_name, level=MESSAGE, sample=1.0):
+        """
+        Args:
+            file_name: The log file, opened in append mode
+            level: Lowest level written (MESSAGE, INFO or EVENT)
+            sample: Fraction of MESSAGE lines written, between 0 and 1
+
+        Raises:
+            OSError: If the file cannot be opened
+        """
+        self.file_name = file_name
+        self.level = level
+        self.sample = sample
+        self.file = open(file_name, 'a')
+        self.queue = queue.SimpleQueue()
+        self.writer = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer.start()
+
+    def wants(self, level):
+        """Tells whether a line at this level would be written, so callers can skip formatting it."""
+        if level < self.level:
+            return False
+        return level != MESSAGE or self.sample >= 1.0 or random.random() < self.sample
+
+    def log(self, message, level=INFO):
+        """Queues a line; the time is taken now, the formatting is left to the writer."""
+        if level >= self.level:
+            self.queue.put((time.time(), message))
+
+    def close(self):
+        """Writes out everything queued and closes the file."""
+        self.queue.put(self._CLOSE)
+        self.writer.join()
+
+    def write_loop(self):
+        pending = []
+        size = 0
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is self._CLOSE:
+                self.flush(pending)
+                self.file.close()
+                return
+            if item is not None:
+                pending.append(item)
+                size += len(item[1])
+                if deadline is None:
+                    deadline = time.monotonic() + LOG_FLUSH_INTERVAL
+            if size >= LOG_FLUSH_BYTES or (deadline is not None and time.monotonic() >= deadline):
+                self.flush(pending)
+                pending = []
+                size = 0
+                deadline = None
+
+    def flush(self, pending):
+        if not pending:
+            return
+        try:
+            self.file.write(''.join(f"[{time.ctime(stamp)}] {message}\n" for stamp, message in pending))
+            self.file.flush()
+        except OSError as e:
+            print(f"FATAL: Could not write to log file {self.file_name}: {e}")
+        sys.stdout.write(''.join(f"{message}\n" for _, message in pending))
+        sys.stdout.flush()
+
+
 class Node:
     """Represents a process in the distributed system."""
     CONFIG_FILE = 'config.txt'
     CONNECTION_RETRY_DELAY = 10  # seconds
 
-    def __init__(self, log_file_name):
+    def __init__(self, log_file_name, log_level=MESSAGE, log_sample=1.0):
         self.id = uuid.uuid4()
         self.log_file_name = log_file_name
-        self.log_lock = threading.Lock()
+        try:
+            self.logger = NodeLogger(log_file_name, log_level, log_sample)
+        except OSError as e:
+            print(f"FATAL: Could not open log file {log_file_name}: {e}")
+            sys.exit(1)
         self.state_lock = threading.Lock()
         self.leader_id = None
         self.state = 0
@@ -54,18 +153,17 @@ class Node:
                 self.neighbor_ip = client_line[0]
                 self.neighbor_port = int(client_line[1])
         except (IOError, IndexError, ValueError) as e:
-            self.log(f"FATAL: Error reading {self.CONFIG_FILE}: {e}")
+            self.log(f"FATAL: Error reading {self.CONFIG_FILE}: {e}", EVENT)
+            self.logger.close()
             sys.exit(1)
 
-    def log(self, message):
-        """Writes a message to the node's log file in a thread-safe manner."""
-        with self.log_lock:
-            try:
-                with open(self.log_file_name, 'a') as f:
-                    f.write(f"[{time.ctime()}] {message}\n")
-                print(message)
-            except IOError as e:
-                print(f"FATAL: Could not write to log file {self.log_file_name}: {e}")
+    def log(self, message, level=INFO):
+        """Queues a message for the node's log file; safe to call from any thread."""
+        self.logger.log(message, level)
+
+    def wants_log(self, level):
+        """Tells whether a message at this level would be logged, so it need not be formatted otherwise."""
+        return self.logger.wants(level)
 
     def start_server(self):
         """Initializes and runs the server functionality."""
@@ -142,25 +240,30 @@ class Node:
         with self.state_lock:
             if self.state == 1:
                 # If the leader is known, announce it and ignore election messages
-                self.log(f"Message ignored: Leader is already known to be {self.leader_id}")
+                if self.wants_log(MESSAGE):
+                    self.log(f"Message ignored: Leader is already known to be {self.leader_id}", MESSAGE)
                 return
             
             if msg_uuid > self.id:
                 self.send_message(msg)
             elif msg_uuid < self.id:
-                self.log(f"Message ignored: Received UUID {msg_uuid} is smaller than my UUID {self.id}.")
+                if self.wants_log(MESSAGE):
+                    self.log(f"Message ignored: Received UUID {msg_uuid} is smaller than my UUID {self.id}.",
+                             MESSAGE)
             
             # This block is only reached when a node receives its own UUID back
             elif msg_uuid == self.id:
-                self.log(f"LEADER: My own UUID {self.id} has returned. I am the leader.")
+                self.log(f"LEADER: My own UUID {self.id} has returned. I am the leader.", EVENT)
                 self.leader_id = self.id
                 self.state = 1
-                self.log(f"leader is {self.leader_id}")
+                self.log(f"leader is {self.leader_id}", EVENT)
                 # Announce leadership to the ring
                 self.send_message(Message(self.id, flag=1))
 
     def log_received(self, msg):
         """Logs received messages, safely reading state."""
+        if not self.wants_log(MESSAGE):
+            return
         comparison = "greater" if uuid.UUID(msg.uuid) > self.id else "less" if uuid.UUID(msg.uuid) < self.id else "same"
         with self.state_lock:
             current_state = self.state
@@ -170,11 +273,12 @@ class Node:
         # Add leader_id to log if state is 1 
         if current_state == 1:
             log_msg += f", leader_id={current_leader_id}"
-        self.log(log_msg)
+        self.log(log_msg, MESSAGE)
 
     def log_sent(self, msg):
         """Logs sent messages."""
-        self.log(f"Sent: uuid={msg.uuid}, flag={msg.flag}")
+        if self.wants_log(MESSAGE):
+            self.log(f"Sent: uuid={msg.uuid}, flag={msg.flag}", MESSAGE)
 
     def run(self):
         """Starts threads and waits for Ctrl+C to shut down."""
@@ -199,18 +303,25 @@ class Node:
             for t in threads:
                 t.join()
             self.log("Shutdown complete.")
+            self.logger.close()
 
 
 def main():
-    if len(sys.argv) != 2:
-        print("Usage: python myleprocess.py <log_file_name>")
-        sys.exit(1)
-    
-    log_file_path = sys.argv[1]
+    parser = argparse.ArgumentParser(description="Leader election node for a ring described by config.txt")
+    parser.add_argument('log_file_name', help="File to log to; replaced if it exists")
+    parser.add_argument('--log-level', choices=list(LOG_LEVELS), default='message',
+                        help="message: log every message sent and received; info: only connections "
+                             "and other node events; event: only leader changes (default: message)")
+    parser.add_argument('--log-sample', type=float, default=1.0,
+                        help="Fraction of per-message lines to log, e.g. 0.01; leader changes are "
+                             "always logged (default: 1.0)")
+    args = parser.parse_args()
+
+    log_file_path = args.log_file_name
     if os.path.exists(log_file_path):
         os.remove(log_file_path)
 
-    node = Node(log_file_path)
+    node = Node(log_file_path, LOG_LEVELS[args.log_level], args.log_sample)
     node.run()
 
 
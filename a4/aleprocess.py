@@ -0,0 +1,520 @@
+# aleprocess.py
+# Event-loop version of myleprocess.py. AsyncNode serves a node's links with asyncio
+# tasks instead of a server thread, a client thread, a thread per accepted
+# connection and a heartbeat thread, so:
+#   - both neighbor links are multiplexed in one loop, and a read simply waits for
+#     data instead of waking up every second to check for shutdown;
+#   - stop() cancels the tasks and closes the links at once;
+#   - every connection a left neighbor opens is accepted and served, the newest
+#     one replacing the previous one, as in myleprocess.py;
+#   - any number of nodes can share one event loop, and so one process: a ring of
+#     a thousand nodes costs a listening socket and two connections per node, but
+#     no threads.
+#
+# AsyncNode inherits the election logic, wire format negotiation, heartbeats,
+# epochs and ring repair of myleprocess.py's Node, so threaded and event-loop
+# nodes can share a ring.
+#
+# Usage:
+#     python aleprocess.py                                 one node from config.txt, like myleprocess.py
+#     python aleprocess.py --ring 1000                     a whole ring on 127.0.0.1 in this process
+#     python aleprocess.py --members members.txt --host 0-499
+#                                                          members 0 to 499 of a larger ring
+# With more than one node, all of them log to one file, each line tagged with the
+# start of the node's UUID.
+
+import argparse
+import asyncio
+import sys
+import time
+
+from myleprocess import (ALGORITHMS, EVENT, HEARTBEAT, HEARTBEAT_TIMEOUT, HEARTBEATS_PER_TIMEOUT, LEFT,
+                         LOG_LEVELS, RECV_SIZE, RIGHT, WIRE_ACCEPT, WIRE_OFFER, WIRE_WAIT, Message, Node,
+                         NodeLogger, find_next_log_file, read_members)
+
+SERVER_BACKLOG = 16  # Pending connections per node; a node that comes back may meet a repair in progress
+
+# Addresses of the listening sockets and right links of the AsyncNodes in this
+# process. A link between two of them needs no heartbeats: one node cannot hang
+# while the other, on the same loop, keeps running, and a node that stops closes
+# its sockets. Without this a process hosting a thousand nodes would spend most of
+# its time sending and reading ten thousand heartbeats a second.
+local_endpoints = set()
+
+
+class AsyncNode(Node):
+    """
+    A Node whose links are served by tasks on the running event loop. The
+    transport methods of Node are coroutines here, so everything is created
+    and driven from inside the loop:
+
+        node = AsyncNode(None, ('127.0.0.1', 0), ('127.0.0.1', 5002))
+        await node.start()
+        ...
+        await node.stop()
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # The loop's own events, so tasks can wait for them (process_message
+        # sets and clears leader_elected from inside the loop)
+        self.client_ready = asyncio.Event()
+        self.election_begun = asyncio.Event()
+        self.shutdown_event = asyncio.Event()
+        self.leader_elected = asyncio.Event()
+        self.writers = {LEFT: None, RIGHT: None}  # Stream writer of each link, None while it is down
+        self.heard = None  # Loop time the right neighbor was last heard from, None unless its link is watched
+        self.left_is_local = False  # Whether the left neighbor runs in this process
+        self.server = None
+        self.tasks = set()
+
+    def spawn(self, coroutine):
+        """Runs a coroutine as one of the node's tasks, which stop() cancels."""
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def open_server(self):
+        """Starts listening, so a neighbor can connect before start() is called."""
+        self.server = await asyncio.start_server(self.accept_left, self.server_ip, self.server_port,
+                                                 backlog=SERVER_BACKLOG)
+        self.server_port = self.server.sockets[0].getsockname()[1]
+        local_endpoints.add((self.server_ip, self.server_port))
+        self.log(f"Server listening on {self.server_ip}:{self.server_port}")
+
+    async def start(self):
+        """Starts the right link and heartbeat tasks and returns at once."""
+        if self.server is None:
+            await self.open_server()  # Listen before connecting, so a neighbor that connects back is not refused
+        self.spawn(self.connect_to_neighbor())
+        self.spawn(self.send_heartbeats())
+
+    async def stop(self):
+        """Cancels the node's tasks, closes its links and closes the log."""
+        self.shutdown_event.set()
+        self.log("Cleaning up resources...")
+        if self.server is not None:
+            self.server.close()
+            local_endpoints.discard((self.server_ip, self.server_port))
+        for writer in self.writers.values():
+            if writer is not None:
+                writer.close()
+        tasks = list(self.tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.log("Shutdown complete.")
+        self.close_log()
+
+    async def run(self):
+        """Runs the node until stop() is called or the loop is interrupted (Ctrl+C)."""
+        await self.start()
+        try:
+            await self.shutdown_event.wait()
+        finally:
+            await self.stop()
+
+    async def accept_left(self, reader, writer):
+        """Serves one connection from a left neighbor; a newer connection replaces it."""
+        task = asyncio.current_task()
+        self.tasks.add(task)
+        try:
+            self.log(f"Accepted connection from {writer.get_extra_info('peername')}")
+            if self.wire == 'binary':
+                writer.write(WIRE_OFFER)
+            # Learn the left link's format before anything is sent on it
+            binary, pending = await self.receive_wire_choice(reader)
+            previous = self.writers[LEFT]
+            self.writers[LEFT] = writer
+            self.binary[LEFT] = binary
+            # The left neighbor registered its end before answering the offer
+            self.left_is_local = writer.get_extra_info('peername') in local_endpoints
+            self.send_held(LEFT)
+            if previous is not None:
+                self.log("A new left neighbor replaces the previous one.")
+                previous.close()
+            self.log(f"Receiving {'binary records' if binary else 'JSON'} from the left neighbor")
+
+            if not self.election_started:
+                self.election_started = True
+                self.log("Server waiting for client connection...")
+                await self.client_ready.wait()
+                if self.writers[RIGHT] is not None:
+                    self.log("Client connected. Sending initial message.")
+                    self.start_election()
+                self.election_begun.set()
+
+            await self.read_messages(reader, LEFT, pending)
+        except OSError as e:
+            self.log(f"Left link failed: {e}")
+        except asyncio.CancelledError:
+            pass  # stop() cancelled it; the server that started the task expects it to end normally
+        finally:
+            if self.writers[LEFT] is writer:
+                self.writers[LEFT] = None
+            writer.close()
+            self.tasks.discard(task)
+
+    async def receive_wire_choice(self, reader):
+        """
+        Reads the left neighbor's first bytes to learn whether it accepted the
+        binary format offer.
+
+        Returns:
+            tuple: (True if it did, the bytes received after its answer)
+        """
+        if self.wire != 'binary':
+            return False, b''
+        data = b''
+        # Stop as soon as the bytes can no longer be, or are, a whole WIRE_ACCEPT
+        while len(data) < len(WIRE_ACCEPT) and WIRE_ACCEPT.startswith(data):
+            chunk = await reader.read(RECV_SIZE)
+            if not chunk: break
+            data += chunk
+        if data.startswith(WIRE_ACCEPT):
+            return True, data[len(WIRE_ACCEPT):]
+        return False, data
+
+    async def connect_to_successor(self, lost=None):
+        """
+        Connects to the nearest successor that accepts, retrying with exponential
+        backoff from RETRY_DELAY_INITIAL up to RETRY_DELAY_MAX.
+
+        Args:
+            lost: Address of the successor whose link just failed, tried last
+
+        Returns:
+            tuple: (reader, writer, (ip, port))
+        """
+        delay = self.RETRY_DELAY_INITIAL
+        attempt = 0
+        while True:
+            for address in self.successors(lost):
+                try:
+                    reader, writer = await asyncio.wait_for(asyncio.open_connection(*address),
+                                                            self.CONNECT_TIMEOUT)
+                except (OSError, asyncio.TimeoutError):
+                    continue
+                return reader, writer, address
+            attempt += 1
+            self.log(f"Connection to neighbor refused. Retrying in {delay * 1000:.0f} ms... (Attempt {attempt})")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.RETRY_DELAY_MAX)
+
+    async def connect_to_neighbor(self):
+        """
+        Keeps a link to the nearest live successor until the node stops: connects,
+        reads from the link until it fails, and connects again. Every
+        reconnection starts a new election, since the ring changed.
+        """
+        connected_before = False
+        address = None
+        while True:
+            reader, writer, address = await self.connect_to_successor(lost=address)
+            endpoint = writer.get_extra_info('sockname')
+            local_endpoints.add(endpoint)
+            try:
+                try:
+                    binary, pending = await self.accept_wire_offer(reader, writer)
+                except OSError:
+                    continue
+                self.writers[RIGHT] = writer
+                self.binary[RIGHT] = binary
+                self.send_held(RIGHT)
+                self.log(f"Connected to neighbor at {address[0]}:{address[1]}")
+                self.log(f"Sending {'binary records' if binary else 'JSON'} to the right neighbor")
+                if connected_before:
+                    self.log(f"Ring repaired: right neighbor is now {address[0]}:{address[1]}", EVENT)
+                    self.restart_election()
+                connected_before = True
+                self.client_ready.set()
+                # Anything the right neighbor sends may need passing on to the left, so
+                # don't read from it before the left link is up
+                await self.election_begun.wait()
+                await self.read_messages(reader, RIGHT, pending, watch=address not in local_endpoints)
+            except OSError:
+                pass
+            finally:
+                if self.writers[RIGHT] is writer:
+                    self.writers[RIGHT] = None
+                local_endpoints.discard(endpoint)
+                writer.close()
+            if self.shutdown_event.is_set():
+                return
+            self.log(f"Lost the right neighbor at {address[0]}:{address[1]}", EVENT)
+
+    async def accept_wire_offer(self, reader, writer):
+        """
+        Waits up to WIRE_WAIT seconds for the right neighbor's binary format offer
+        and accepts it.
+
+        Returns:
+            tuple: (True if the link now uses binary records, False for JSON;
+                    the bytes received that were not part of the offer)
+        """
+        if self.wire != 'binary':
+            return False, b''
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + WIRE_WAIT
+        data = b''
+        # A neighbor that never offers may send JSON messages instead, so stop
+        # reading as soon as the bytes cannot be the offer
+        while len(data) < len(WIRE_OFFER) and WIRE_OFFER.startswith(data):
+            try:
+                chunk = await asyncio.wait_for(reader.read(len(WIRE_OFFER) - len(data)), deadline - loop.time())
+            except asyncio.TimeoutError:
+                break  # An older neighbor, which never offers
+            if not chunk: break
+            data += chunk
+        if data != WIRE_OFFER:
+            return False, data
+        writer.write(WIRE_ACCEPT)
+        return True, b''
+
+    async def read_messages(self, reader, direction, pending=b'', watch=True):
+        """
+        Reads messages from one neighbor until the link closes. A binary link from
+        the right neighbor carries its heartbeats, so unless it is a local link the
+        time of every read from it is noted for send_heartbeats() to check.
+
+        Args:
+            reader: The link's stream reader
+            direction: Which neighbor is at the other end
+            pending: Bytes already received on the link
+            watch: False if the right neighbor runs in this process and sends no heartbeats
+
+        Raises:
+            OSError: If the link fails
+        """
+        decode = Message.decode_binary if self.binary[direction] else Message.decode_json
+        buffer = bytearray(pending)
+        watch = watch and direction == RIGHT and self.binary[RIGHT]
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                if watch:
+                    self.heard = loop.time()
+                messages, used = decode(buffer)
+                del buffer[:used]
+                for msg in messages:
+                    if msg.flag != HEARTBEAT:
+                        self.handle_message(msg, direction)
+                data = await reader.read(RECV_SIZE)
+                if not data: break
+                buffer += data
+        except (ValueError, KeyError) as e:
+            self.log(f"Malformed message from the {direction} neighbor: {e}")
+        finally:
+            if watch:
+                self.heard = None
+        self.log(f"Ending listen loop ({direction} neighbor).")
+
+    async def send_heartbeats(self):
+        """
+        Sends a HEARTBEAT to the left neighbor HEARTBEATS_PER_TIMEOUT times per
+        heartbeat timeout, so it can tell a hung or unreachable node from a quiet
+        one, and closes the link to the right neighbor once nothing has come from
+        it for heartbeat_timeout seconds.
+
+        Every node of the process shares the loop, so when the loop itself falls
+        behind (this task wakes up late) the right neighbor's data may be sitting
+        unread; the silence is then not held against the neighbor.
+        """
+        record = Message(self.uid, HEARTBEAT).to_bytes()
+        interval = self.heartbeat_timeout / HEARTBEATS_PER_TIMEOUT
+        loop = asyncio.get_running_loop()
+        woke = loop.time()
+        while True:
+            await asyncio.sleep(interval)
+            now = loop.time()
+            late = now - woke > 2 * interval
+            woke = now
+            writer = self.writers[LEFT]
+            if writer is not None and self.binary[LEFT] and not self.left_is_local and not writer.is_closing():
+                writer.write(record)
+
+            if self.heard is None:
+                continue
+            if late:
+                self.heard = now
+            elif now - self.heard > self.heartbeat_timeout:
+                self.log(f"No heartbeat from the right neighbor for {self.heartbeat_timeout * 1000:.0f} ms.", EVENT)
+                self.heard = None
+                self.writers[RIGHT].close()  # Ends its read loop, and connect_to_neighbor() reconnects
+
+    def send_message(self, message, direction=RIGHT):
+        """
+        Queues a message of the current epoch on the link on the given side. The
+        write never blocks: the transport buffers what the socket cannot take yet.
+        """
+        message.epoch = self.epoch
+        writer = self.writers[direction]
+        if writer is None or writer.is_closing():
+            self.held[direction].append(message)
+            return
+        data = self.encode(message, direction)
+        writer.write(data)
+        self.messages_sent += 1
+        self.bytes_sent += len(data)
+        self.log_sent(message)
+
+    def send_held(self, direction):
+        """Sends the messages held for a side over its new link."""
+        held = self.held[direction]
+        if not held:
+            return
+        messages = list(held)
+        held.clear()
+        data = b''.join(self.encode(msg, direction) for msg in messages)
+        self.writers[direction].write(data)
+        self.log(f"Sent {len(messages)} held messages to the {direction} neighbor.")
+        self.messages_sent += len(messages)
+        self.bytes_sent += len(data)
+        for msg in messages:
+            self.log_sent(msg)
+
+
+async def run_nodes(nodes, report=True):
+    """
+    Runs nodes on this event loop until cancelled (Ctrl+C), printing when all of
+    them first agree on a leader.
+
+    Args:
+        nodes: AsyncNodes whose servers are already open
+        report: Whether to print the time until every node knew the leader
+    """
+    start = time.perf_counter()
+    for node in nodes:
+        await node.start()
+    try:
+        if report:
+            await asyncio.gather(*(node.leader_elected.wait() for node in nodes))
+            leaders = {node.leader_id for node in nodes}
+            print(f"{len(nodes)} nodes elected {', '.join(map(str, leaders))} in "
+                  f"{(time.perf_counter() - start) * 1000:.1f} ms")
+        await asyncio.Event().wait()  # Until cancelled
+    finally:
+        # Flag every node first, so none of them takes the others' shutdown for a failure
+        for node in nodes:
+            node.shutdown_event.set()
+        await asyncio.gather(*(node.stop() for node in nodes))
+
+
+async def host_ring(size, options):
+    """Hosts a whole ring of size nodes on 127.0.0.1, on ports chosen by the OS."""
+    nodes = [AsyncNode(None, ('127.0.0.1', 0), ('127.0.0.1', 0), **options) for _ in range(size)]
+    for node in nodes:
+        await node.open_server()
+    members = [(node.server_ip, node.server_port) for node in nodes]
+    for i, node in enumerate(nodes):
+        node.neighbor_port = members[(i + 1) % size][1]
+        node.members = members
+    await run_nodes(nodes)
+
+
+async def host_members(members, first, last, options):
+    """Hosts members first to last (inclusive) of a ring listed in a membership file."""
+    nodes = []
+    for i in range(first, last + 1):
+        nodes.append(AsyncNode(None, members[i], members[(i + 1) % len(members)], members=members, **options))
+    for node in nodes:
+        await node.open_server()
+    await run_nodes(nodes, report=False)
+
+
+def parse_range(text, size):
+    """
+    Parses a "first-last" range of member indexes (or a single index).
+
+    Raises:
+        ValueError: If the range is malformed or outside 0 to size - 1
+    """
+    first, _, last = text.partition('-')
+    first = int(first)
+    last = int(last) if last else first
+    if not 0 <= first <= last < size:
+        raise ValueError(f"{text} is not a range of member indexes from 0 to {size - 1}")
+    return first, last
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Event-loop leader election nodes: one node from config.txt, "
+                                                 "a whole ring, or part of a ring from a membership file")
+    parser.add_argument('--ring', type=int, default=None,
+                        help="Host a whole ring of this many nodes on 127.0.0.1 in this process")
+    parser.add_argument('--members', default=None,
+                        help="File listing every node's ip,port in ring order, so a node can skip "
+                             "a failed neighbor and connect to the next live one")
+    parser.add_argument('--host', default=None,
+                        help="With --members: host the members with these 0-based indexes, e.g. 0-499 "
+                             "(default: the one node in config.txt)")
+    parser.add_argument('--algorithm', choices=sorted(ALGORITHMS), default='lcr',
+                        help="lcr: Chang-Roberts, one-way; hs: Hirschberg-Sinclair, two-way. "
+                             "Every node of the ring must use the same one (default: lcr)")
+    parser.add_argument('--wire', choices=['binary', 'json'], default='binary',
+                        help="binary: offer and accept 17-byte binary records, falling back to JSON "
+                             "with neighbors that don't; json: JSON lines only (default: binary)")
+    parser.add_argument('--log-level', choices=list(LOG_LEVELS), default=None,
+                        help="message, info or event, as in myleprocess.py (default: message for "
+                             "one node, event for several)")
+    parser.add_argument('--log-sample', type=float, default=1.0,
+                        help="Fraction of per-message lines to log (default: 1.0)")
+    parser.add_argument('--heartbeat-timeout', type=float, default=HEARTBEAT_TIMEOUT,
+                        help=f"Seconds of silence after which the right neighbor counts as failed "
+                             f"(default: {HEARTBEAT_TIMEOUT})")
+    args = parser.parse_args()
+    if args.host is not None and args.members is None:
+        parser.error("--host needs --members")
+    if args.ring is not None and args.ring < 1:
+        parser.error("--ring needs at least one node")
+
+    members = None
+    if args.members:
+        try:
+            members = read_members(args.members)
+        except (OSError, ValueError) as e:
+            print(f"FATAL: Error reading {args.members}: {e}")
+            sys.exit(1)
+    if args.host is not None:
+        try:
+            first, last = parse_range(args.host, len(members))
+        except ValueError as e:
+            parser.error(str(e))
+    single = args.ring is None and args.host is None
+    log_level = LOG_LEVELS[args.log_level or ('message' if single else 'event')]
+    log_file_path = find_next_log_file()
+
+    if single:
+        node = AsyncNode(log_file_path, algorithm=args.algorithm, wire=args.wire, log_level=log_level,
+                         log_sample=args.log_sample, members=members, heartbeat_timeout=args.heartbeat_timeout)
+        if members and (node.server_ip, node.server_port) not in members:
+            node.log(f"FATAL: {node.server_ip},{node.server_port} is not listed in {args.members}", EVENT)
+            node.close_log()
+            sys.exit(1)
+        main_coroutine = node.run()
+        logger = None
+    else:
+        try:
+            logger = NodeLogger(log_file_path, log_level, args.log_sample)
+        except OSError as e:
+            print(f"FATAL: Could not open log file {log_file_path}: {e}")
+            sys.exit(1)
+        options = dict(algorithm=args.algorithm, wire=args.wire, heartbeat_timeout=args.heartbeat_timeout,
+                       logger=logger)
+        if args.ring is not None:
+            main_coroutine = host_ring(args.ring, options)
+        else:
+            main_coroutine = host_members(members, first, last, options)
+
+    try:
+        asyncio.run(main_coroutine)
+    except KeyboardInterrupt:
+        print("\nNodes stopped.")
+    finally:
+        if logger is not None:
+            logger.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+# lesim.py
+# Leader election simulator: runs a whole ring of Node instances in one process
+# and measures how long the election takes and how many messages it costs as
+# the ring grows, without opening a terminal (and editing config.txt) per node.
+#
+# Three transports:
+#     memory    Nodes hand messages to a shared FIFO queue that one loop drains,
+#               delivering each to the receiving node's handle_message(). No
+#               sockets or threads, so rings of thousands of nodes take seconds,
+#               and runs with the same seed are exactly repeatable.
+#     loopback  Every node runs its real server and client threads over TCP on
+#               127.0.0.1, with ports picked by the OS, exactly as
+#               myleprocess.py does. Costs a few threads and sockets per node,
+#               so it suits rings of up to a few hundred nodes. With
+#               --fail-leader, the leader is crashed once it is elected and the
+#               time until the other nodes have repaired the ring and agreed on
+#               a new leader is reported as well.
+#     asyncio   The same over TCP on 127.0.0.1, but with aleprocess.py's AsyncNode:
+#               every node's links are tasks on one event loop, with no threads,
+#               so rings of a thousand nodes or more fit in one process.
+#               --fail-leader works here too.
+#
+# UUIDs are random, but their order around the ring can be chosen:
+#     random      shuffled, the average case
+#     ascending   each node's successor has a larger UUID, so every election
+#                 message but the leader's is dropped after one hop (best case)
+#     descending  each successor has a smaller UUID, so every message travels
+#                 until it reaches the leader: n(n+1)/2 election messages (worst case)
+#
+# and the election algorithm can be LCR (Chang-Roberts, O(n^2) messages in the
+# worst case) or Hirschberg-Sinclair (O(n log n) messages in every case), with
+# messages sent as binary records or JSON lines; give several of each to compare
+# them in one table. Every algorithm and wire format runs on the same rings, so
+# their rows differ only in what is being compared. The memory transport encodes
+# and decodes every message too, so the bytes and time it reports include the
+# wire format's cost.
+#
+# Example:
+#     python lesim.py --sizes 10,100,1000 --algorithm lcr,hs --ordering random,descending
+#     python lesim.py --sizes 1000 --ordering descending --wire binary,json
+
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import random
+import statistics
+import time
+import uuid
+
+from aleprocess import AsyncNode
+from myleprocess import ALGORITHMS, LEFT, RIGHT, Message, Node
+
+SIZES = '10,100,1000'
+LOOPBACK_TIMEOUT = 60.0      # Seconds to wait for a loopback ring to elect a leader
+POLL_INTERVAL = 0.001        # Seconds between checks for the ring's recovery
+ORDERINGS = ('random', 'ascending', 'descending')
+WIRES = ('binary', 'json')
+
+
+def make_ids(size, ordering, rng):
+    """
+    Generates the UUIDs of a ring, in ring order.
+
+    Args:
+        size: Number of nodes
+        ordering: 'random', 'ascending' or 'descending'
+        rng: The random.Random to draw from
+
+    Returns:
+        list[uuid.UUID]: One UUID per node; node i sends to node i + 1
+    """
+    ids = [uuid.UUID(int=rng.getrandbits(128), version=4) for _ in range(size)]
+    if ordering == 'ascending':
+        ids.sort()
+    elif ordering == 'descending':
+        ids.sort(reverse=True)
+    return ids
+
+
+class MemoryLink:
+    """Stands in for one of a node's sockets by queueing its messages for the simulator."""
+
+    def __init__(self, queue, target, arrives_from):
+        self.queue = queue
+        self.target = target
+        self.arrives_from = arrives_from  # The side of target the messages arrive on
+
+    def send(self, data):
+        self.queue.append((self.target, data, self.arrives_from))
+
+
+def simulate_memory(ids, algorithm, wire):
+    """
+    Runs one election over the in-memory transport. Every node starts at the
+    same moment and messages are delivered one at a time in the order sent.
+
+    Args:
+        ids: The nodes' UUIDs in ring order
+        algorithm: Election algorithm name
+        wire: 'binary' or 'json'
+
+    Returns:
+        tuple: (nodes, seconds until every node knew the leader, None)
+    """
+    size = len(ids)
+    nodes = [Node(None, ('memory', i), ('memory', (i + 1) % size), node_id=node_id, algorithm=algorithm,
+                  wire=wire)
+             for i, node_id in enumerate(ids)]
+    binary = wire == 'binary'
+    decode = Message.decode_binary if binary else Message.decode_json
+    queue = collections.deque()
+    for i, node in enumerate(nodes):
+        node.binary = {LEFT: binary, RIGHT: binary}
+        node.links = {
+            RIGHT: MemoryLink(queue, nodes[(i + 1) % size], LEFT),
+            LEFT: MemoryLink(queue, nodes[i - 1], RIGHT),
+        }
+
+    start = time.perf_counter()
+    for node in nodes:
+        node.start_election()
+    while queue:
+        target, data, direction = queue.popleft()
+        for message in decode(data)[0]:
+            target.handle_message(message, direction)
+    return nodes, time.perf_counter() - start, None
+
+
+def wait_for_leader(nodes, expected, deadline):
+    """
+    Waits until every node knows the expected leader.
+
+    Raises:
+        TimeoutError: If that has not happened by the deadline (a perf_counter() value)
+    """
+    while not agree_on(nodes, expected):
+        if time.perf_counter() > deadline:
+            raise TimeoutError(f"{len(nodes)} nodes did not agree on leader {expected} in time.")
+        time.sleep(POLL_INTERVAL)
+
+
+def agree_on(nodes, expected):
+    """Tells whether every node knows the expected leader."""
+    return all(node.leader_elected.is_set() and node.leader_id == expected for node in nodes)
+
+
+def simulate_loopback(ids, algorithm, wire, fail_leader=False, timeout=LOOPBACK_TIMEOUT):
+    """
+    Runs one election with every node on its own TCP ports on 127.0.0.1.
+
+    Args:
+        ids: The nodes' UUIDs in ring order
+        algorithm: Election algorithm name
+        wire: 'binary' or 'json'
+        fail_leader: Whether to crash the leader after the election and time the recovery
+        timeout: Seconds to wait for each election to finish
+
+    Returns:
+        tuple: (nodes, seconds until every node knew the leader,
+                seconds from the crash until every live node knew the new leader, or None)
+
+    Raises:
+        TimeoutError: If some node still has no leader after timeout seconds
+    """
+    size = len(ids)
+    nodes = [Node(None, ('127.0.0.1', 0), ('127.0.0.1', 0), node_id=node_id, algorithm=algorithm, wire=wire)
+             for node_id in ids]
+    try:
+        # Bind every server first, so each node knows its neighbor's port and no
+        # connection attempt is refused
+        for node in nodes:
+            node.open_server()
+        members = [(node.server_ip, node.server_port) for node in nodes]
+        for i, node in enumerate(nodes):
+            node.neighbor_port = nodes[(i + 1) % size].server_port
+            node.members = members
+
+        start = time.perf_counter()
+        for node in nodes:
+            node.start()
+        deadline = start + timeout
+        for node in nodes:
+            if not node.leader_elected.wait(max(0, deadline - time.perf_counter())):
+                raise TimeoutError(f"No leader after {timeout} seconds in a ring of {size}.")
+        elapsed = time.perf_counter() - start
+        if not fail_leader:
+            return nodes, elapsed, None
+
+        leader = max(nodes, key=lambda node: node.uid)
+        survivors = [node for node in nodes if node is not leader]
+        crashed = time.perf_counter()
+        leader.stop(wait=False)
+        wait_for_leader(survivors, max(node.id for node in survivors), crashed + timeout)
+        return survivors, elapsed, time.perf_counter() - crashed
+    finally:
+        # Flag every node first, so none of them takes the others' shutdown for a
+        # failure and starts repairing the ring
+        for node in nodes:
+            node.shutdown_event.set()
+        for node in nodes:
+            node.stop(wait=False)
+        for node in nodes:
+            node.stop()
+
+
+async def elect_asyncio(ids, algorithm, wire, fail_leader=False, timeout=LOOPBACK_TIMEOUT):
+    """
+    Runs one election with every node an AsyncNode on the running event loop,
+    each on its own TCP port on 127.0.0.1.
+
+    Returns:
+        tuple: as simulate_loopback()
+
+    Raises:
+        TimeoutError: If some node still has no leader after timeout seconds
+    """
+    size = len(ids)
+    nodes = [AsyncNode(None, ('127.0.0.1', 0), ('127.0.0.1', 0), node_id=node_id, algorithm=algorithm, wire=wire)
+             for node_id in ids]
+    try:
+        for node in nodes:
+            await node.open_server()
+        members = [(node.server_ip, node.server_port) for node in nodes]
+        for i, node in enumerate(nodes):
+            node.neighbor_port = nodes[(i + 1) % size].server_port
+            node.members = members
+
+        start = time.perf_counter()
+        for node in nodes:
+            await node.start()
+        try:
+            await asyncio.wait_for(asyncio.gather(*(node.leader_elected.wait() for node in nodes)), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"No leader after {timeout} seconds in a ring of {size}.") from None
+        elapsed = time.perf_counter() - start
+        if not fail_leader:
+            return nodes, elapsed, None
+
+        leader = max(nodes, key=lambda node: node.uid)
+        survivors = [node for node in nodes if node is not leader]
+        expected = max(node.id for node in survivors)
+        crashed = time.perf_counter()
+        await leader.stop()
+        while not agree_on(survivors, expected):
+            if time.perf_counter() > crashed + timeout:
+                raise TimeoutError(f"{len(survivors)} nodes did not agree on leader {expected} in time.")
+            await asyncio.sleep(POLL_INTERVAL)
+        return survivors, elapsed, time.perf_counter() - crashed
+    finally:
+        for node in nodes:
+            node.shutdown_event.set()
+        await asyncio.gather(*(node.stop() for node in nodes))
+
+
+def run_election(ids, algorithm, wire, transport, fail_leader=False):
+    """
+    Builds a ring of the given UUIDs, runs one election and checks that it chose
+    the largest UUID (or, after the leader was crashed, the largest one left).
+
+    Returns:
+        dict: size, messages and bytes sent, time to leader and time to recover
+              in milliseconds (None unless fail_leader)
+
+    Raises:
+        RuntimeError: If some node settled on the wrong leader
+    """
+    size = len(ids)
+    if transport == 'memory':
+        nodes, elapsed, recovery = simulate_memory(ids, algorithm, wire)
+    elif transport == 'asyncio':
+        nodes, elapsed, recovery = asyncio.run(elect_asyncio(ids, algorithm, wire, fail_leader))
+    else:
+        nodes, elapsed, recovery = simulate_loopback(ids, algorithm, wire, fail_leader)
+    expected = max(node.id for node in nodes)
+    wrong = [node for node in nodes if node.leader_id != expected]
+    if wrong:
+        raise RuntimeError(f"{len(wrong)} of {len(nodes)} nodes did not elect {expected}.")
+    return {
+        'size': size,
+        'messages': sum(node.messages_sent for node in nodes),
+        'bytes': sum(node.bytes_sent for node in nodes),
+        'time_ms': elapsed * 1000,
+        'recovery_ms': None if recovery is None else recovery * 1000,
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Simulate ring leader elections and measure their cost")
+    parser.add_argument('--sizes', default=SIZES,
+                        help=f"Comma-separated ring sizes (default: {SIZES})")
+    parser.add_argument('--transport', choices=['memory', 'loopback', 'asyncio'], default='memory',
+                        help="memory: one in-process queue; loopback: real TCP sockets and threads; "
+                             "asyncio: real TCP sockets on one event loop (default: memory)")
+    parser.add_argument('--algorithm', default='lcr',
+                        help=f"Comma-separated election algorithms out of {', '.join(sorted(ALGORITHMS))} "
+                             "(default: lcr)")
+    parser.add_argument('--ordering', default='random',
+                        help=f"Comma-separated orders of the UUIDs around the ring out of "
+                             f"{', '.join(ORDERINGS)} (default: random)")
+    parser.add_argument('--wire', default='binary',
+                        help=f"Comma-separated wire formats out of {', '.join(WIRES)} (default: binary)")
+    parser.add_argument('--fail-leader', action='store_true',
+                        help="Loopback and asyncio only: crash the leader after the election and report how long the "
+                             "ring takes to repair itself and elect a new one")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="Elections per ring size; the median is reported (default: 3)")
+    parser.add_argument('--seed', type=int, default=None,
+                        help="Random seed, for repeatable UUIDs")
+    parser.add_argument('--json', action='store_true',
+                        help="Print the results as JSON instead of a table")
+    args = parser.parse_args()
+    args.algorithm = args.algorithm.split(',')
+    args.ordering = args.ordering.split(',')
+    args.wire = args.wire.split(',')
+    if args.fail_leader and args.transport == 'memory':
+        parser.error("--fail-leader needs --transport loopback or asyncio")
+    for name in args.wire:
+        if name not in WIRES:
+            parser.error(f"unknown wire format {name!r}")
+    for name in args.algorithm:
+        if name not in ALGORITHMS:
+            parser.error(f"unknown algorithm {name!r}")
+    for name in args.ordering:
+        if name not in ORDERINGS:
+            parser.error(f"unknown ordering {name!r}")
+    return args
+
+
+def compare(rings, algorithm, ordering, wire, args, results):
+    """
+    Runs one election on each ring and adds the medians to results, printing
+    them as a table row unless --json was given.
+
+    Args:
+        rings (list[list[uuid.UUID]]): The rings, one per repeat
+        algorithm (str): The election algorithm
+        ordering (str): The order the rings' UUIDs were made in
+        wire (str): The wire format
+        args (argparse.Namespace): The command line options
+        results (list[dict]): The rows so far
+    """
+    size = len(rings[0])
+    runs = [run_election(ids, algorithm, wire, args.transport, args.fail_leader) for ids in rings]
+    results.append({
+        'size': size,
+        'algorithm': algorithm,
+        'ordering': ordering,
+        'wire': wire,
+        'transport': args.transport,
+        'messages': statistics.median(run['messages'] for run in runs),
+        'bytes': statistics.median(run['bytes'] for run in runs),
+        'time_ms': statistics.median(run['time_ms'] for run in runs),
+    })
+    if args.fail_leader:
+        results[-1]['recovery_ms'] = statistics.median(run['recovery_ms'] for run in runs)
+    if not args.json:
+        row = results[-1]
+        print(f"{algorithm:<4} {ordering:<11} {wire:<7} n={size:<6} messages={row['messages']:<10g} "
+              f"per node={row['messages'] / size:<8.1f} bytes={row['bytes']:<11.0f} "
+              f"time to leader={row['time_ms']:.1f} ms"
+              + (f" recovery={row['recovery_ms']:.1f} ms" if args.fail_leader else ""))
+
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+    sizes = [int(s) for s in args.sizes.split(',')]
+    results = []
+    for ordering, size in itertools.product(args.ordering, sizes):
+        rings = [make_ids(size, ordering, rng) for _ in range(args.repeat)]
+        for algorithm, wire in itertools.product(args.algorithm, args.wire):
+            compare(rings, algorithm, ordering, wire, args, results)
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,12 @@
 # myleprocess.py
 # CS 158A, Assignment 4: Leader Election
 
+import argparse
+import collections
+import queue
+import random
 import socket
+import struct
 import threading
 import time
 import uuid
@@ -9,43 +14,461 @@ import json
 import sys
 import os
 
+# Message flags
+ELECTION = 0  # A candidate's UUID travelling around the ring (LCR)
+LEADER = 1    # Announcement of the elected leader
+PROBE = 2     # Hirschberg-Sinclair: a candidate probing 2^phase hops out
+REPLY = 3     # Hirschberg-Sinclair: a probe's answer travelling back to the candidate
+HEARTBEAT = 4 # "Still alive", sent to the left neighbor over binary links only
+REELECT = 5   # The ring was repaired: forget the leader and elect again
+
+# Every election runs in an epoch. A node that repairs the ring moves to the
+# next epoch and sends REELECT around it; messages from older epochs are then
+# dropped, so an election cut short by a failure cannot go on circulating.
+# Epochs count modulo EPOCHS (they travel in the top bits of the flag byte), and
+# one less than half the range ahead counts as newer.
+EPOCHS = 32
+FLAG_BITS = 3  # The low bits of the flag byte hold the flag, the rest the epoch
+
+# Link directions. A node connects to its neighbor on the right (its successor)
+# and accepts a connection from the node on its left (its predecessor).
+LEFT = 'left'
+RIGHT = 'right'
+
+
+# Wire formats. Messages are either JSON lines ({"uuid": "...", "flag": n}, the
+# original format) or fixed-size binary records: the UUID's 16 bytes, big-endian,
+# then the flag byte (flag | epoch << FLAG_BITS), 17 bytes in all. PROBE and REPLY records add the phase (1
+# byte) and hop count (4 bytes), 22 bytes in all. A binary ELECTION message is
+# about a third the size of the JSON one and needs no parsing beyond slicing.
+#
+# The accepting node offers the binary format by sending WIRE_OFFER as soon as it
+# accepts; a connecting node that understands it answers WIRE_ACCEPT and both
+# sides then use binary records on that connection. A node that never answers
+# (an older node, or one started with --wire json) just sends JSON lines, so
+# rings can mix old and new nodes.
+WIRE_OFFER = b'\x00LE/BIN\n'
+WIRE_ACCEPT = b'\x00LE/BIN OK\n'
+WIRE_WAIT = 0.5  # Seconds a connecting node waits for the offer before falling back to JSON
+RECORD = struct.Struct('>16sB')
+PHASED_RECORD = struct.Struct('>16sBBI')
+RECORD_SIZES = {PROBE: PHASED_RECORD.size, REPLY: PHASED_RECORD.size}
+RECV_SIZE = 64 * 1024
+HEARTBEAT_TIMEOUT = 0.5      # Seconds of silence before the right neighbor counts as failed
+HEARTBEATS_PER_TIMEOUT = 5   # Heartbeats sent per timeout, so a few can be late or lost
+HELD_MAX = 1024              # Messages kept for a side whose link is down, oldest dropped first
+
+# Log levels. MESSAGE lines ("Received: ...", "Sent: ...", ignored messages) are
+# written once or more per message, so on a busy ring they are most of the log;
+# EVENT lines (leader changes) are the ones that matter, and are never dropped.
+MESSAGE = 10
+INFO = 20
+EVENT = 30
+LOG_LEVELS = {'message': MESSAGE, 'info': INFO, 'event': EVENT}
+LOG_FLUSH_BYTES = 64 * 1024  # Write the pending lines once they add up to this much
+LOG_FLUSH_INTERVAL = 0.1     # ... or once the oldest has waited this many seconds
+
+
+def opposite(direction):
+    """Returns the other direction around the ring."""
+    return RIGHT if direction == LEFT else LEFT
+
+
+def close_socket(sock):
+    """Shuts a socket down and closes it, waking any thread blocked reading it."""
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    sock.close()
+
+
+def read_members(path):
+    """
+    Reads a membership list: one "ip,port" line per node, in ring order, in the
+    same format as config.txt.
+
+    Returns:
+        list[tuple]: (ip, port) per node
+
+    Raises:
+        OSError: If the file cannot be read
+        ValueError: If a line is malformed
+    """
+    members = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                ip, port = line.split(',')
+                members.append((ip.strip(), int(port)))
+    return members
+
+
 class Message:
-    """Defines the structure for messages passed between nodes."""
-    def __init__(self, sender_uuid, flag=0):
-        self.uuid = str(sender_uuid)
+    """
+    Defines the structure for messages passed between nodes. The sender's UUID
+    is kept as a 128-bit int, which compares as fast as any int and is turned
+    into UUID text only for JSON and log lines.
+    """
+    __slots__ = ('uid', 'flag', 'phase', 'hops', 'epoch')
+
+    def __init__(self, sender_uuid, flag=ELECTION, phase=0, hops=0, epoch=0):
+        """
+        Args:
+            sender_uuid: The UUID as a uuid.UUID, an int or a str
+            flag: ELECTION, LEADER, PROBE or REPLY
+            phase: The Hirschberg-Sinclair phase (PROBE and REPLY only)
+            hops: Hops the probe has travelled (PROBE only)
+            epoch: The election epoch; Node.send_message sets it
+        """
+        if isinstance(sender_uuid, int):
+            self.uid = sender_uuid
+        elif isinstance(sender_uuid, uuid.UUID):
+            self.uid = sender_uuid.int
+        else:
+            self.uid = uuid.UUID(sender_uuid).int
         self.flag = flag
+        self.phase = phase
+        self.hops = hops
+        self.epoch = epoch
+
+    @property
+    def uuid(self):
+        """The sender's UUID as text."""
+        return str(uuid.UUID(int=self.uid))
 
     def to_json(self):
         """Serializes the message instance to a JSON string."""
-        return json.dumps(self.__dict__) + "\n"
+        data = {'uuid': self.uuid, 'flag': self.flag}
+        if self.flag in (PROBE, REPLY):
+            data['phase'] = self.phase
+            data['hops'] = self.hops
+        if self.epoch:
+            data['epoch'] = self.epoch
+        return json.dumps(data) + "\n"
 
     @staticmethod
     def from_json(json_str):
         """Deserializes a JSON string back into a Message instance."""
         data = json.loads(json_str)
-        return Message(data['uuid'], data['flag'])
+        return Message(data['uuid'], data['flag'], data.get('phase', 0), data.get('hops', 0),
+                       data.get('epoch', 0))
+
+    def to_bytes(self):
+        """Serializes the message as a binary record."""
+        raw = self.uid.to_bytes(16, 'big')
+        flag_byte = self.flag | self.epoch << FLAG_BITS
+        if self.flag in (PROBE, REPLY):
+            return PHASED_RECORD.pack(raw, flag_byte, self.phase, self.hops)
+        return RECORD.pack(raw, flag_byte)
+
+    @staticmethod
+    def decode_binary(buffer):
+        """
+        Decodes the complete binary records at the start of a buffer.
+
+        Args:
+            buffer: Received bytes
+
+        Returns:
+            tuple: (list of Messages, number of bytes used)
+        """
+        messages = []
+        pos = 0
+        end = len(buffer)
+        while end - pos >= RECORD.size:
+            flag_byte = buffer[pos + 16]
+            flag = flag_byte & (1 << FLAG_BITS) - 1
+            size = RECORD_SIZES.get(flag, RECORD.size)
+            if end - pos < size:
+                break
+            uid = int.from_bytes(buffer[pos:pos + 16], 'big')
+            if size == RECORD.size:
+                messages.append(Message(uid, flag, epoch=flag_byte >> FLAG_BITS))
+            else:
+                _, _, phase, hops = PHASED_RECORD.unpack_from(buffer, pos)
+                messages.append(Message(uid, flag, phase, hops, flag_byte >> FLAG_BITS))
+            pos += size
+        return messages, pos
+
+    @staticmethod
+    def decode_json(buffer):
+        """
+        Decodes the complete JSON lines at the start of a buffer, skipping
+        wire format offers.
+
+        Args:
+            buffer: Received bytes
+
+        Returns:
+            tuple: (list of Messages, number of bytes used)
+
+        Raises:
+            ValueError: If a line is not a valid message
+        """
+        messages = []
+        pos = 0
+        while True:
+            end = buffer.find(b'\n', pos)
+            if end == -1:
+                return messages, pos
+            line = bytes(buffer[pos:end])
+            pos = end + 1
+            if not line.startswith(b'\x00'):
+                messages.append(Message.from_json(line))
+
+
+class LCR:
+    """
+    Chang-Roberts (LCR) election on a one-way ring. Every node sends its UUID to
+    the right; a node forwards UUIDs larger than its own and drops smaller ones,
+    so only the largest UUID makes it all the way around. Costs O(n^2) messages
+    when the UUIDs decrease around the ring, O(n) when they increase.
+    """
+    name = 'lcr'
+    bidirectional = False  # Only sends to the right
+
+    def start(self, node):
+        """Sends the node's own UUID to start the election."""
+        node.send_message(Message(node.id))
+
+    def on_message(self, node, msg, direction):
+        """Handles an election message. Called with node.state_lock held."""
+        if msg.uid > node.uid:
+            node.send_message(msg)
+        elif msg.uid < node.uid:
+            if node.wants_log(MESSAGE):
+                node.log(f"Message ignored: Received UUID {msg.uuid} is smaller than my UUID {node.id}.", MESSAGE)
+        else:
+            node.log(f"LEADER: My own UUID {node.id} has returned. I am the leader.", EVENT)
+            node.declare_leader()
+
+
+class HirschbergSinclair:
+    """
+    Hirschberg-Sinclair election on a two-way ring, O(n log n) messages whatever
+    the UUID order. In phase k a candidate sends a PROBE 2^k hops both ways. A
+    node passes on probes with a larger UUID and drops smaller ones; the node at
+    distance 2^k turns a probe into a REPLY back to the candidate. A candidate
+    that gets both replies starts the next phase, and one whose probe comes back
+    around the ring to itself is the leader. Every node must run this algorithm.
+    """
+    name = 'hs'
+    bidirectional = True  # Sends to both neighbors
+
+    def __init__(self):
+        self.phase = 0
+        self.replies = 0  # Replies received in the current phase
+
+    def start(self, node):
+        """Sends the first phase's probes."""
+        self.send_probes(node)
+
+    def send_probes(self, node):
+        self.replies = 0
+        for direction in (LEFT, RIGHT):
+            node.send_message(Message(node.id, PROBE, self.phase, 1), direction)
+
+    def on_message(self, node, msg, direction):
+        """
+        Handles a PROBE or REPLY. Called with node.state_lock held.
+
+        Args:
+            node: The node the message arrived at
+            msg: The message
+            direction: The side it arrived from; messages passed on leave by the other side
+        """
+        if msg.flag == PROBE:
+            if msg.uid == node.uid:
+                node.log(f"LEADER: My own probe {node.id} went around the ring. I am the leader.", EVENT)
+                node.declare_leader()
+            elif msg.uid < node.uid:
+                if node.wants_log(MESSAGE):
+                    node.log(f"Message ignored: Received UUID {msg.uuid} is smaller than my UUID {node.id}.",
+                             MESSAGE)
+            elif msg.hops < 2 ** msg.phase:
+                node.send_message(Message(msg.uid, PROBE, msg.phase, msg.hops + 1), opposite(direction))
+            else:
+                node.send_message(Message(msg.uid, REPLY, msg.phase), direction)
+        elif msg.flag == REPLY:
+            if msg.uid != node.uid:
+                node.send_message(msg, opposite(direction))
+            elif msg.phase == self.phase:
+                self.replies += 1
+                if self.replies == 2:
+                    self.phase += 1
+                    node.log(f"Both phase {msg.phase} replies received. Starting phase {self.phase}.")
+                    self.send_probes(node)
+
+
+ALGORITHMS = {algorithm.name: algorithm for algorithm in (LCR, HirschbergSinclair)}
+
+
+class NodeLogger:
+    """
+    Writes a node's log lines from a background thread, so logging never makes
+    the threads handling messages wait for the disk or the terminal. log() just
+    puts the line on a queue.SimpleQueue, which takes no Python-level lock; the
+    writer keeps the file open and writes (and echoes to stdout) everything
+    queued in one go, whenever LOG_FLUSH_BYTES have piled up or the oldest line
+    has waited LOG_FLUSH_INTERVAL seconds.
+    """
+    _CLOSE = object()
+
+    def __init__(self, file_name, level=MESSAGE, sample=1.0, echo=True):
+        """
+        Args:
+            file_name: The log file, opened in append mode
+            level: Lowest level written (MESSAGE, INFO or EVENT)
+            sample: Fraction of MESSAGE lines written, between 0 and 1
+            echo: Whether to print each line as well
+
+        Raises:
+            OSError: If the file cannot be opened
+        """
+        self.file_name = file_name
+        self.level = level
+        self.sample = sample
+        self.echo = echo
+        self.file = open(file_name, 'a')
+        self.queue = queue.SimpleQueue()
+        self.writer = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer.start()
+
+    def wants(self, level):
+        """Tells whether a line at this level would be written, so callers can skip formatting it."""
+        if level < self.level:
+            return False
+        return level != MESSAGE or self.sample >= 1.0 or random.random() < self.sample
+
+    def log(self, message, level=INFO):
+        """Queues a line; the time is taken now, the formatting is left to the writer."""
+        if level >= self.level:
+            self.queue.put((time.time(), message))
+
+    def close(self):
+        """Writes out everything queued and closes the file."""
+        self.queue.put(self._CLOSE)
+        self.writer.join()
+
+    def write_loop(self):
+        pending = []
+        size = 0
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is self._CLOSE:
+                self.flush(pending)
+                self.file.close()
+                return
+            if item is not None:
+                stamp, message = item
+                pending.append((stamp, message))
+                size += len(message)
+                if deadline is None:
+                    deadline = time.monotonic() + LOG_FLUSH_INTERVAL
+            if size >= LOG_FLUSH_BYTES or (deadline is not None and time.monotonic() >= deadline):
+                self.flush(pending)
+                pending = []
+                size = 0
+                deadline = None
+
+    def flush(self, pending):
+        if not pending:
+            return
+        try:
+            self.file.write(''.join(f"[{time.ctime(stamp)}] {message}\n" for stamp, message in pending))
+            self.file.flush()
+        except OSError as e:
+            print(f"FATAL: Could not write to log file {self.file_name}: {e}")
+        if self.echo:
+            sys.stdout.write(''.join(f"[{self.file_name}] {message}\n" for _, message in pending))
+            sys.stdout.flush()
 
 
 class Node:
     """Represents a process in the distributed system."""
     CONFIG_FILE = 'config.txt'
-    CONNECTION_RETRY_DELAY = 10  # seconds
+    RETRY_DELAY_INITIAL = 0.005  # Seconds before the first reconnect attempt; doubles after each round
+    RETRY_DELAY_MAX = 1.0        # Longest wait between rounds of connection attempts
+    CONNECT_TIMEOUT = 0.5        # Seconds to wait for one connection attempt
 
-    def __init__(self, log_file_name):
-        self.id = uuid.uuid4()
+    def __init__(self, log_file_name, server_address=None, neighbor_address=None, node_id=None,
+                 algorithm='lcr', wire='binary', log_level=MESSAGE, log_sample=1.0,
+                 members=None, heartbeat_timeout=HEARTBEAT_TIMEOUT, logger=None):
+        """
+        Args:
+            log_file_name: File to log to, or None to run without logging (simulations)
+            server_address: (ip, port) to listen on; read from CONFIG_FILE if None.
+                            Port 0 picks a free port when open_server() is called.
+            neighbor_address: (ip, port) of the neighbor; read from CONFIG_FILE if None
+            node_id: The node's UUID, or None for a random one
+            algorithm: Election algorithm, a key of ALGORITHMS; all nodes of a ring must agree
+            wire: 'binary' to offer and accept binary records, 'json' to only use JSON lines
+            log_level: Lowest level logged (MESSAGE, INFO or EVENT)
+            log_sample: Fraction of MESSAGE lines logged
+            members: Every node's (ip, port) in ring order, this one's included, so a
+                     node can skip a failed neighbor; None to only use the neighbor
+            heartbeat_timeout: Seconds of silence after which the right neighbor is
+                               taken to have failed (binary links only)
+            logger: A NodeLogger shared with other nodes of this process, used
+                    instead of opening log_file_name; each line is then tagged
+                    with the start of this node's UUID
+        """
+        self.id = node_id if node_id is not None else uuid.uuid4()
+        self.uid = self.id.int  # For comparing with Message.uid
+        self.wire = wire
+        self.binary = {LEFT: False, RIGHT: False}  # Whether each link uses binary records
+        self.algorithm = ALGORITHMS[algorithm]()
         self.log_file_name = log_file_name
-        self.log_lock = threading.Lock()
+        self.logger = logger
+        self.owns_logger = logger is None  # A shared logger is closed by whoever opened it
+        self.log_tag = f"[{self.id.hex[:8]}] " if logger is not None else ''
+        if logger is not None:
+            self.log_file_name = logger.file_name
+        elif log_file_name is not None:
+            try:
+                self.logger = NodeLogger(log_file_name, log_level, log_sample)
+            except OSError as e:
+                print(f"FATAL: Could not open log file {log_file_name}: {e}")
+                sys.exit(1)
         self.state_lock = threading.Lock()
+        self.send_locks = {LEFT: threading.Lock(), RIGHT: threading.Lock()}  # One sender per socket at a time
+        # Messages for a side whose link is down or being replaced, sent once the
+        # next link on that side is up (during a repair the new epoch can reach a
+        # node before its new left neighbor has finished connecting)
+        self.held = {LEFT: collections.deque(maxlen=HELD_MAX), RIGHT: collections.deque(maxlen=HELD_MAX)}
         self.leader_id = None
         self.state = 0
+        self.epoch = 0
+        self.election_started = False
+        self.members = members
+        self.heartbeat_timeout = heartbeat_timeout
         self.server_socket = None
-        self.client_socket = None
+        self.client_socket = None      # Link to the right neighbor
+        self.server_connection = None  # Link from the left neighbor
+        self.links = None  # {LEFT: link, RIGHT: link} replacing the sockets when a simulator delivers messages in memory
         self.client_ready = threading.Event()
+        self.election_begun = threading.Event()  # Set once both links are up and the first election started
         self.shutdown_event = threading.Event()
+        self.leader_elected = threading.Event()  # Set once this node knows the leader
+        self.messages_sent = 0
+        self.bytes_sent = 0
+        self.threads = []
 
         self.log(f"Node initialized with UUID: {self.id}")
         self.log(f"Logging to {self.log_file_name}")
+        self.log(f"Election algorithm: {self.algorithm.name}")
 
+        if server_address is not None and neighbor_address is not None:
+            self.server_ip, self.server_port = server_address
+            self.neighbor_ip, self.neighbor_port = neighbor_address
+            return
         try:
             with open(self.CONFIG_FILE, 'r') as f:
                 server_line = f.readline().strip().split(',')
@@ -55,118 +478,429 @@ class Node:
                 self.neighbor_ip = client_line[0]
                 self.neighbor_port = int(client_line[1])
         except (IOError, IndexError, ValueError) as e:
-            self.log(f"FATAL: Error reading {self.CONFIG_FILE}: {e}")
+            self.log(f"FATAL: Error reading {self.CONFIG_FILE}: {e}", EVENT)
+            self.close_log()
             sys.exit(1)
 
-    def log(self, message):
-        """Writes a message to the node's log file in a thread-safe manner."""
-        with self.log_lock:
-            try:
-                with open(self.log_file_name, 'a') as f:
-                    f.write(f"[{time.ctime()}] {message}\n")
-                print(f"[{self.log_file_name}] {message}")
-            except IOError as e:
-                print(f"FATAL: Could not write to log file {self.log_file_name}: {e}")
+    def log(self, message, level=INFO):
+        """Queues a message for the node's log file; safe to call from any thread."""
+        if self.logger is not None:
+            self.logger.log(self.log_tag + message, level)
 
-    def start_server(self):
-        """Initializes and runs the server functionality."""
+    def wants_log(self, level):
+        """Tells whether a message at this level would be logged, so it need not be formatted otherwise."""
+        return self.logger is not None and self.logger.wants(level)
+
+    def close_log(self):
+        """Writes out the queued log lines and closes the log file."""
+        if self.logger is not None:
+            if self.owns_logger:
+                self.logger.close()
+            self.logger = None
+
+    def open_server(self):
+        """Creates the listening socket, so a neighbor can connect before the server thread runs."""
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.server_socket.bind((self.server_ip, self.server_port))
-        self.server_socket.listen(1)
+        self.server_socket.listen(4)
+        self.server_port = self.server_socket.getsockname()[1]
         self.log(f"Server listening on {self.server_ip}:{self.server_port}")
 
-        try:
-            connection, address = self.server_socket.accept()
+    def start_server(self):
+        """
+        Accepts connections from the left neighbor until shutdown. Each new
+        connection replaces the previous one: it comes from a node that lost its
+        old right neighbor, and closing the old link makes any predecessor it
+        replaces look for its nearest successor again, which is how a node that
+        comes back is taken into the ring again.
+        """
+        if self.server_socket is None:
+            self.open_server()
+
+        while not self.shutdown_event.is_set():
+            try:
+                connection, address = self.server_socket.accept()
+            except OSError:
+                continue  # The listening socket was closed
+            try:
+                connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                if self.wire == 'binary':
+                    connection.sendall(WIRE_OFFER)
+            except OSError:
+                connection.close()  # The neighbor left at once
+                continue
             self.log(f"Accepted connection from {address}")
-            self.listen_for_messages(connection)
-        except OSError:
-            pass # Socket was closed
-        finally:
-            if 'connection' in locals(): connection.close()
+            listener = threading.Thread(target=self.listen_for_messages, args=(connection,))
+            self.threads.append(listener)
+            listener.start()
 
-    def connect_to_neighbor(self):
-        """Initializes the client, retrying indefinitely until shutdown."""
+    def successors(self, lost=None):
+        """
+        Lists the addresses to try as the right neighbor, nearest first.
+
+        Args:
+            lost: Address of the successor whose link just failed. It is put
+                  after the others, since a hung process's kernel still accepts
+                  connections on its behalf.
+
+        Raises:
+            ValueError: If the membership list does not include this node
+        """
+        if not self.members:
+            return [(self.neighbor_ip, self.neighbor_port)]
+        me = self.members.index((self.server_ip, self.server_port))
+        addresses = self.members[me + 1:] + self.members[:me]
+        if lost in addresses and len(addresses) > 1:
+            addresses.remove(lost)
+            addresses.append(lost)
+        return addresses
+
+    def connect_to_successor(self, lost=None):
+        """
+        Connects to the nearest successor that accepts, retrying with exponential
+        backoff from RETRY_DELAY_INITIAL up to RETRY_DELAY_MAX.
+
+        Args:
+            lost: Address of the successor whose link just failed, tried last
+
+        Returns:
+            tuple: (socket, (ip, port)), or (None, None) if the node shut down first
+        """
+        delay = self.RETRY_DELAY_INITIAL
         attempt = 0
         while not self.shutdown_event.is_set():
-            try:
-                self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                self.client_socket.connect((self.neighbor_ip, self.neighbor_port))
-                self.log(f"Connected to neighbor at {self.neighbor_ip}:{self.neighbor_port}")
-                self.client_ready.set()
+            for address in self.successors(lost):
+                try:
+                    sock = socket.create_connection(address, timeout=self.CONNECT_TIMEOUT)
+                except OSError:
+                    continue
+                # Election messages are tiny and answered at once; don't let Nagle hold them back
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                sock.settimeout(None)
+                return sock, address
+            attempt += 1
+            self.log(f"Connection to neighbor refused. Retrying in {delay * 1000:.0f} ms... (Attempt {attempt})")
+            if self.shutdown_event.wait(delay):
+                break
+            delay = min(delay * 2, self.RETRY_DELAY_MAX)
+        return None, None
+
+    def connect_to_neighbor(self):
+        """
+        Keeps a link to the nearest live successor until shutdown: connects,
+        reads from the link until it fails, and connects again, skipping failed
+        successors when there is a membership list. Every reconnection starts a
+        new election, since the ring changed.
+        """
+        connected_before = False
+        address = None
+        while not self.shutdown_event.is_set():
+            sock, address = self.connect_to_successor(lost=address)
+            if sock is None:
                 return
-            except (ConnectionRefusedError, OSError):
-                if self.shutdown_event.is_set(): break
-                attempt += 1
-                self.log(f"Connection to neighbor refused. Retrying... (Attempt {attempt})")
-                time.sleep(self.CONNECTION_RETRY_DELAY)
+            try:
+                binary, pending = self.accept_wire_offer(sock)
+            except OSError:
+                sock.close()
+                continue
+            with self.send_locks[RIGHT]:
+                self.client_socket = sock
+                self.binary[RIGHT] = binary
+                self.send_held(RIGHT)
+            self.log(f"Connected to neighbor at {address[0]}:{address[1]}")
+            self.log(f"Sending {'binary records' if binary else 'JSON'} to the right neighbor")
+            if connected_before:
+                self.log(f"Ring repaired: right neighbor is now {address[0]}:{address[1]}", EVENT)
+                self.restart_election()
+            connected_before = True
+            self.client_ready.set()
+            # Anything the right neighbor sends may need passing on to the left, so
+            # don't read from it before the left link is up
+            self.election_begun.wait()
+
+            self.read_messages(sock, RIGHT, pending)
+            with self.send_locks[RIGHT]:
+                self.client_socket = None
+            close_socket(sock)
+            if not self.shutdown_event.is_set():
+                self.log(f"Lost the right neighbor at {address[0]}:{address[1]}", EVENT)
+
+    def accept_wire_offer(self, sock):
+        """
+        Waits up to WIRE_WAIT seconds for the right neighbor's binary format offer
+        and accepts it.
+
+        Returns:
+            tuple: (True if the link now uses binary records, False for JSON;
+                    the bytes received that were not part of the offer)
+        """
+        if self.wire != 'binary':
+            return False, b''
+        data = b''
+        sock.settimeout(WIRE_WAIT)
+        try:
+            # A neighbor that never offers may send JSON messages instead, so stop
+            # reading as soon as the bytes cannot be the offer
+            while len(data) < len(WIRE_OFFER) and WIRE_OFFER.startswith(data):
+                chunk = sock.recv(len(WIRE_OFFER) - len(data))
+                if not chunk: break
+                data += chunk
+        except socket.timeout:
+            pass  # An older neighbor, which never offers
+        finally:
+            sock.settimeout(None)
+        if data != WIRE_OFFER:
+            return False, data
+        sock.sendall(WIRE_ACCEPT)
+        return True, b''
+
+    def receive_wire_choice(self, connection):
+        """
+        Reads the left neighbor's first bytes to learn whether it accepted the
+        binary format offer.
+
+        Returns:
+            tuple: (True if it did, the bytes received after its answer)
+        """
+        if self.wire != 'binary':
+            return False, b''
+        data = b''
+        connection.settimeout(1.0)
+        while not self.shutdown_event.is_set():
+            # Stop as soon as the bytes can no longer be, or are, a whole WIRE_ACCEPT
+            if len(data) >= len(WIRE_ACCEPT) or not WIRE_ACCEPT.startswith(data):
+                break
+            try:
+                chunk = connection.recv(RECV_SIZE)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            if not chunk: break
+            data += chunk
+        if data.startswith(WIRE_ACCEPT):
+            return True, data[len(WIRE_ACCEPT):]
+        return False, data
 
     def listen_for_messages(self, connection):
         """Listens for incoming messages from the neighbor."""
-        self.log("Server thread waiting for client connection...")
-        self.client_ready.wait()
-        
-        if self.client_socket:
-            self.log("Client connected. Sending initial message.")
-            self.send_message(Message(self.id))
-        
-        buffer = ""
+        # Learn the left link's format before anything is sent on it
+        binary, pending = self.receive_wire_choice(connection)
+        with self.send_locks[LEFT]:
+            previous = self.server_connection
+            self.server_connection = connection
+            self.binary[LEFT] = binary
+            self.send_held(LEFT)
+        if previous is not None:
+            self.log("A new left neighbor replaces the previous one.")
+            close_socket(previous)
+        self.log(f"Receiving {'binary records' if binary else 'JSON'} from the left neighbor")
+
+        with self.state_lock:
+            first = not self.election_started
+            self.election_started = True
+        if first:
+            self.log("Server thread waiting for client connection...")
+            self.client_ready.wait()
+            if self.client_socket and not self.shutdown_event.is_set():
+                self.log("Client connected. Sending initial message.")
+                self.start_election()
+            self.election_begun.set()
+
+        try:
+            self.read_messages(connection, LEFT, pending)
+        finally:
+            with self.send_locks[LEFT]:
+                if self.server_connection is connection:
+                    self.server_connection = None
+            close_socket(connection)
+
+    def read_messages(self, connection, direction, pending=b''):
+        """
+        Reads messages from one neighbor until the connection closes or the node
+        shuts down. A binary link from the right neighbor carries its heartbeats,
+        so going silent on it for heartbeat_timeout seconds also ends the loop.
+
+        Args:
+            connection: The socket to read
+            direction: Which neighbor is at the other end
+            pending: Bytes already received on the connection
+        """
+        decode = Message.decode_binary if self.binary[direction] else Message.decode_json
+        buffer = bytearray(pending)
+        watch = direction == RIGHT and self.binary[RIGHT]
+        connection.settimeout(self.heartbeat_timeout if watch else 1.0)
         while not self.shutdown_event.is_set():
             try:
-                connection.settimeout(1.0)
-                data = connection.recv(1024).decode('utf-8')
+                messages, used = decode(buffer)
+                del buffer[:used]
+                for msg in messages:
+                    if msg.flag != HEARTBEAT:
+                        self.handle_message(msg, direction)
+                data = connection.recv(RECV_SIZE)
                 if not data: break
                 buffer += data
-                while "\n" in buffer:
-                    line, buffer = buffer.split('\n', 1)
-                    msg = Message.from_json(line)
-                    self.log_received(msg)
-                    self.process_message(msg)
             except socket.timeout:
+                if watch:
+                    self.log(f"No heartbeat from the right neighbor for {self.heartbeat_timeout * 1000:.0f} ms.",
+                             EVENT)
+                    break
                 continue
-            except (json.JSONDecodeError, socket.error, OSError):
+            except (ValueError, KeyError, socket.error, OSError):
                 break
-        self.log("Ending listen loop.")
+        self.log(f"Ending listen loop ({direction} neighbor).")
 
-    def send_message(self, message):
-        """Sends a message to the neighbor."""
-        if not self.client_socket: return
-        try:
-            self.client_socket.sendall(message.to_json().encode('utf-8'))
+    def send_heartbeats(self):
+        """
+        Sends a HEARTBEAT to the left neighbor HEARTBEATS_PER_TIMEOUT times per
+        heartbeat timeout, so it can tell a hung or unreachable node from a quiet one.
+        """
+        record = Message(self.uid, HEARTBEAT).to_bytes()
+        while not self.shutdown_event.wait(self.heartbeat_timeout / HEARTBEATS_PER_TIMEOUT):
+            with self.send_locks[LEFT]:
+                if self.server_connection is None or not self.binary[LEFT]:
+                    continue
+                try:
+                    self.server_connection.sendall(record)
+                except OSError:
+                    pass  # The listener notices the broken link
+
+    def start_election(self):
+        """Starts an election using the node's election algorithm."""
+        with self.state_lock:
+            self.algorithm.start(self)
+
+    def handle_message(self, msg, direction=LEFT):
+        """Logs and processes one message received from a neighbor."""
+        self.log_received(msg)
+        self.process_message(msg, direction)
+
+    def send_message(self, message, direction=RIGHT):
+        """Sends a message of the current epoch to the neighbor on the given side, in that link's format."""
+        message.epoch = self.epoch
+        if self.links is not None:
+            data = self.encode(message, direction)
+            self.links[direction].send(data)
+            self.messages_sent += 1
+            self.bytes_sent += len(data)
             self.log_sent(message)
-        except socket.error as e:
-            self.log(f"Error sending message: {e}")
+            return
+        with self.send_locks[direction]:
+            connection = self.client_socket if direction == RIGHT else self.server_connection
+            if not connection:
+                self.held[direction].append(message)
+                return
+            data = self.encode(message, direction)
+            try:
+                connection.sendall(data)
+            except socket.error as e:
+                self.log(f"Error sending message: {e}")
+                self.held[direction].append(message)
+                return
+        self.messages_sent += 1
+        self.bytes_sent += len(data)
+        self.log_sent(message)
+
+    def encode(self, message, direction):
+        """Serializes a message in the format of the link on the given side."""
+        return message.to_bytes() if self.binary[direction] else message.to_json().encode('utf-8')
 
-    def process_message(self, msg):
-        """Implements the leader election logic."""
-        msg_uuid = uuid.UUID(msg.uuid)
+    def send_held(self, direction):
+        """
+        Sends the messages held for a side over its new link. Called with that
+        side's send lock held, right after the link is set. Messages from an
+        epoch that is over by now are dropped by the receiver.
+        """
+        connection = self.client_socket if direction == RIGHT else self.server_connection
+        held = self.held[direction]
+        if not held:
+            return
+        messages = list(held)
+        held.clear()
+        data = b''.join(self.encode(msg, direction) for msg in messages)
+        try:
+            connection.sendall(data)
+        except OSError as e:
+            self.log(f"Error sending held messages: {e}")
+            return
+        self.log(f"Sent {len(messages)} held messages to the {direction} neighbor.")
+        self.messages_sent += len(messages)
+        self.bytes_sent += len(data)
+        for msg in messages:
+            self.log_sent(msg)
+
+    def process_message(self, msg, direction=LEFT):
+        """
+        Implements the leader election logic: leader announcements are handled
+        here, everything else by the election algorithm.
+
+        Args:
+            msg: The received message
+            direction: The side it arrived from
+        """
         with self.state_lock:
+            if msg.epoch != self.epoch:
+                if not 0 < (msg.epoch - self.epoch) % EPOCHS < EPOCHS // 2:
+                    if self.wants_log(MESSAGE):
+                        self.log(f"Message ignored: It is from epoch {msg.epoch}, before epoch {self.epoch}.",
+                                 MESSAGE)
+                    return
+                # Another node repaired the ring; its REELECT, or a message sent
+                # after it, got here first
+                self.log(f"Epoch {msg.epoch} started elsewhere in the ring. Electing again.", EVENT)
+                self.enter_epoch(msg.epoch)
+            if msg.flag == REELECT:
+                return  # Dropped once every node has seen it
+
             if self.state == 1:
-                self.log(f"Message ignored: Leader is already known to be {self.leader_id}")
+                if self.wants_log(MESSAGE):
+                    self.log(f"Message ignored: Leader is already known to be {self.leader_id}", MESSAGE)
                 return
             
-            if msg.flag == 1:
-                self.log(f"Announcement received. Leader is {msg.uuid}")
+            if msg.flag == LEADER:
+                self.log(f"Announcement received. Leader is {msg.uuid}", EVENT)
                 self.state = 1
-                self.leader_id = msg_uuid
-                self.log(f"leader is {self.leader_id}") 
+                self.leader_id = uuid.UUID(int=msg.uid)
+                self.leader_elected.set()
+                self.log(f"leader is {self.leader_id}", EVENT)
                 self.send_message(msg)
                 return
-            
-            if msg_uuid > self.id:
-                self.send_message(msg)
-            elif msg_uuid < self.id:
-                self.log(f"Message ignored: Received UUID {msg_uuid} is smaller than my UUID {self.id}.")
-            elif msg_uuid == self.id:
-                self.log(f"LEADER: My own UUID {self.id} has returned. I am the leader.")
-                self.leader_id = self.id
-                self.state = 1
-                self.log(f"leader is {self.leader_id}")
-                self.send_message(Message(self.id, flag=1))
+
+            self.algorithm.on_message(self, msg, direction)
+
+    def restart_election(self):
+        """Starts an election in the next epoch, after this node repaired the ring."""
+        with self.state_lock:
+            self.enter_epoch((self.epoch + 1) % EPOCHS)
+
+    def enter_epoch(self, epoch):
+        """
+        Forgets the leader, passes REELECT on to the right and starts electing
+        in the given epoch. Called with state_lock held.
+        """
+        self.epoch = epoch
+        self.state = 0
+        self.leader_id = None
+        self.leader_elected.clear()
+        self.algorithm = type(self.algorithm)()
+        self.log(f"Starting election epoch {epoch}.")
+        self.send_message(Message(self.id, REELECT))
+        self.algorithm.start(self)
+
+    def declare_leader(self):
+        """Makes this node the leader and announces it to the right. Called with state_lock held."""
+        self.leader_id = self.id
+        self.state = 1
+        self.leader_elected.set()
+        self.log(f"leader is {self.leader_id}", EVENT)
+        self.send_message(Message(self.id, flag=LEADER))
 
     def log_received(self, msg):
         """Logs received messages, safely reading state."""
-        comparison = "greater" if uuid.UUID(msg.uuid) > self.id else "less" if uuid.UUID(msg.uuid) < self.id else "same"
+        if not self.wants_log(MESSAGE):
+            return
+        comparison = "greater" if msg.uid > self.uid else "less" if msg.uid < self.uid else "same"
         with self.state_lock:
             current_state = self.state
             current_leader_id = self.leader_id
@@ -174,35 +908,60 @@ class Node:
         log_msg = f"Received: uuid={msg.uuid}, flag={msg.flag}, {comparison}, state={current_state}"
         if current_state == 1:
             log_msg += f", leader_id={current_leader_id}"
-        self.log(log_msg)
+        self.log(log_msg, MESSAGE)
 
     def log_sent(self, msg):
         """Logs sent messages."""
-        self.log(f"Sent: uuid={msg.uuid}, flag={msg.flag}")
+        if not self.wants_log(MESSAGE):
+            return
+        if msg.flag in (PROBE, REPLY):
+            self.log(f"Sent: uuid={msg.uuid}, flag={msg.flag}, phase={msg.phase}, hops={msg.hops}", MESSAGE)
+        else:
+            self.log(f"Sent: uuid={msg.uuid}, flag={msg.flag}", MESSAGE)
 
-    def run(self):
-        """Starts threads and waits for Ctrl+C to shut down."""
+    def start(self):
+        """Starts the server, client and heartbeat threads and returns at once."""
+        if self.server_socket is None:
+            self.open_server()  # Listen before connecting, so a neighbor that connects back is not refused
         threads = [
             threading.Thread(target=self.start_server),
-            threading.Thread(target=self.connect_to_neighbor)
+            threading.Thread(target=self.connect_to_neighbor),
+            threading.Thread(target=self.send_heartbeats),
         ]
-        
+        self.threads.extend(threads)
         for t in threads:
             t.start()
 
+    def stop(self, wait=True):
+        """
+        Signals the threads to stop and closes the sockets. When waiting for the
+        threads, the log is written out and closed as well.
+
+        Args:
+            wait: Whether to wait for the threads to finish
+        """
+        self.shutdown_event.set()
+        self.client_ready.set()  # Wakes a listener still waiting for the first right link
+        self.election_begun.set()
+        self.log("Cleaning up resources...")
+        for sock in (self.server_socket, self.client_socket, self.server_connection):
+            if sock: close_socket(sock)
+        if wait:
+            for t in list(self.threads):
+                t.join()
+            self.log("Shutdown complete.")
+            self.close_log()
+
+    def run(self):
+        """Starts threads and waits for Ctrl+C to shut down."""
+        self.start()
         try:
-            while any(t.is_alive() for t in threads):
+            while any(t.is_alive() for t in self.threads):
                 time.sleep(1)
         except KeyboardInterrupt:
             self.log("Ctrl+C detected. Initiating shutdown...")
         finally:
-            self.shutdown_event.set()
-            self.log("Cleaning up resources...")
-            if self.server_socket: self.server_socket.close()
-            if self.client_socket: self.client_socket.close()
-            for t in threads:
-                t.join()
-            self.log("Shutdown complete.")
+            self.stop()
 
 
 def find_next_log_file():
@@ -224,9 +983,42 @@ def find_next_log_file():
             log_num += 1
 
 def main():
+    parser = argparse.ArgumentParser(description="Leader election node for a ring described by config.txt")
+    parser.add_argument('--algorithm', choices=sorted(ALGORITHMS), default='lcr',
+                        help="lcr: Chang-Roberts, one-way; hs: Hirschberg-Sinclair, two-way. "
+                             "Every node of the ring must use the same one (default: lcr)")
+    parser.add_argument('--wire', choices=['binary', 'json'], default='binary',
+                        help="binary: offer and accept 17-byte binary records, falling back to JSON "
+                             "with neighbors that don't; json: JSON lines only (default: binary)")
+    parser.add_argument('--log-level', choices=list(LOG_LEVELS), default='message',
+                        help="message: log every message sent and received; info: only connections "
+                             "and other node events; event: only leader changes (default: message)")
+    parser.add_argument('--log-sample', type=float, default=1.0,
+                        help="Fraction of per-message lines to log, e.g. 0.01; leader changes are "
+                             "always logged (default: 1.0)")
+    parser.add_argument('--members', default=None,
+                        help="File listing every node's ip,port in ring order, so a node can skip "
+                             "a failed neighbor and connect to the next live one")
+    parser.add_argument('--heartbeat-timeout', type=float, default=HEARTBEAT_TIMEOUT,
+                        help=f"Seconds of silence after which the right neighbor counts as failed "
+                             f"(default: {HEARTBEAT_TIMEOUT})")
+    args = parser.parse_args()
+    members = None
+    if args.members:
+        try:
+            members = read_members(args.members)
+        except (OSError, ValueError) as e:
+            print(f"FATAL: Error reading {args.members}: {e}")
+            sys.exit(1)
     log_file_path = find_next_log_file()
     
-    node = Node(log_file_path)
+    node = Node(log_file_path, algorithm=args.algorithm, wire=args.wire,
+                log_level=LOG_LEVELS[args.log_level], log_sample=args.log_sample,
+                members=members, heartbeat_timeout=args.heartbeat_timeout)
+    if members and (node.server_ip, node.server_port) not in members:
+        node.log(f"FATAL: {node.server_ip},{node.server_port} is not listed in {args.members}", EVENT)
+        node.close_log()
+        sys.exit(1)
     node.run()
 
 
@@ -0,0 +1,275 @@
+# asyncget.py
+# Batch mode for secureget.py: fetches many URLs at once with asyncio.
+#
+# Each URL gets its own task, which opens a TLS connection with
+# asyncio.open_connection(), sends a GET and streams the body to its own file
+# through ResponseParser, as secureget.stream_secure_request() does. While one
+# task waits for its server the others run, so a batch takes about as long as
+# its slowest few URLs instead of the sum of all of them.
+#
+# Two kinds of semaphore bound how many fetches run at once: one for the whole
+# batch, so hundreds of URLs don't open hundreds of sockets, and one per host,
+# so no single server gets flooded. A task takes its host's semaphore first;
+# otherwise tasks queued for a busy host would hold batch slots that fetches
+# from other hosts could be using.
+#
+# With an HttpCache, a URL with a fresh cached copy is served from disk without
+# waiting for a slot, and one with a stale copy is asked for only if it changed.
+#
+# Run through secureget.py:
+#     python3 secureget.py --batch urls.txt --output-dir pages
+#     cat urls.txt | python3 secureget.py --batch - --concurrency 64 --per-host 4
+
+import asyncio
+import collections
+import os
+import sys
+import time
+
+from httpresponse import ResponseParser, build_request
+from httpcache import cache_key
+from secureget import RECV_SIZE, WRITE_BUFFER, make_context, output_name, parse_url, request_headers
+
+CONCURRENCY = 32  # Fetches running at once in the whole batch
+PER_HOST = 6      # Fetches running at once against one host, as browsers allow
+TIMEOUT = 30.0    # Seconds to wait for a connection, or for the server to send anything
+
+
+def read_urls(source):
+    """
+    Reads URLs, one per line. Blank lines and lines starting with '#' are skipped.
+
+    Args:
+        source (str): A file name, or '-' for standard input
+
+    Returns:
+        list[str]: The URLs
+    """
+    if source == '-':
+        lines = sys.stdin.readlines()
+    else:
+        with open(source) as f:
+            lines = f.readlines()
+    return [line.strip() for line in lines if line.strip() and not line.lstrip().startswith('#')]
+
+
+def output_names(urls, output_dir):
+    """
+    Picks the file each URL's body is saved to: output_name(url) in output_dir,
+    with -2, -3, ... added when the same name comes up again.
+
+    Returns:
+        list[str]: One file name per URL, or None for a URL that isn't valid
+    """
+    seen = collections.Counter()
+    filenames = []
+    for url in urls:
+        try:
+            name = output_name(url)
+        except ValueError:
+            filenames.append(None)
+            continue
+        seen[name] += 1
+        if seen[name] > 1:
+            stem, dot, extension = name.rpartition('.')
+            name = f"{stem}-{seen[name]}.{extension}" if dot else f"{name}-{seen[name]}"
+        filenames.append(os.path.join(output_dir, name))
+    return filenames
+
+
+async def download(host, port, path, headers, filename, context, timeout, compress, result, start):
+    """
+    Sends one GET and streams the response's body to filename.part, which
+    replaces filename once the body is complete. A 304 has no body, so then the
+    file is left as it was.
+
+    Args:
+        host (str): The server hostname
+        port (int): The port to connect to
+        path (str): The path to request
+        headers (dict): The extra request headers
+        filename (str): The file to write the body to
+        context (ssl.SSLContext): The context for the TLS connection
+        timeout (float): Seconds to wait for the connection, or for each read
+        compress (bool): Whether to decode a gzip or deflate compressed body
+        result (dict): fetch()'s result, whose ttfb and wire_bytes are filled in
+        start (float): When the fetch started, a time.perf_counter(), for ttfb
+
+    Returns:
+        ResponseParser: The parsed response
+
+    Raises:
+        asyncio.TimeoutError: If the server took longer than timeout
+        OSError: If the connection or the file fails
+        ValueError: If the response is malformed
+    """
+    parser = ResponseParser(decode=compress)
+    writer = None
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=context, server_hostname=host), timeout)
+        writer.write(build_request(host, path, headers))
+        with open(filename + '.part', 'wb', buffering=WRITE_BUFFER) as f:
+            while not parser.done:
+                data = await asyncio.wait_for(reader.read(RECV_SIZE), timeout)
+                if result['ttfb'] is None:
+                    result['ttfb'] = time.perf_counter() - start
+                for piece in parser.feed(data) if data else parser.feed_eof():
+                    f.write(piece)
+        if parser.status != 304:
+            os.replace(filename + '.part', filename)
+    finally:
+        result['wire_bytes'] += parser.wire_bytes
+        if writer is not None:
+            if parser.done:
+                writer.close()
+            else:
+                writer.transport.abort()  # close() would wait for a TLS goodbye the server may never send
+        if os.path.exists(filename + '.part'):
+            os.remove(filename + '.part')
+    return parser
+
+
+async def fetch(url, filename, context, batch_limit, host_limits, timeout, compress=True, cache=None):
+    """
+    Fetches one URL and streams its body to a file, decoded if it was
+    compressed. Errors are reported in the result instead of raised, so one bad
+    URL doesn't stop the batch.
+
+    Args:
+        url (str): The URL
+        filename (str): The file to write the body to
+        context (ssl.SSLContext): The context for the TLS connection
+        batch_limit (asyncio.Semaphore): Bounds the fetches running in the batch
+        host_limits (dict): (host, port) -> asyncio.Semaphore bounding the fetches per host
+        timeout (float): Seconds to wait for the connection, or for each read
+        compress (bool): Whether to ask for a gzip or deflate compressed body
+        cache (HttpCache): The cache to use, or None
+
+    Returns:
+        dict: url, filename, status, wire_bytes, body_bytes (as sent),
+              decoded_bytes (as saved), encoding, ttfb (seconds from
+              starting to connect to the first response byte), seconds (the
+              whole fetch, not counting time waiting for a slot), cache (as
+              in SecureClient.fetch()) and error (None on success)
+    """
+    result = {'url': url, 'filename': filename, 'status': None, 'wire_bytes': 0, 'body_bytes': 0,
+              'decoded_bytes': 0, 'encoding': None, 'ttfb': None, 'seconds': None, 'cache': None, 'error': None}
+    try:
+        host, port, path = parse_url(url)
+    except ValueError as e:
+        result['error'] = str(e)
+        return result
+
+    key = cache_key(host, port, path)
+    headers = request_headers(compress, 'close')
+    start = time.perf_counter()
+    try:
+        entry = cache.lookup(key) if cache is not None else None
+        if entry is not None and cache.is_fresh(entry):
+            result.update(status=entry['status'], decoded_bytes=cache.serve(key, entry, filename), ttfb=0.0,
+                          seconds=time.perf_counter() - start, cache='hit')
+            return result
+    except OSError as e:
+        result['error'] = str(e) or type(e).__name__
+        return result
+
+    async with host_limits[(host, port)], batch_limit:
+        start = time.perf_counter()
+        try:
+            validators = cache.validators(entry) if entry is not None else {}
+            parser = await download(host, port, path, {**headers, **validators}, filename, context, timeout,
+                                    compress, result, start)
+            if parser.status == 304 and cache is not None:
+                # Other tasks ran while this one waited for the server, and one of
+                # them may have evicted the copy to make room for what it stored
+                entry = cache.lookup(key)
+                if entry is None:
+                    parser = await download(host, port, path, headers, filename, context, timeout,
+                                            compress, result, start)
+            result.update(status=parser.status, body_bytes=parser.body_bytes, decoded_bytes=parser.decoded_bytes,
+                          encoding=parser.decoding)
+            if parser.status == 304 and entry is not None:  # The cached copy is current
+                cache.revalidated(key, entry, parser.headers)
+                result['decoded_bytes'] = cache.serve(key, entry, filename)
+                result['cache'] = 'revalidated'
+            elif cache is not None and cache.store(key, parser.status, parser.reason, parser.headers, filename):
+                result['cache'] = 'stored'
+        except asyncio.TimeoutError:
+            result['error'] = f"timed out after {timeout:g} s"
+        except (OSError, ValueError) as e:
+            result['error'] = str(e) or type(e).__name__
+        result['seconds'] = time.perf_counter() - start
+    return result
+
+
+async def fetch_batch(urls, output_dir='.', cafile=None, concurrency=CONCURRENCY, per_host=PER_HOST,
+                      timeout=TIMEOUT, compress=True, cache=None):
+    """
+    Fetches every URL concurrently, saving each body to its own file in output_dir.
+
+    Args:
+        urls (list[str]): The URLs
+        output_dir (str): Directory to save the bodies to; created if missing
+        cafile (str): Extra CA certificates to trust
+        concurrency (int): Fetches running at once in the whole batch
+        per_host (int): Fetches running at once against one host
+        timeout (float): Seconds to wait for a connection, or for each read
+        compress (bool): Whether to ask for gzip or deflate compressed bodies
+        cache (HttpCache): The cache to use, or None
+
+    Returns:
+        list[dict]: fetch()'s result for each URL, in the order given
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    context = make_context(cafile)
+    batch_limit = asyncio.Semaphore(concurrency)
+    host_limits = collections.defaultdict(lambda: asyncio.Semaphore(per_host))
+    return await asyncio.gather(*(fetch(url, filename, context, batch_limit, host_limits, timeout, compress, cache)
+                                  for url, filename in zip(urls, output_names(urls, output_dir))))
+
+
+def print_summary(results, seconds):
+    """
+    Prints a line per URL and the totals.
+
+    Args:
+        results (list[dict]): fetch_batch()'s results
+        seconds (float): How long the whole batch took
+    """
+    width = min(60, max(len(result['url']) for result in results))
+    print(f"{'URL':<{width}}  {'status':>6}  {'encoding':>8}  {'wire bytes':>10}  {'saved bytes':>11}  "
+          f"{'TTFB ms':>8}  {'total ms':>8}  cache")
+    for result in results:
+        url = result['url'] if len(result['url']) <= width else result['url'][:width - 3] + '...'
+        if result['error']:
+            print(f"{url:<{width}}  failed: {result['error']}")
+            continue
+        print(f"{url:<{width}}  {result['status']:>6}  {result['encoding'] or '-':>8}  {result['wire_bytes']:>10}  "
+              f"{result['decoded_bytes']:>11}  {result['ttfb'] * 1000:>8.1f}  {result['seconds'] * 1000:>8.1f}  "
+              f"{result['cache'] or '-'}")
+
+    fetched = [result for result in results if result['seconds'] is not None]
+    failed = sum(1 for result in results if result['error'])
+    print(f"{len(results)} URLs ({failed} failed) in {seconds:.2f} s: {sum(result['wire_bytes'] for result in results)} "
+          f"bytes on the wire for {sum(result['decoded_bytes'] for result in results)} of content.")
+    cached = sum(1 for result in results if result['cache'] in ('hit', 'revalidated'))
+    if cached:
+        print(f"{cached} of them came from the cache.")
+    if fetched:
+        print(f"The slowest took {max(result['seconds'] for result in fetched):.2f} s; one after another "
+              f"they would have taken about {sum(result['seconds'] for result in fetched):.2f} s.")
+
+
+def run_batch(urls, output_dir='.', cafile=None, concurrency=CONCURRENCY, per_host=PER_HOST, timeout=TIMEOUT,
+              compress=True, cache=None):
+    """
+    Runs fetch_batch() and prints its summary.
+
+    Returns:
+        list[dict]: fetch_batch()'s results
+    """
+    start = time.perf_counter()
+    results = asyncio.run(fetch_batch(urls, output_dir, cafile, concurrency, per_host, timeout, compress, cache))
+    print_summary(results, time.perf_counter() - start)
+    return results
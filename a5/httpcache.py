@@ -0,0 +1,253 @@
+# httpcache.py
+# An on-disk HTTP cache for secureget.py, keyed by URL.
+#
+# A saved response is kept with its validators (ETag and Last-Modified) and the
+# time it stays fresh (Cache-Control: max-age, or Expires). Fetching the URL
+# again then costs:
+#     nothing on the network  while the copy is fresh: it is copied from disk;
+#     a few hundred bytes     after that, if it has validators: the request
+#                             carries If-None-Match / If-Modified-Since, and a
+#                             "304 Not Modified" answer means the copy is used;
+#     a full download         otherwise, and the new copy replaces the old one.
+#
+# The bodies are stored decoded, one file each, next to an index.json holding
+# what's known about them. The index is kept in least recently used order, and
+# the oldest entries are dropped whenever the bodies take more than max_bytes.
+# It is read when the cache is opened and written when it is closed, so use it
+# as a context manager:
+#     with HttpCache('.secureget-cache') as cache:
+#         ...
+
+import email.utils
+import hashlib
+import json
+import os
+import shutil
+import time
+
+CACHE_DIR = '.secureget-cache'
+MAX_BYTES = 50 * 1024 * 1024  # Space the cached bodies may take
+INDEX = 'index.json'
+
+
+def cache_key(host, port, path):
+    """
+    Makes the key a URL is cached under, the same however the URL was written.
+
+    Returns:
+        str: e.g. 'https://www.google.com/' or 'https://localhost:8443/page'
+    """
+    return f"https://{host}{'' if port == 443 else f':{port}'}{path}"
+
+
+def cache_control(headers):
+    """
+    Parses the Cache-Control header.
+
+    Args:
+        headers (dict): Response headers, names in lower case
+
+    Returns:
+        dict: directive -> value (None for directives without one), e.g. {'max-age': '600', 'public': None}
+    """
+    directives = {}
+    for directive in headers.get('cache-control', '').split(','):
+        name, sep, value = directive.partition('=')
+        if name.strip():
+            directives[name.strip().lower()] = value.strip().strip('"') if sep else None
+    return directives
+
+
+def freshness_lifetime(headers):
+    """
+    Works out how long a response can be used without asking the server again.
+
+    Args:
+        headers (dict): Response headers, names in lower case
+
+    Returns:
+        float: Seconds from now; 0 if it must be revalidated every time
+    """
+    directives = cache_control(headers)
+    if 'no-cache' in directives or 'no-store' in directives:
+        return 0.0
+    try:
+        if 'max-age' in directives:
+            lifetime = float(directives['max-age'])
+        elif 'expires' in headers:
+            expires = email.utils.parsedate_to_datetime(headers['expires']).timestamp()
+            date = email.utils.parsedate_to_datetime(headers['date']).timestamp() if 'date' in headers else time.time()
+            lifetime = expires - date
+        else:
+            return 0.0
+        lifetime -= float(headers.get('age', 0))  # Time it already spent in caches on the way
+    except (TypeError, ValueError):
+        return 0.0  # A malformed date or number: don't trust it
+    return max(0.0, lifetime)
+
+
+class HttpCache:
+    """
+    The cache: a directory of response bodies and their index.
+
+    Entries are dicts with file (the body's file name in the directory), size,
+    status, reason, etag, last_modified, fresh_until (a time.time()) and stored.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_BYTES):
+        """
+        Args:
+            directory (str): Where to keep the cache; created if missing
+            max_bytes (int): Space the cached bodies may take
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries = {}  # key -> entry, least recently used first
+        self.changed = False
+        os.makedirs(directory, exist_ok=True)
+        try:
+            with open(os.path.join(directory, INDEX)) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            pass  # No cache yet, or a damaged index: start empty
+        self.size = sum(entry['size'] for entry in self.entries.values())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Writes the index if it changed."""
+        if not self.changed:
+            return
+        path = os.path.join(self.directory, INDEX)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(path + '.tmp', path)  # Never leave a half-written index behind
+        self.changed = False
+
+    def lookup(self, key):
+        """
+        Finds the cached response for a URL.
+
+        Returns:
+            dict: The entry, or None if the URL isn't cached
+        """
+        entry = self.entries.get(key)
+        if entry is not None and not os.path.exists(self._path(entry)):
+            self._remove(key)  # The body was deleted behind our back
+            return None
+        return entry
+
+    @staticmethod
+    def is_fresh(entry):
+        """Whether an entry can be used without asking the server."""
+        return time.time() < entry['fresh_until']
+
+    @staticmethod
+    def validators(entry):
+        """
+        Makes the headers that ask the server whether an entry is still current.
+
+        Returns:
+            dict: If-None-Match and/or If-Modified-Since, as far as the entry has validators
+        """
+        headers = {}
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def serve(self, key, entry, filename):
+        """
+        Copies a cached body to a file and marks the entry as just used.
+
+        Returns:
+            int: The body's size
+        """
+        shutil.copyfile(self._path(entry), filename)
+        self.entries[key] = self.entries.pop(key)  # Now the most recently used
+        self.changed = True
+        return entry['size']
+
+    def revalidated(self, key, entry, headers):
+        """
+        Records a 304 Not Modified answer: the entry is current, and the headers
+        sent with the 304 say how long it now stays fresh.
+
+        Args:
+            key (str): The URL's cache key
+            entry (dict): Its entry
+            headers (dict): The 304 response's headers, names in lower case
+        """
+        entry['fresh_until'] = time.time() + freshness_lifetime(headers)
+        entry['etag'] = headers.get('etag', entry['etag'])
+        entry['last_modified'] = headers.get('last-modified', entry['last_modified'])
+        self.changed = True
+
+    def store(self, key, status, reason, headers, filename):
+        """
+        Caches a response whose body has been saved to a file, if it may be
+        cached and would be of use: a 200 with validators or a freshness lifetime,
+        without Cache-Control: no-store, and smaller than the whole cache.
+
+        Args:
+            key (str): The URL's cache key
+            status (int): The response's status code
+            reason (str): Its reason phrase
+            headers (dict): Its headers, names in lower case
+            filename (str): The file its (decoded) body was saved to
+
+        Returns:
+            bool: Whether it was cached
+        """
+        lifetime = freshness_lifetime(headers)
+        etag = headers.get('etag')
+        last_modified = headers.get('last-modified')
+        size = os.path.getsize(filename)
+        if (status != 200 or 'no-store' in cache_control(headers) or size > self.max_bytes
+                or not (lifetime or etag or last_modified)):
+            if key in self.entries:
+                self._remove(key)  # What's cached is out of date, and this can't replace it
+            return False
+
+        if key in self.entries:
+            self._remove(key)
+        entry = {
+            'file': hashlib.sha256(key.encode()).hexdigest()[:32] + '.body',
+            'size': size,
+            'status': status,
+            'reason': reason,
+            'etag': etag,
+            'last_modified': last_modified,
+            'fresh_until': time.time() + lifetime,
+            'stored': time.time(),
+        }
+        shutil.copyfile(filename, self._path(entry))
+        self.entries[key] = entry
+        self.size += size
+        self.changed = True
+        self._evict()
+        return True
+
+    def _evict(self):
+        """Drops the least recently used entries until the bodies fit in max_bytes."""
+        while self.size > self.max_bytes:
+            self._remove(next(iter(self.entries)))
+
+    def _remove(self, key):
+        """Drops an entry and its body."""
+        entry = self.entries.pop(key)
+        self.size -= entry['size']
+        self.changed = True
+        try:
+            os.remove(self._path(entry))
+        except FileNotFoundError:
+            pass
+
+    def _path(self, entry):
+        """The path of an entry's body."""
+        return os.path.join(self.directory, entry['file'])
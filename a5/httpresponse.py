@@ -0,0 +1,369 @@
+# httpresponse.py
+# Incremental HTTP/1.1 response parsing for secureget.py.
+#
+# ResponseParser is fed a response's bytes as they arrive, in pieces of any size,
+# and hands back the body as soon as the framing allows:
+#     Content-Length: N            the next N bytes
+#     Transfer-Encoding: chunked   "<hex size>\r\n<data>\r\n" ... "0\r\n<trailers>\r\n"
+#     neither                      everything until the server closes the connection
+# so a caller can write the body out while it downloads instead of holding the
+# whole response. The body pieces are memoryviews of the bytes just fed, so the
+# body is never copied; only the status line, the headers and the chunk size
+# lines are buffered, and those are small.
+#
+# With decode=True a body sent with Content-Encoding: gzip or deflate (which a
+# request asks for with Accept-Encoding: ACCEPT_ENCODING) is decompressed as it
+# arrives by a ContentDecoder, and the pieces handed back are the decoded bytes.
+
+import re
+import zlib
+
+ACCEPT_ENCODING = 'gzip, deflate'  # The Content-Encodings ContentDecoder understands
+
+MAX_HEAD = 64 * 1024  # Longest status line and headers accepted
+MAX_LINE = 4 * 1024   # Longest chunk size or trailer line accepted
+HEX_SIZE = re.compile(rb'[0-9A-Fa-f]+')  # A chunk size; int(..., 16) alone would also take '-5', '+5' or '0x5'
+
+# Parser states
+HEAD = 'head'                # Reading the status line and headers
+LENGTH = 'length'            # Reading a Content-Length body
+CHUNK_SIZE = 'chunk-size'    # Reading a chunk's size line
+CHUNK_DATA = 'chunk-data'    # Reading a chunk's data
+CHUNK_END = 'chunk-end'      # Reading the CRLF after a chunk's data
+TRAILERS = 'trailers'        # Reading the trailer lines after the last chunk
+UNTIL_CLOSE = 'until-close'  # Reading a body that ends when the connection does
+DONE = 'done'
+
+
+def build_request(host, path='/', headers=None):
+    """
+    Builds a GET request.
+
+    Args:
+        host: The server's hostname, for the Host header
+        path: The path and query to request
+        headers: Extra headers, as a dict
+
+    Returns:
+        bytes: The request, ending with the blank line
+    """
+    lines = [f"GET {path} HTTP/1.1", f"Host: {host}"]
+    lines.extend(f"{name}: {value}" for name, value in (headers or {}).items())
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+
+class ContentDecoder:
+    """
+    Streaming decoder for a gzip or deflate Content-Encoding, built on
+    zlib.decompressobj(), so a compressed body is decoded piece by piece as it
+    arrives instead of all at once at the end.
+    """
+
+    def __init__(self, encoding):
+        """
+        Args:
+            encoding: 'gzip' (or 'x-gzip') or 'deflate'
+
+        Raises:
+            ValueError: For any other encoding
+        """
+        self.encoding = encoding
+        self._empty = True  # No body bytes yet; an empty body is fine, without any compressed data
+        self._format_known = True
+        if encoding in ('gzip', 'x-gzip'):
+            self._zlib = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            # 'deflate' should be zlib-wrapped, but some servers send raw deflate
+            # data; which one it is shows in the first two bytes
+            self._zlib = zlib.decompressobj(zlib.MAX_WBITS)
+            self._format_known = False
+            self._start = b''
+        else:
+            raise ValueError(f"Unsupported Content-Encoding {encoding!r}.")
+
+    def decompress(self, data):
+        """
+        Decodes the next piece of the body.
+
+        Args:
+            data: The encoded bytes (bytes, bytearray or memoryview)
+
+        Returns:
+            bytes: The decoded bytes they contain (possibly none yet)
+
+        Raises:
+            ValueError: If the data is not valid for the encoding
+        """
+        self._empty = self._empty and not len(data)
+        if not self._format_known:
+            self._start += data
+            if len(self._start) < 2:
+                return b''
+            data = self._start
+            self._check_format()
+        try:
+            return self._zlib.decompress(data)
+        except zlib.error as e:
+            raise ValueError(f"Bad {self.encoding} body: {e}") from None
+
+    def flush(self):
+        """
+        Finishes decoding once the whole body has been passed to decompress().
+
+        Returns:
+            bytes: Any decoded bytes still held back
+
+        Raises:
+            ValueError: If the compressed data ended early
+        """
+        if self._empty:
+            return b''
+        data = b''
+        if not self._format_known:
+            data = self._start
+            self._check_format()
+        try:
+            rest = self._zlib.decompress(data) + self._zlib.flush()
+        except zlib.error as e:
+            raise ValueError(f"Bad {self.encoding} body: {e}") from None
+        if not self._zlib.eof:
+            raise ValueError(f"The {self.encoding} body ends before its compressed data does.")
+        return rest
+
+    def _check_format(self):
+        """Switches to raw deflate if the body doesn't start with a zlib header."""
+        cmf, flg = (self._start + b'\0\0')[:2]
+        if cmf & 0x0f != 8 or (cmf << 8 | flg) % 31:
+            self._zlib = zlib.decompressobj(-zlib.MAX_WBITS)
+        self._format_known = True
+        self._start = b''
+
+
+class ResponseParser:
+    """
+    Incremental parser for one HTTP/1.1 response. Interim (1xx) responses are
+    skipped. Once the head has been parsed, status, reason and headers (names
+    in lower case, repeated headers joined with ", ") are set.
+    """
+
+    def __init__(self, method='GET', decode=False):
+        """
+        Args:
+            method: The request's method; the response to a HEAD request has no body
+            decode: Whether to decode a gzip or deflate Content-Encoding; other
+                    encodings are handed back as they are
+        """
+        self.method = method
+        self.decode = decode
+        self.decoder = None   # The ContentDecoder, once the head shows the body needs one
+        self.decoding = None  # The Content-Encoding being decoded, if any
+        self.version = None
+        self.status = None
+        self.reason = ''
+        self.headers = {}
+        self.trailers = {}
+        self.state = HEAD
+        self.framing = None  # How the body's end is marked: 'none', 'length', 'chunked' or 'close'
+        self.wire_bytes = 0  # Bytes fed, head and framing included
+        self.body_bytes = 0  # Body bytes received, as sent (compressed, if it was)
+        self.decoded_bytes = 0  # Body bytes handed back, after decoding
+        self.leftover = b''  # Bytes fed after the end of the response
+        self._buffer = bytearray()
+        self._scanned = 0    # Bytes of _buffer already known not to end the head
+        self._remaining = 0  # Bytes left in the body or the current chunk
+
+    @property
+    def head_done(self):
+        """Whether the status line and headers have been parsed."""
+        return self.state != HEAD
+
+    @property
+    def done(self):
+        """Whether the whole response has been parsed."""
+        return self.state == DONE
+
+    @property
+    def keep_alive(self):
+        """Whether the connection can carry another request now that the response is complete."""
+        if not self.done or self.framing == 'close':
+            return False
+        connection = [token.strip() for token in self.headers.get('connection', '').lower().split(',')]
+        if 'close' in connection:
+            return False
+        return self.version != 'HTTP/1.0' or 'keep-alive' in connection
+
+    def feed(self, data):
+        """
+        Parses the next bytes of the response.
+
+        Args:
+            data: The bytes just received (bytes or bytearray)
+
+        Returns:
+            list[memoryview]: The body bytes they contain, in order. They refer to
+                              data, so use them before changing it. When the
+                              body is being decoded they are decoded bytes instead.
+
+        Raises:
+            ValueError: If the response is malformed
+        """
+        self.wire_bytes += len(data)
+        view = memoryview(data)
+        pieces = []
+        pos = 0
+        end = len(data)
+        while pos < end and self.state != DONE:
+            if self.state in (LENGTH, CHUNK_DATA):
+                size = min(self._remaining, end - pos)
+                pieces.append(view[pos:pos + size])
+                pos += size
+                self._remaining -= size
+                self.body_bytes += size
+                if not self._remaining:
+                    self.state = DONE if self.state == LENGTH else CHUNK_END
+            elif self.state == UNTIL_CLOSE:
+                pieces.append(view[pos:])
+                self.body_bytes += end - pos
+                pos = end
+            elif self.state == HEAD:
+                pos = self._feed_head(data, pos)
+            else:
+                line, pos = self._take_line(data, pos)
+                if line is not None:
+                    self._on_line(line)
+        if pos < end:
+            self.leftover += bytes(view[pos:])
+        return self._decoded(pieces)
+
+    def feed_eof(self):
+        """
+        Tells the parser the connection was closed.
+
+        Returns:
+            list[bytes]: The last decoded body bytes, for a body that ended with
+                         the connection and is being decoded; otherwise empty
+
+        Raises:
+            ConnectionError: If the response was not complete
+        """
+        if self.state == UNTIL_CLOSE:
+            self.state = DONE
+            return self._decoded([])
+        elif self.state != DONE:
+            raise ConnectionError(f"Connection closed after {self.wire_bytes} bytes, before the response ended.")
+        return []
+
+    def _decoded(self, pieces):
+        """Passes body pieces through the decoder (if any), flushing it once the body is complete."""
+        if self.decoder is not None:
+            pieces = [decoded for decoded in map(self.decoder.decompress, pieces) if decoded]
+            if self.state == DONE:
+                rest = self.decoder.flush()
+                if rest:
+                    pieces.append(rest)
+                self.decoder = None
+        self.decoded_bytes += sum(map(len, pieces))
+        return pieces
+
+    def _feed_head(self, data, pos):
+        """Buffers head bytes; once the blank line arrives, parses the head and returns where the body starts."""
+        before = len(self._buffer)
+        self._buffer += data[pos:]
+        found = self._buffer.find(b'\r\n\r\n', max(0, self._scanned - 3))
+        if found == -1:
+            self._scanned = len(self._buffer)
+            if self._scanned > MAX_HEAD:
+                raise ValueError(f"Response head longer than {MAX_HEAD} bytes.")
+            return len(data)
+        head = bytes(self._buffer[:found])
+        body_start = pos + found + 4 - before
+        self._buffer.clear()
+        self._scanned = 0
+        self._parse_head(head)
+        return body_start
+
+    def _parse_head(self, head):
+        """Parses the status line and headers and works out how the body is framed."""
+        lines = head.decode('latin-1').split('\r\n')
+        version, _, rest = lines[0].partition(' ')
+        code, _, reason = rest.partition(' ')
+        if not version.startswith('HTTP/') or not code.isdigit():
+            raise ValueError(f"Malformed status line {lines[0][:80]!r}.")
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(':')
+            if not sep:
+                raise ValueError(f"Malformed header line {line[:80]!r}.")
+            name = name.strip().lower()
+            value = value.strip()
+            headers[name] = f"{headers[name]}, {value}" if name in headers else value
+        status = int(code)
+        if 100 <= status < 200:
+            return  # An interim response (100 Continue); the real one follows
+
+        self.version = version
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        if self.method == 'HEAD' or status in (204, 304):
+            self.framing = 'none'
+            self.state = DONE
+        elif headers.get('transfer-encoding', '').lower().rsplit(',', 1)[-1].strip() == 'chunked':
+            self.framing = 'chunked'
+            self.state = CHUNK_SIZE
+        elif 'content-length' in headers:
+            length = headers['content-length']
+            if not (length.isascii() and length.isdigit()):  # int() would also take '-5', '+5' or ' 5'
+                raise ValueError(f"Bad Content-Length {length!r}.")
+            self._remaining = int(length)
+            self.framing = 'length'
+            self.state = LENGTH if self._remaining else DONE
+        else:
+            self.framing = 'close'
+            self.state = UNTIL_CLOSE
+        encoding = headers.get('content-encoding', '').strip().lower()
+        if self.decode and self.state != DONE and encoding in ('gzip', 'x-gzip', 'deflate'):
+            self.decoder = ContentDecoder(encoding)
+            self.decoding = encoding
+
+    def _take_line(self, data, pos):
+        """
+        Takes the next line, which may have started in an earlier feed.
+
+        Returns:
+            tuple: (the line without its CRLF, or None if it is not complete yet;
+                    the position after it)
+        """
+        newline = data.find(b'\n', pos)
+        if newline == -1:
+            self._buffer += data[pos:]
+            if len(self._buffer) > MAX_LINE:
+                raise ValueError(f"Chunk size or trailer line longer than {MAX_LINE} bytes.")
+            return None, len(data)
+        line = data[pos:newline]
+        if self._buffer:
+            line = bytes(self._buffer) + line
+            self._buffer.clear()
+        return line.rstrip(b'\r'), newline + 1
+
+    def _on_line(self, line):
+        """Handles a complete chunk size, chunk end or trailer line."""
+        if self.state == CHUNK_SIZE:
+            token = line.split(b';', 1)[0].strip()
+            if not HEX_SIZE.fullmatch(token):
+                raise ValueError(f"Bad chunk size line {line[:80]!r}.")
+            size = int(token, 16)
+            if size:
+                self._remaining = size
+                self.state = CHUNK_DATA
+            else:
+                self.state = TRAILERS
+        elif self.state == CHUNK_END:
+            if line:
+                raise ValueError("Chunk data longer than its size.")
+            self.state = CHUNK_SIZE
+        elif line:  # TRAILERS
+            name, _, value = line.decode('latin-1').partition(':')
+            self.trailers[name.strip().lower()] = value.strip()
+        else:
+            self.state = DONE
@@ -1,14 +1,127 @@
+import argparse
+import functools
+import os
+import re
 import socket
 import ssl
+import time
+from urllib.parse import urlsplit
 
-def make_secure_request(host, port):
+from httpcache import CACHE_DIR, MAX_BYTES, HttpCache, cache_key
+from httpresponse import ACCEPT_ENCODING, ResponseParser, build_request
+
+RECV_SIZE = 256 * 1024      # Bytes asked of the socket per read when streaming
+WRITE_BUFFER = 1024 * 1024  # Bytes the output file collects before each write to disk
+POOL_SIZE = 4               # Idle connections kept open per host
+IDLE_TIMEOUT = 30.0         # Seconds an idle connection is kept; servers close theirs after a while too
+TIMEOUT = 30.0              # Seconds to wait for a connection or for the server to send something
+
+
+def parse_url(url):
+    """
+    Splits an https URL (or a bare hostname) into the parts a request needs.
+
+    Args:
+        url (str): e.g. 'https://www.google.com/search?q=tls' or 'www.google.com'
+
+    Returns:
+        tuple: (host, port, path)
+
+    Raises:
+        ValueError: If the URL is not https
+    """
+    if '://' not in url:
+        url = 'https://' + url
+    parts = urlsplit(url)
+    if parts.scheme != 'https' or not parts.hostname:
+        raise ValueError(f"{url} is not an https URL.")
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    return parts.hostname, parts.port or 443, path
+
+
+def output_name(url):
+    """
+    Makes a file name for a URL's body, for saving several pages into one directory.
+
+    Args:
+        url (str): The URL
+
+    Returns:
+        str: e.g. 'www.python.org_downloads.html' for https://www.python.org/downloads/
+    """
+    host, _, path = parse_url(url)
+    name = re.sub(r'[^A-Za-z0-9.-]+', '_', host + path).strip('_')
+    last = path.rstrip('/').rsplit('/', 1)[-1]
+    return name if '.' in last and '?' not in path else name + '.html'
+
+
+@functools.lru_cache(maxsize=None)
+def make_context(cafile=None):
+    """
+    Creates the SSL context for verifying servers. Loading the CA certificates
+    takes a while, so the context is created once per cafile and then shared.
+
+    Args:
+        cafile (str): Extra CA certificates to trust, e.g. a test server's self-signed one
+
+    Returns:
+        ssl.SSLContext: A context that checks certificates and hostnames
+    """
+    context = ssl.create_default_context()
+    if cafile:
+        context.load_verify_locations(cafile)
+    return context
+
+
+def request_headers(compress=True, connection=None):
+    """
+    Builds the extra request headers.
+
+    Args:
+        compress (bool): Whether to ask for a gzip or deflate compressed body
+        connection (str): The Connection header, e.g. 'close', or None to leave it out
+
+    Returns:
+        dict: The headers
+    """
+    headers = {}
+    if compress:
+        headers['Accept-Encoding'] = ACCEPT_ENCODING
+    if connection:
+        headers['Connection'] = connection
+    return headers
+
+
+def describe_transfer(result):
+    """
+    Describes how many bytes a response took on the wire and how many it saved.
+
+    Args:
+        result (dict): A fetch result with wire_bytes, decoded_bytes and encoding
+
+    Returns:
+        str: e.g. '44314 bytes on the wire for 188890 of content (gzip, 77% less)'
+    """
+    text = f"{result['wire_bytes']} bytes on the wire for {result['decoded_bytes']} of content"
+    if result['encoding'] and result['decoded_bytes']:
+        saved = 1 - result['wire_bytes'] / result['decoded_bytes']
+        text += f" ({result['encoding']}, {saved:.0%} less)"
+    return text
+
+
+def make_secure_request(host, port, path='/', cafile=None, compress=True):
     """
     Establishes a secure connection to a host, sends an HTTP GET request for the
-    root path, and returns the server's full response.
+    path, and returns the server's full response.
 
     Args:
         host (str): The server hostname (e.g., 'www.google.com').
         port (int): The port to connect to (e.g., 443 for HTTPS).
+        path (str): The path to request.
+        cafile (str): Extra CA certificates to trust.
+        compress (bool): Whether to ask for a compressed body.
 
     Returns:
         bytes: The complete HTTP response from the server, or None on failure.
@@ -16,7 +129,7 @@ def make_secure_request(host, port):
     try:
         # Create a standard TCP socket and wrap it with SSL
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        context = ssl.create_default_context()
+        context = make_context(cafile)
         secure_sock = context.wrap_socket(sock, server_hostname=host)
 
         # Connect and send the request
@@ -24,20 +137,21 @@ def make_secure_request(host, port):
         secure_sock.connect((host, port))
         print("Connection successful.")
 
-        request = b"GET / HTTP/1.1\r\nHost: " + host.encode() + b"\r\nConnection: close\r\n\r\n"
+        request = build_request(host, path, request_headers(compress, 'close'))
         print("Sending HTTP GET request...")
         secure_sock.sendall(request)
 
-        # Receive the full response
-        response = b""
+        # Receive the full response. The pieces are joined once at the end;
+        # adding each one to a growing bytes object would copy it all every time
+        chunks = []
         while True:
             data = secure_sock.recv(4096)
             if not data:
                 break
-            response += data
-        
+            chunks.append(data)
+
         print("Response received.")
-        return response
+        return b''.join(chunks)
 
     except Exception as e:
         print(f"An error occurred: {e}")
@@ -52,6 +166,8 @@ def make_secure_request(host, port):
 def save_html_content(response_data, filename):
     """
     Parses a raw HTTP response, extracts the HTML content, and saves it to a file.
+    A chunked body is decoded, so the file holds the page and not the chunk sizes,
+    and so is a gzip or deflate compressed one.
 
     Args:
         response_data (bytes): The raw HTTP response.
@@ -62,34 +178,379 @@ def save_html_content(response_data, filename):
         return
 
     try:
-        # The HTML body starts after the first double newline characters (\r\n\r\n)
-        header_end = response_data.find(b"\r\n\r\n")
-        if header_end != -1:
-            # The HTML starts 4 bytes after the header separator
-            html_content = response_data[header_end + 4:]
-            with open(filename, 'wb') as f:
-                f.write(html_content)
-            print(f"Successfully saved HTML content to {filename}.")
-        else:
-            print("Could not find the end of the HTTP headers.")
+        parser = ResponseParser(decode=True)
+        body = parser.feed(response_data)
+        body += parser.feed_eof()
+        with open(filename, 'wb') as f:
+            for piece in body:
+                f.write(piece)
+        print(f"Successfully saved HTML content to {filename}: {parser.wire_bytes} bytes on the wire "
+              f"for {parser.decoded_bytes} of content.")
+    except ValueError as e:
+        print(f"Could not parse the HTTP response: {e}")
     except Exception as e:
         print(f"Could not save file: {e}")
 
 
+class SecureClient:
+    """
+    Fetches pages over HTTPS, keeping what makes a fetch slow between requests:
+
+    * one SSL context, so the CA certificates are loaded once;
+    * up to pool_size idle keep-alive connections per host, so another request
+      to the same host skips the TCP and TLS handshakes altogether;
+    * the TLS session of each host, so a new connection to it resumes the
+      session (an abbreviated handshake, without the certificate exchange and
+      checks) instead of starting from scratch.
+
+    It also asks for compressed bodies (unless compress is False) and decodes
+    them as they arrive, so less has to cross the network, and with an
+    HttpCache it doesn't fetch what it already has: a fresh cached copy is
+    used as it is, and a stale one with validators is only sent again if the
+    server says it changed.
+
+    Responses are streamed as in stream_secure_request(). Use it as a context
+    manager, or call close(), to close the idle connections.
+
+        with SecureClient() as client:
+            for path in ('/', '/about/', '/downloads/'):
+                client.fetch('www.python.org', 443, path, output_name(...))
+    """
+
+    def __init__(self, cafile=None, pool_size=POOL_SIZE, timeout=TIMEOUT, compress=True, cache=None):
+        """
+        Args:
+            cafile (str): Extra CA certificates to trust.
+            pool_size (int): Idle connections kept open per host.
+            timeout (float): Seconds to wait for a connection or for data.
+            compress (bool): Whether to ask for gzip or deflate compressed bodies.
+            cache (HttpCache): The cache for the bodies saved to files, or None.
+        """
+        self.context = make_context(cafile)
+        self.compress = compress
+        self.cache = cache
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.pools = {}     # (host, port) -> [(socket, time it went idle)], most recent last
+        self.sessions = {}  # (host, port) -> the last ssl.SSLSession, for resumption
+        self.requests = 0
+        self.connections = 0  # Connections opened, each with a TLS handshake
+        self.resumed = 0      # ... of which resumed an earlier TLS session
+        self.reused = 0       # Requests sent on a connection that was already open
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Closes every idle connection."""
+        for pool in self.pools.values():
+            for sock, _ in pool:
+                sock.close()
+        self.pools.clear()
+
+    def fetch(self, host, port, path, filename=None):
+        """
+        Fetches a path and writes the body to a file as it arrives, decoded if
+        it was compressed. The file is only replaced once the body is complete.
+        With a cache, the body may come from the cache instead.
+
+        A request on a reused connection that the server has meanwhile closed
+        is sent again on a new connection.
+
+        Args:
+            host (str): The server hostname.
+            port (int): The port to connect to.
+            path (str): The path to request.
+            filename (str): The file to write the body to, or None to discard it.
+
+        Returns:
+            dict: status, reason, headers, wire_bytes (response bytes received),
+                  body_bytes (as sent), decoded_bytes (as saved), encoding (the
+                  Content-Encoding decoded, or None), seconds, reused
+                  (whether the connection was already open) and cache ('hit'
+                  if the body came from the cache without asking the server,
+                  'revalidated' if it came from the cache after a 304,
+                  'stored' if it was cached, otherwise None).
+
+        Raises:
+            OSError: If the connection fails (ssl.SSLError if TLS does)
+            ValueError: If the response is malformed
+        """
+        key = (host, port)
+        url = cache_key(host, port, path)
+        entry = self.cache.lookup(url) if self.cache is not None and filename else None
+        start = time.perf_counter()
+        if entry is not None and self.cache.is_fresh(entry):
+            size = self.cache.serve(url, entry, filename)
+            return {
+                'status': entry['status'],
+                'reason': entry['reason'],
+                'headers': {},
+                'wire_bytes': 0,
+                'body_bytes': 0,
+                'decoded_bytes': size,
+                'encoding': None,
+                'seconds': time.perf_counter() - start,
+                'reused': False,
+                'cache': 'hit',
+            }
+
+        headers = request_headers(self.compress)
+        if entry is not None:
+            headers.update(self.cache.validators(entry))
+        request = build_request(host, path, headers)
+        while True:
+            sock, reused = self._checkout(key)
+            parser = ResponseParser(decode=self.compress)
+            try:
+                sock.sendall(request)
+                self._read_response(sock, parser, filename)
+            except (OSError, ValueError):
+                sock.close()
+                if reused and parser.wire_bytes == 0:
+                    continue  # The server closed the idle connection first; a GET can be sent again
+                raise
+            break
+        self.requests += 1
+        self.reused += reused
+        if sock.session is not None:
+            self.sessions[key] = sock.session  # TLS 1.3 sends its session tickets after the handshake
+        if parser.keep_alive and not parser.leftover:
+            self._checkin(key, sock)
+        else:
+            sock.close()
+        result = {
+            'status': parser.status,
+            'reason': parser.reason,
+            'headers': parser.headers,
+            'wire_bytes': parser.wire_bytes,
+            'body_bytes': parser.body_bytes,
+            'decoded_bytes': parser.decoded_bytes,
+            'encoding': parser.decoding,
+            'seconds': None,
+            'reused': reused,
+            'cache': None,
+        }
+        if entry is not None and parser.status == 304:
+            self.cache.revalidated(url, entry, parser.headers)
+            result['decoded_bytes'] = self.cache.serve(url, entry, filename)
+            result['cache'] = 'revalidated'
+        elif self.cache is not None and filename:
+            if self.cache.store(url, parser.status, parser.reason, parser.headers, filename):
+                result['cache'] = 'stored'
+        result['seconds'] = time.perf_counter() - start
+        return result
+
+    def _checkout(self, key):
+        """
+        Takes the most recently used idle connection to a host, or opens one.
+
+        Returns:
+            tuple: (ssl.SSLSocket, True if it was already open)
+        """
+        pool = self.pools.get(key, [])
+        now = time.monotonic()
+        while pool:
+            sock, idle_since = pool.pop()
+            if now - idle_since < IDLE_TIMEOUT:
+                return sock, True
+            sock.close()
+        sock = socket.create_connection(key, timeout=self.timeout)
+        try:
+            secure_sock = self.context.wrap_socket(sock, server_hostname=key[0], session=self.sessions.get(key))
+        except OSError:
+            sock.close()
+            raise
+        self.connections += 1
+        self.resumed += secure_sock.session_reused
+        return secure_sock, False
+
+    def _checkin(self, key, sock):
+        """Keeps a connection for the next request to its host, or closes it if the pool is full."""
+        pool = self.pools.setdefault(key, [])
+        if len(pool) >= self.pool_size:
+            sock.close()
+            return
+        pool.append((sock, time.monotonic()))
+
+    @staticmethod
+    def _read_response(sock, parser, filename):
+        """
+        Reads one response from the socket, writing its body to the file (if any).
+        The body goes to filename.part, which replaces the file once the body is
+        complete, so a failed download (or a 304, which has none) leaves the
+        file as it was.
+        """
+        f = open(filename + '.part', 'wb', buffering=WRITE_BUFFER) if filename else None
+        try:
+            while not parser.done:
+                data = sock.recv(RECV_SIZE)
+                pieces = parser.feed(data) if data else parser.feed_eof()
+                if f is not None:
+                    for piece in pieces:
+                        f.write(piece)
+        finally:
+            if f is not None:
+                f.close()
+                if parser.done and parser.status != 304:
+                    os.replace(filename + '.part', filename)
+                else:
+                    os.remove(filename + '.part')
+
+
+def stream_secure_request(host, port, path, filename, cafile=None, compress=True, cache=None):
+    """
+    Fetches a path over TLS and writes the body to a file as it arrives, so
+    memory use stays the same however large the body is. The response is parsed
+    as it comes in (Content-Length, chunked, or until the connection closes) and
+    the file is written in WRITE_BUFFER-sized blocks.
+
+    Args:
+        host (str): The server hostname.
+        port (int): The port to connect to.
+        path (str): The path to request.
+        filename (str): The file to write the body to.
+        cafile (str): Extra CA certificates to trust.
+        compress (bool): Whether to ask for a compressed body.
+        cache (HttpCache): The cache to use, or None.
+
+    Returns:
+        dict: as SecureClient.fetch(), or None on failure.
+    """
+    print(f"Fetching https://{host}:{port}{path}...")
+    try:
+        with SecureClient(cafile, compress=compress, cache=cache) as client:
+            result = client.fetch(host, port, path, filename)
+    except (OSError, ValueError) as e:
+        print(f"An error occurred: {e}")
+        return None
+    print(f"HTTP {result['status']} {result['reason']}: saved {result['decoded_bytes']} bytes to {filename} in "
+          f"{result['seconds']:.2f} s ({result['decoded_bytes'] / result['seconds'] / 1e6:.1f} MB/s).")
+    print(describe_transfer(result).capitalize() + '.')
+    if result['cache'] == 'hit':
+        print("Served from the cache without asking the server; the cached copy is still fresh.")
+    elif result['cache'] == 'revalidated':
+        print("The server says the page hasn't changed (304 Not Modified); served from the cache.")
+    return result
+
+
+def fetch_many(urls, output_dir='.', cafile=None, compress=True, cache=None):
+    """
+    Fetches several URLs one after another with one SecureClient, so requests
+    to the same host share connections and TLS sessions, saving each body under
+    output_name(url) in output_dir.
+
+    Returns:
+        SecureClient: The (closed) client, for its counters
+    """
+    wire_bytes = decoded_bytes = cached = 0
+    with SecureClient(cafile, compress=compress, cache=cache) as client:
+        for url in urls:
+            host, port, path = parse_url(url)
+            filename = os.path.join(output_dir, output_name(url))
+            try:
+                result = client.fetch(host, port, path, filename)
+            except (OSError, ValueError) as e:
+                print(f"{url}: failed: {e}")
+                continue
+            wire_bytes += result['wire_bytes']
+            decoded_bytes += result['decoded_bytes']
+            cached += result['cache'] in ('hit', 'revalidated')
+            notes = []
+            if result['reused']:
+                notes.append('reused connection')
+            if result['cache']:
+                notes.append(f"cache {result['cache']}")
+            notes = f" ({', '.join(notes)})" if notes else ''
+            print(f"{url}: HTTP {result['status']}, {describe_transfer(result)}, saved to {filename} in "
+                  f"{result['seconds'] * 1000:.1f} ms{notes}")
+    print(f"{client.requests} requests over {client.connections} connections "
+          f"({client.resumed} of them resumed a TLS session), {wire_bytes} bytes on the wire "
+          f"for {decoded_bytes} of content; {cached} of {len(urls)} pages came from the cache.")
+    return client
+
+
 def main():
     """
     Main function to execute the secure web request.
     """
-    HOST = 'www.google.com'
-    PORT = 443
+    URL = 'https://www.google.com/'
     FILENAME = 'response.html'
 
-    # Make the request and get the response
-    full_response = make_secure_request(HOST, PORT)
+    parser = argparse.ArgumentParser(description="Fetch pages over HTTPS and save their bodies")
+    parser.add_argument('urls', nargs='*', metavar='url',
+                        help=f"The https URLs to fetch (default: {URL})")
+    parser.add_argument('-o', '--output', default=FILENAME,
+                        help=f"File to save the body to, with one URL (default: {FILENAME})")
+    parser.add_argument('--output-dir', default='.',
+                        help="Directory to save the bodies to, with several URLs; each file is named "
+                             "after its URL (default: the current directory)")
+    parser.add_argument('--buffered', action='store_true',
+                        help="Read the whole response into memory before saving it, as the first "
+                             "version did, instead of streaming it to the file")
+    parser.add_argument('--no-compression', dest='compress', action='store_false',
+                        help=f"Don't ask the server to compress the body (normally Accept-Encoding: {ACCEPT_ENCODING})")
+    parser.add_argument('--cache-dir', default=CACHE_DIR,
+                        help=f"Directory of the response cache (default: {CACHE_DIR})")
+    parser.add_argument('--cache-size', type=float, default=MAX_BYTES / 2**20,
+                        help=f"Megabytes the cached bodies may take (default: {MAX_BYTES / 2**20:g})")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Always fetch the whole page, without using or filling the cache")
+    parser.add_argument('--cafile', default=None,
+                        help="Extra CA certificates to trust, e.g. a local test server's self-signed one")
+    batch = parser.add_argument_group("batch mode", "Fetch a list of URLs concurrently, saving each body in --output-dir")
+    batch.add_argument('--batch', metavar='FILE',
+                       help="File listing the URLs to fetch, one per line ('-' for standard input)")
+    batch.add_argument('--concurrency', type=int, default=32, help="Fetches running at once (default: 32)")
+    batch.add_argument('--per-host', type=int, default=6, help="Fetches running at once per host (default: 6)")
+    batch.add_argument('--timeout', type=float, default=30.0,
+                       help="Seconds to wait for a connection, or for the server to send anything (default: 30)")
+    args = parser.parse_args()
+
+    if args.batch and args.buffered:
+        parser.error("--buffered can't be used with --batch")
+    if args.batch:
+        # Imported here since asyncget.py imports this module
+        from asyncget import read_urls, run_batch
+        try:
+            urls = read_urls(args.batch) + args.urls
+        except OSError as e:
+            parser.error(str(e))
+        if not urls:
+            parser.error(f"no URLs in {args.batch}")
+    else:
+        urls = args.urls or [URL]
+        try:
+            host, port, path = [parse_url(url) for url in urls][0]
+        except ValueError as e:
+            parser.error(str(e))
+        if len(urls) > 1 and args.buffered:
+            parser.error("--buffered takes a single URL")
+
+    if args.buffered:
+        # Make the request and get the response
+        full_response = make_secure_request(host, port, path, args.cafile, args.compress)
 
-    # Save the HTML content from the response
-    save_html_content(full_response, FILENAME)
+        # Save the HTML content from the response
+        save_html_content(full_response, args.output)
+        return
+
+    cache = None if args.no_cache else HttpCache(args.cache_dir, int(args.cache_size * 2**20))
+    try:
+        if args.batch:
+            run_batch(urls, args.output_dir, args.cafile, args.concurrency, args.per_host, args.timeout,
+                      args.compress, cache)
+        elif len(urls) > 1:
+            fetch_many(urls, args.output_dir, args.cafile, args.compress, cache)
+        else:
+            stream_secure_request(host, port, path, args.output, args.cafile, args.compress, cache)
+    finally:
+        if cache is not None:
+            cache.close()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,143 @@
+# test_httpcache.py
+# Tests for the on-disk response cache in httpcache.py, run with:
+#     python -m unittest test_httpcache      (or python -m pytest)
+# Each test gets its own temporary directory for the cache and the saved pages.
+
+import email.utils
+import os
+import tempfile
+import time
+import unittest
+
+from httpcache import INDEX, HttpCache, cache_control, cache_key, freshness_lifetime
+
+
+class FreshnessTest(unittest.TestCase):
+    def test_cache_key(self):
+        self.assertEqual(cache_key('example.com', 443, '/'), 'https://example.com/')
+        self.assertEqual(cache_key('localhost', 8443, '/page?x=1'), 'https://localhost:8443/page?x=1')
+
+    def test_cache_control(self):
+        self.assertEqual(cache_control({'cache-control': 'Public, max-age="600", no-transform'}),
+                         {'public': None, 'max-age': '600', 'no-transform': None})
+        self.assertEqual(cache_control({}), {})
+
+    def test_max_age_less_age(self):
+        self.assertEqual(freshness_lifetime({'cache-control': 'max-age=600', 'age': '100'}), 500)
+        self.assertEqual(freshness_lifetime({'cache-control': 'max-age=60', 'age': '100'}), 0)
+
+    def test_expires(self):
+        now = time.time()
+        headers = {'date': email.utils.formatdate(now, usegmt=True),
+                   'expires': email.utils.formatdate(now + 3600, usegmt=True)}
+        self.assertAlmostEqual(freshness_lifetime(headers), 3600, delta=1)
+
+    def test_max_age_wins_over_expires(self):
+        headers = {'cache-control': 'max-age=10', 'expires': email.utils.formatdate(time.time() + 3600, usegmt=True)}
+        self.assertEqual(freshness_lifetime(headers), 10)
+
+    def test_not_fresh(self):
+        for headers in ({}, {'cache-control': 'no-cache, max-age=600'}, {'cache-control': 'no-store'},
+                        {'cache-control': 'max-age=soon'}, {'expires': 'yesterday'}):
+            with self.subTest(headers=headers):
+                self.assertEqual(freshness_lifetime(headers), 0)
+
+
+class HttpCacheTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.cache_dir = os.path.join(self.directory, 'cache')
+
+    def page(self, name, content):
+        """Saves a page as a fetch would and returns its file name."""
+        filename = os.path.join(self.directory, name)
+        with open(filename, 'wb') as f:
+            f.write(content)
+        return filename
+
+    def read(self, filename):
+        with open(filename, 'rb') as f:
+            return f.read()
+
+    def test_store_and_serve(self):
+        with HttpCache(self.cache_dir) as cache:
+            stored = cache.store('https://a/', 200, 'OK', {'cache-control': 'max-age=600', 'etag': '"v1"'},
+                                 self.page('a.html', b'page a'))
+            self.assertTrue(stored)
+            entry = cache.lookup('https://a/')
+            self.assertTrue(cache.is_fresh(entry))
+            self.assertEqual(cache.serve('https://a/', entry, os.path.join(self.directory, 'out.html')), 6)
+        self.assertEqual(self.read(os.path.join(self.directory, 'out.html')), b'page a')
+        self.assertIsNone(HttpCache(self.cache_dir).lookup('https://b/'))
+
+    def test_index_survives_reopening(self):
+        with HttpCache(self.cache_dir) as cache:
+            cache.store('https://a/', 200, 'OK', {'etag': '"v1"'}, self.page('a.html', b'page a'))
+        self.assertTrue(os.path.exists(os.path.join(self.cache_dir, INDEX)))
+        cache = HttpCache(self.cache_dir)
+        entry = cache.lookup('https://a/')
+        self.assertEqual(entry['etag'], '"v1"')
+        self.assertEqual(cache.size, 6)
+
+    def test_damaged_index_starts_empty(self):
+        os.makedirs(self.cache_dir)
+        with open(os.path.join(self.cache_dir, INDEX), 'w') as f:
+            f.write('{not json')
+        self.assertEqual(HttpCache(self.cache_dir).entries, {})
+
+    def test_responses_that_are_not_kept(self):
+        cache = HttpCache(self.cache_dir, max_bytes=10)
+        filename = self.page('a.html', b'page a')
+        for status, headers in ((404, {'etag': '"v1"'}),
+                                (200, {'cache-control': 'no-store', 'etag': '"v1"'}),
+                                (200, {})):
+            with self.subTest(status=status, headers=headers):
+                self.assertFalse(cache.store('https://a/', status, '', headers, filename))
+        self.assertFalse(cache.store('https://a/', 200, 'OK', {'etag': '"v1"'}, self.page('big', b'x' * 11)))
+        self.assertEqual(cache.entries, {})
+
+    def test_uncacheable_response_drops_the_old_copy(self):
+        cache = HttpCache(self.cache_dir)
+        cache.store('https://a/', 200, 'OK', {'etag': '"v1"'}, self.page('a.html', b'old'))
+        self.assertFalse(cache.store('https://a/', 200, 'OK', {'cache-control': 'no-store'},
+                                     self.page('a.html', b'new')))
+        self.assertIsNone(cache.lookup('https://a/'))
+        self.assertEqual(cache.size, 0)
+
+    def test_revalidate(self):
+        cache = HttpCache(self.cache_dir)
+        cache.store('https://a/', 200, 'OK', {'etag': '"v1"', 'last-modified': 'Mon, 01 Jan 2024 00:00:00 GMT'},
+                    self.page('a.html', b'page a'))
+        entry = cache.lookup('https://a/')
+        self.assertFalse(cache.is_fresh(entry))
+        self.assertEqual(cache.validators(entry), {'If-None-Match': '"v1"',
+                                                   'If-Modified-Since': 'Mon, 01 Jan 2024 00:00:00 GMT'})
+        cache.revalidated('https://a/', entry, {'etag': '"v2"', 'cache-control': 'max-age=600'})
+        self.assertTrue(cache.is_fresh(entry))
+        self.assertEqual(cache.validators(entry)['If-None-Match'], '"v2"')
+
+    def test_evicts_least_recently_used(self):
+        cache = HttpCache(self.cache_dir, max_bytes=25)
+        for name in 'abc':
+            cache.store(f'https://{name}/', 200, 'OK', {'etag': '"v1"'}, self.page(name, name.encode() * 10))
+        # Storing c pushed the total to 30 bytes, so a, the oldest, went
+        self.assertEqual(list(cache.entries), ['https://b/', 'https://c/'])
+        cache.serve('https://b/', cache.lookup('https://b/'), os.path.join(self.directory, 'out'))
+        cache.store('https://d/', 200, 'OK', {'etag': '"v1"'}, self.page('d', b'd' * 10))
+        # b was used after c, so now c goes
+        self.assertEqual(list(cache.entries), ['https://b/', 'https://d/'])
+        self.assertEqual(cache.size, 20)
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), sorted(e['file'] for e in cache.entries.values()))
+
+    def test_body_deleted_behind_its_back(self):
+        cache = HttpCache(self.cache_dir)
+        cache.store('https://a/', 200, 'OK', {'etag': '"v1"'}, self.page('a.html', b'page a'))
+        os.remove(os.path.join(self.cache_dir, cache.entries['https://a/']['file']))
+        self.assertIsNone(cache.lookup('https://a/'))
+        self.assertEqual(cache.size, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,200 @@
+# test_httpresponse.py
+# Tests for ResponseParser and ContentDecoder in httpresponse.py, run with:
+#     python -m unittest test_httpresponse      (or python -m pytest)
+# Every response is parsed fed all at once and fed one byte at a time, since
+# the parser must give the same answer however the bytes arrive.
+
+import gzip
+import unittest
+import zlib
+
+from httpresponse import MAX_HEAD, ResponseParser, build_request
+
+
+def parse(response, piece_size=None, eof=False, **options):
+    """
+    Feeds a response to a new parser.
+
+    Args:
+        response (bytes): The whole response
+        piece_size (int): Bytes fed at a time; None for all at once
+        eof (bool): Whether to call feed_eof() afterwards
+        options: Passed on to ResponseParser()
+
+    Returns:
+        tuple: (the parser, the body it handed back)
+    """
+    parser = ResponseParser(**options)
+    step = piece_size or max(1, len(response))
+    body = b''
+    for start in range(0, len(response), step):
+        body += b''.join(bytes(piece) for piece in parser.feed(response[start:start + step]))
+    if eof:
+        body += b''.join(bytes(piece) for piece in parser.feed_eof())
+    return parser, body
+
+
+class ResponseParserTest(unittest.TestCase):
+    def check(self, response, body, eof=False, **options):
+        """Parses response both ways, checks it is complete with this body and returns the parser."""
+        for piece_size in (None, 1):
+            with self.subTest(piece_size=piece_size):
+                parser, received = parse(response, piece_size, eof, **options)
+                self.assertTrue(parser.done)
+                self.assertEqual(received, body)
+        return parser
+
+    def test_content_length(self):
+        parser = self.check(b'HTTP/1.1 200 OK\r\nContent-Length: 5\r\nX-Thing: a\r\n\r\nhello', b'hello')
+        self.assertEqual((parser.status, parser.reason, parser.framing), (200, 'OK', 'length'))
+        self.assertEqual(parser.headers, {'content-length': '5', 'x-thing': 'a'})
+        self.assertTrue(parser.keep_alive)
+        self.assertEqual(parser.wire_bytes, parser.body_bytes + len(b'HTTP/1.1 200 OK\r\nContent-Length: 5\r\n'
+                                                                   b'X-Thing: a\r\n\r\n'))
+
+    def test_bytes_after_the_body_are_kept(self):
+        parser, body = parse(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nhiHTTP/1.1')
+        self.assertEqual(body, b'hi')
+        self.assertEqual(parser.leftover, b'HTTP/1.1')
+
+    def test_chunked(self):
+        response = (b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+                    b'5\r\nhello\r\n7;name=value\r\n, world\r\n0\r\nX-Checksum: 42\r\n\r\n')
+        parser = self.check(response, b'hello, world')
+        self.assertEqual(parser.framing, 'chunked')
+        self.assertEqual(parser.trailers, {'x-checksum': '42'})
+        self.assertEqual(parser.body_bytes, 12)
+
+    def test_chunked_hex_sizes(self):
+        data = bytes(range(256)) * 2
+        response = b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n1Ff\r\n' + data[:0x1ff] + \
+                   b'\r\n1\r\n' + data[0x1ff:] + b'\r\n0\r\n\r\n'
+        self.check(response, data)
+
+    def test_close_delimited(self):
+        parser = self.check(b'HTTP/1.1 200 OK\r\n\r\nuntil the end', b'until the end', eof=True)
+        self.assertEqual(parser.framing, 'close')
+        self.assertFalse(parser.keep_alive)
+
+    def test_close_delimited_needs_eof(self):
+        parser, body = parse(b'HTTP/1.1 200 OK\r\n\r\nsome')
+        self.assertEqual(body, b'some')
+        self.assertFalse(parser.done)
+
+    def test_no_body(self):
+        self.check(b'HTTP/1.1 304 Not Modified\r\nETag: "v1"\r\n\r\n', b'')
+        self.check(b'HTTP/1.1 204 No Content\r\n\r\n', b'')
+        self.check(b'HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\n', b'', method='HEAD')
+        self.check(b'HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n', b'')
+
+    def test_interim_response_is_skipped(self):
+        parser = self.check(b'HTTP/1.1 100 Continue\r\n\r\nHTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok', b'ok')
+        self.assertEqual(parser.status, 200)
+
+    def test_repeated_headers_are_joined(self):
+        parser = self.check(b'HTTP/1.1 200 OK\r\nVary: a\r\nVary: b\r\nContent-Length: 0\r\n\r\n', b'')
+        self.assertEqual(parser.headers['vary'], 'a, b')
+
+    def test_keep_alive(self):
+        for head, keep_alive in ((b'HTTP/1.1 200 OK\r\nConnection: close', False),
+                                 (b'HTTP/1.0 200 OK', False),
+                                 (b'HTTP/1.0 200 OK\r\nConnection: keep-alive', True)):
+            with self.subTest(head=head):
+                parser, _ = parse(head + b'\r\nContent-Length: 1\r\n\r\nx')
+                self.assertEqual(parser.keep_alive, keep_alive)
+
+    def test_truncated_responses_raise(self):
+        for response in (b'HTTP/1.1 200 OK\r\nContent-Le',
+                         b'HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\nshort',
+                         b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n5\r\nhel'):
+            with self.subTest(response=response):
+                parser, _ = parse(response)
+                with self.assertRaises(ConnectionError):
+                    parser.feed_eof()
+
+    def test_malformed_responses_raise(self):
+        chunked = b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+        for response in (b'HTTP/1.1 OK\r\n\r\n',
+                         b'SMTP 200 OK\r\n\r\n',
+                         b'HTTP/1.1 200 OK\r\nno colon here\r\n\r\n',
+                         b'HTTP/1.1 200 OK\r\nContent-Length: -5\r\n\r\n',
+                         b'HTTP/1.1 200 OK\r\nContent-Length: +5\r\n\r\n',
+                         b'HTTP/1.1 200 OK\r\nContent-Length: five\r\n\r\n',
+                         chunked + b'-5\r\nhello\r\n0\r\n\r\n',
+                         chunked + b'+5\r\nhello\r\n0\r\n\r\n',
+                         chunked + b'0x5\r\nhello\r\n0\r\n\r\n',
+                         chunked + b'\r\n',
+                         chunked + b'3\r\nhello\r\n0\r\n\r\n'):
+            for piece_size in (None, 1):
+                with self.subTest(response=response, piece_size=piece_size):
+                    with self.assertRaises(ValueError):
+                        parse(response, piece_size)
+
+    def test_endless_head_raises(self):
+        with self.assertRaises(ValueError):
+            parse(b'HTTP/1.1 200 OK\r\n' + b'X-Padding: xxxxxxxxxxxxxxxx\r\n' * (MAX_HEAD // 16), piece_size=4096)
+
+
+class DecodingTest(unittest.TestCase):
+    text = b'<html>' + b'all work and no play ' * 500 + b'</html>'
+
+    def decode(self, encoding, body, chunked=False):
+        if chunked:
+            framed = b''.join(b'%x\r\n%s\r\n' % (len(body[i:i + 100]), body[i:i + 100])
+                              for i in range(0, len(body), 100)) + b'0\r\n\r\n'
+            head = b'Transfer-Encoding: chunked'
+        else:
+            framed = body
+            head = b'Content-Length: %d' % len(body)
+        response = b'HTTP/1.1 200 OK\r\nContent-Encoding: ' + encoding + b'\r\n' + head + b'\r\n\r\n' + framed
+        bodies = []
+        for piece_size in (None, 1):
+            parser, decoded = parse(response, piece_size, decode=True)
+            self.assertTrue(parser.done)
+            bodies.append(decoded)
+        self.assertEqual(bodies[0], bodies[1])
+        return parser, bodies[0]
+
+    def test_gzip(self):
+        parser, body = self.decode(b'gzip', gzip.compress(self.text))
+        self.assertEqual(body, self.text)
+        self.assertEqual(parser.decoding, 'gzip')
+        self.assertEqual(parser.decoded_bytes, len(self.text))
+        self.assertLess(parser.body_bytes, parser.decoded_bytes)
+
+    def test_gzip_chunked(self):
+        self.assertEqual(self.decode(b'gzip', gzip.compress(self.text), chunked=True)[1], self.text)
+
+    def test_deflate_zlib_and_raw(self):
+        raw = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        for body in (zlib.compress(self.text), raw.compress(self.text) + raw.flush()):
+            with self.subTest(body=body[:2]):
+                self.assertEqual(self.decode(b'deflate', body)[1], self.text)
+
+    def test_other_encodings_are_left_alone(self):
+        parser, body = self.decode(b'br', b'not really brotli')
+        self.assertEqual(body, b'not really brotli')
+        self.assertIsNone(parser.decoding)
+
+    def test_not_decoded_unless_asked(self):
+        compressed = gzip.compress(self.text)
+        parser, body = parse(b'HTTP/1.1 200 OK\r\nContent-Encoding: gzip\r\nContent-Length: %d\r\n\r\n'
+                             % len(compressed) + compressed)
+        self.assertEqual(body, compressed)
+
+    def test_corrupt_and_truncated_bodies_raise(self):
+        compressed = gzip.compress(self.text)
+        for body in (b'definitely not gzip', compressed[:len(compressed) // 2]):
+            with self.subTest(size=len(body)):
+                with self.assertRaises(ValueError):
+                    self.decode(b'gzip', body)
+
+
+class BuildRequestTest(unittest.TestCase):
+    def test_build_request(self):
+        self.assertEqual(build_request('example.com', '/a?b=c', {'Accept-Encoding': 'gzip'}),
+                         b'GET /a?b=c HTTP/1.1\r\nHost: example.com\r\nAccept-Encoding: gzip\r\n\r\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
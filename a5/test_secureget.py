@@ -0,0 +1,62 @@
+# test_secureget.py
+# Tests for secureget.py's URL helpers and command line, and for the file
+# names batch mode picks, run with:
+#     python -m unittest test_secureget      (or python -m pytest)
+# Nothing here touches the network: every command line tested is refused
+# before a connection would be opened.
+
+import contextlib
+import io
+import os
+import unittest
+from unittest import mock
+
+import secureget
+from asyncget import output_names
+from secureget import output_name, parse_url
+
+
+class UrlTest(unittest.TestCase):
+    def test_parse_url(self):
+        self.assertEqual(parse_url('https://www.google.com/search?q=tls'), ('www.google.com', 443, '/search?q=tls'))
+        self.assertEqual(parse_url('localhost:8443'), ('localhost', 8443, '/'))
+
+    def test_parse_url_needs_https(self):
+        for url in ('http://example.com/', 'ftp://example.com/', 'https://'):
+            with self.subTest(url=url):
+                with self.assertRaises(ValueError):
+                    parse_url(url)
+
+    def test_output_name(self):
+        self.assertEqual(output_name('https://www.python.org/downloads/'), 'www.python.org_downloads.html')
+        self.assertEqual(output_name('https://localhost:8443/big.iso'), 'localhost_big.iso')
+        self.assertEqual(output_name('https://example.com/a.php?x=1'), 'example.com_a.php_x_1.html')
+
+    def test_batch_names_are_unique(self):
+        names = output_names(['https://a/x', 'https://a/x', 'http://bad/', 'https://a/x'], 'out')
+        self.assertEqual(names, [os.path.join('out', 'a_x.html'), os.path.join('out', 'a_x-2.html'), None,
+                                 os.path.join('out', 'a_x-3.html')])
+
+
+class CommandLineTest(unittest.TestCase):
+    def refused(self, *argv):
+        """Runs main() with a command line it must refuse, and returns the error message."""
+        stderr = io.StringIO()
+        with mock.patch('sys.argv', ['secureget.py', *argv]), contextlib.redirect_stderr(stderr):
+            with self.assertRaises(SystemExit) as raised:
+                secureget.main()
+        self.assertEqual(raised.exception.code, 2)
+        return stderr.getvalue()
+
+    def test_buffered_with_batch(self):
+        self.assertIn("--buffered can't be used with --batch", self.refused('--batch', 'urls.txt', '--buffered'))
+
+    def test_buffered_with_several_urls(self):
+        self.assertIn("--buffered takes a single URL", self.refused('--buffered', 'https://a/', 'https://b/'))
+
+    def test_not_https(self):
+        self.assertIn("is not an https URL", self.refused('http://example.com/'))
+
+
+if __name__ == '__main__':
+    unittest.main()
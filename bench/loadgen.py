@@ -0,0 +1,419 @@
+# loadgen.py
+# Load generator for the a1 and a2 servers. It simulates many concurrent clients
+# on one asyncio event loop and reports throughput, latency percentiles and a
+# latency histogram, connection setup times and error counts, optionally as JSON
+# so results from different versions of the servers can be compared.
+#
+# Targets:
+#   vl    a1/myvlserver.py - each client sends a length-prefixed message and waits
+#         for the uppercased reply (closed loop). Latency is request -> response.
+#   chat  a2/mychatserver.py - each client sends a message every --send-interval
+#         seconds and reads what the others send. Latency is the time from one
+#         client sending a message until another client receives the relayed copy.
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+import struct
+import sys
+import time
+
+# Upper bounds (in milliseconds) of the latency histogram buckets in the report
+HISTOGRAM_BOUNDS_MS = [0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+# Chat payloads carry their send time so the receiving client can compute the fan-out
+# latency. The relayed copy arrives as "<port>: <payload>", possibly glued to or split
+# from other messages, so payloads end with a record separator and are found by pattern.
+CHAT_PAYLOAD = re.compile(rb'LG(\d{20})x*\x1e')
+
+
+class Results:
+    """Raw measurements collected by all simulated clients during one run."""
+
+    def __init__(self):
+        self.latencies = []         # Seconds, one per completed request / delivered message
+        self.connect_times = []     # Seconds, one per successful connection setup
+        self.errors = {}            # Error description -> count
+        self.requests_sent = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def error(self, description):
+        """Counts one error of the given kind."""
+        self.errors[description] = self.errors.get(description, 0) + 1
+
+
+def percentile(sorted_values, fraction):
+    """
+    Returns the value at the given percentile of an already sorted list.
+
+    Args:
+        sorted_values: Sorted list of numbers
+        fraction: The percentile as a fraction, e.g. 0.99 for p99
+
+    Returns:
+        float: The percentile (nearest-rank), or 0.0 for an empty list
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[rank]
+
+
+def summarize_times(values):
+    """
+    Summarizes a list of durations in seconds.
+
+    Returns:
+        dict: count plus p50/p90/p99/max in milliseconds
+    """
+    ordered = sorted(values)
+    return {
+        "count": len(ordered),
+        "p50_ms": percentile(ordered, 0.50) * 1000,
+        "p90_ms": percentile(ordered, 0.90) * 1000,
+        "p99_ms": percentile(ordered, 0.99) * 1000,
+        "max_ms": (ordered[-1] if ordered else 0.0) * 1000,
+    }
+
+
+def histogram(values):
+    """
+    Buckets durations in seconds by HISTOGRAM_BOUNDS_MS.
+
+    Returns:
+        list: [upper bound in ms (or "inf"), count] pairs
+    """
+    counts = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+    for value in values:
+        ms = value * 1000
+        index = 0
+        while index < len(HISTOGRAM_BOUNDS_MS) and ms > HISTOGRAM_BOUNDS_MS[index]:
+            index += 1
+        counts[index] += 1
+    return [[bound, count] for bound, count in zip(HISTOGRAM_BOUNDS_MS + ["inf"], counts)]
+
+
+async def open_timed_connection(args, results):
+    """
+    Connects to the target and records how long the TCP handshake took.
+
+    Returns:
+        tuple: (reader, writer), or (None, None) if the connection failed
+    """
+    started = time.perf_counter()
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(args.host, args.port), timeout=args.timeout)
+    except (OSError, asyncio.TimeoutError) as e:
+        results.error(f"connect: {type(e).__name__}")
+        return None, None
+    results.connect_times.append(time.perf_counter() - started)
+    return reader, writer
+
+
+def encode_vl_frame(payload, framing):
+    """Prefixes a payload with its length in the a1 legacy or wide framing."""
+    if framing == 'wide':
+        return struct.pack('!I', len(payload)) + payload
+    return f"{len(payload):02d}".encode() + payload
+
+
+async def vl_handshake(reader, writer, timeout):
+    """Sends the a1 wide-framing hello and checks that the server accepted it."""
+    writer.write(b'#W\x01')
+    answer = await asyncio.wait_for(reader.readexactly(3), timeout=timeout)
+    if answer[:2] != b'#W' or answer[2] == 0:
+        raise ConnectionError("server refused wide framing")
+
+
+async def vl_client(args, results, deadline):
+    """
+    One simulated myvlclient: sends messages back to back until the deadline,
+    reconnecting for every message unless --keep-alive is set.
+    """
+    header_size = 4 if args.framing == 'wide' else 2
+    text = bytes(random.choices(b'abcdefghijklmnopqrstuvwxyz ', k=max(args.message_sizes)))
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        if writer is None:
+            reader, writer = await open_timed_connection(args, results)
+            if writer is None:
+                await asyncio.sleep(0.05)  # Back off a little so refusals do not spin
+                continue
+            if args.framing == 'wide':
+                try:
+                    await vl_handshake(reader, writer, args.timeout)
+                except (OSError, ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                    results.error(f"handshake: {type(e).__name__}")
+                    writer.close()
+                    reader = writer = None
+                    continue
+
+        payload = text[:random.choice(args.message_sizes)]
+        frame = encode_vl_frame(payload, args.framing)
+
+        started = time.perf_counter()
+        try:
+            writer.write(frame)
+            results.requests_sent += 1
+            results.bytes_sent += len(frame)
+            header = await asyncio.wait_for(reader.readexactly(header_size), timeout=args.timeout)
+            length = struct.unpack('!I', header)[0] if args.framing == 'wide' else int(header)
+            response = await asyncio.wait_for(reader.readexactly(length), timeout=args.timeout)
+        except (OSError, ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+            results.error(f"request: {type(e).__name__}")
+            writer.close()
+            reader = writer = None
+            continue
+        results.latencies.append(time.perf_counter() - started)
+        results.bytes_received += header_size + length
+        if response != payload.upper():
+            results.error("request: wrong response")
+
+        if not args.keep_alive:
+            writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def chat_receiver(reader, results, since_ns):
+    """
+    Reads relayed chat messages and records the fan-out latency of each.
+    Messages stamped before since_ns are history the server replayed from an
+    earlier run and are not counted.
+    """
+    buffer = b''
+    while True:
+        data = await reader.read(65536)
+        if not data:
+            return
+        received_at = time.perf_counter_ns()
+        results.bytes_received += len(data)
+        buffer += data
+        end = 0
+        for match in CHAT_PAYLOAD.finditer(buffer):
+            sent_at = int(match.group(1))
+            if sent_at >= since_ns:
+                results.latencies.append((received_at - sent_at) / 1e9)
+            end = match.end()
+        # Keep a possibly incomplete payload at the end for the next read: all of
+        # it, from its LG on, however large it is. Without one, only a last byte
+        # that could be the L of the next payload is kept
+        start = buffer.rfind(b'LG', end)
+        buffer = buffer[start:] if start != -1 else buffer[-1:]
+
+
+async def chat_client(args, results, deadline, connected, all_connected):
+    """
+    One simulated mychatclient: connects, waits until every client is connected,
+    then sends a timestamped message every --send-interval seconds until the deadline.
+    """
+    reader, writer = await open_timed_connection(args, results)
+    connected()
+    if writer is None:
+        return
+    receiver = asyncio.create_task(chat_receiver(reader, results, time.perf_counter_ns()))
+    if args.framing == 'lines':
+        # Ask for the CHAT/2 line protocol; the answer is skipped by the receiver
+        writer.write(b'\x00CHAT/2\n')
+    try:
+        await all_connected.wait()
+        # Spread the first sends over one interval so clients do not fire in lockstep
+        await asyncio.sleep(random.uniform(0, args.send_interval))
+        while time.perf_counter() < deadline:
+            size = random.choice(args.message_sizes)
+            stamp = b'LG%020d' % time.perf_counter_ns()
+            payload = stamp + b'x' * max(0, size - len(stamp) - 1) + b'\x1e'
+            if args.framing == 'lines':
+                payload += b'\n'
+            writer.write(payload)
+            results.requests_sent += 1
+            results.bytes_sent += len(payload)
+            try:
+                await writer.drain()
+            except OSError as e:
+                results.error(f"send: {type(e).__name__}")
+                return
+            await asyncio.sleep(args.send_interval)
+        # Give the last messages time to be relayed before hanging up
+        await asyncio.sleep(min(1.0, args.timeout))
+        writer.write(b'exit\n' if args.framing == 'lines' else b'exit')
+    finally:
+        receiver.cancel()
+        writer.close()
+
+
+def raise_file_limit(clients):
+    """Raises the open-file limit so thousands of simulated clients can connect."""
+    try:
+        import resource
+    except ImportError:
+        return  # Not available on Windows
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = clients + 64
+    if soft != resource.RLIM_INFINITY and soft < wanted:
+        new_soft = wanted if hard == resource.RLIM_INFINITY else min(wanted, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (new_soft, hard))
+
+
+async def run(args):
+    """
+    Runs one load test.
+
+    Returns:
+        dict: The report, as printed or written to JSON
+    """
+    results = Results()
+    started = time.perf_counter()
+    deadline = started + args.duration
+
+    if args.target == 'vl':
+        await asyncio.gather(*(vl_client(args, results, deadline) for _ in range(args.clients)))
+    else:
+        # Everyone connects before the clock for sending starts
+        all_connected = asyncio.Event()
+        pending = [args.clients]
+
+        def connected():
+            pending[0] -= 1
+            if pending[0] == 0:
+                all_connected.set()
+
+        await asyncio.gather(*(chat_client(args, results, deadline, connected, all_connected)
+                               for _ in range(args.clients)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "tool": "loadgen",
+        "version": 1,
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "config": {
+            "target": args.target,
+            "host": args.host,
+            "port": args.port,
+            "clients": args.clients,
+            "duration_s": args.duration,
+            "message_sizes": args.message_sizes,
+            "framing": args.framing,
+            "keep_alive": args.keep_alive if args.target == 'vl' else None,
+            "send_interval_s": args.send_interval if args.target == 'chat' else None,
+        },
+        "results": {
+            "elapsed_s": elapsed,
+            "requests_sent": results.requests_sent,
+            "completed": len(results.latencies),
+            "throughput_per_s": len(results.latencies) / elapsed if elapsed > 0 else 0.0,
+            "bytes_sent": results.bytes_sent,
+            "bytes_received": results.bytes_received,
+            "latency": summarize_times(results.latencies),
+            "latency_histogram_ms": histogram(results.latencies),
+            "connect": summarize_times(results.connect_times),
+            "errors": sum(results.errors.values()),
+            "errors_by_kind": results.errors,
+        },
+    }
+
+
+def print_report(report, baseline=None):
+    """Prints a report for humans, with changes against a baseline report if given."""
+    config, res = report["config"], report["results"]
+    what = "responses" if config["target"] == 'vl' else "deliveries"
+    print(f"target={config['target']} {config['host']}:{config['port']} clients={config['clients']} "
+          f"duration={config['duration_s']}s sizes={config['message_sizes']}")
+    print(f"sent={res['requests_sent']} {what}={res['completed']} "
+          f"throughput={res['throughput_per_s']:.1f}/s errors={res['errors']}")
+    for name in ("latency", "connect"):
+        t = res[name]
+        print(f"{name:>8}: p50={t['p50_ms']:.3f}ms p90={t['p90_ms']:.3f}ms "
+              f"p99={t['p99_ms']:.3f}ms max={t['max_ms']:.3f}ms (n={t['count']})")
+    print("histogram:")
+    total = max(1, res["completed"])
+    for bound, count in res["latency_histogram_ms"]:
+        if count:
+            label = f"<= {bound} ms" if bound != "inf" else f"> {HISTOGRAM_BOUNDS_MS[-1]} ms"
+            print(f"  {label:>12} {count:>9} {'#' * max(1, round(40 * count / total))}")
+    for kind, count in res["errors_by_kind"].items():
+        print(f"  error {kind}: {count}")
+
+    if baseline:
+        base = baseline["results"]
+
+        def change(new, old):
+            return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+
+        print(f"vs baseline: throughput {change(res['throughput_per_s'], base['throughput_per_s'])}, "
+              f"p50 {change(res['latency']['p50_ms'], base['latency']['p50_ms'])}, "
+              f"p99 {change(res['latency']['p99_ms'], base['latency']['p99_ms'])}, "
+              f"errors {res['errors']} (was {base['errors']})")
+
+
+def parse_args():
+    """
+    Parses the command line options.
+
+    Returns:
+        argparse.Namespace: The parsed options
+    """
+    parser = argparse.ArgumentParser(description="Load generator for the a1 and a2 servers")
+    parser.add_argument('target', choices=['vl', 'chat'],
+                        help="vl: a1/myvlserver.py, chat: a2/mychatserver.py")
+    parser.add_argument('--host', default='127.0.0.1', help="server host (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, help="server port (default: 12000 for vl, 12345 for chat)")
+    parser.add_argument('--clients', type=int, default=50, help="concurrent simulated clients (default: 50)")
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds to generate load (default: 10)")
+    parser.add_argument('--message-sizes', default='32',
+                        help="comma-separated message sizes in bytes, picked at random per message (default: 32)")
+    parser.add_argument('--framing', choices=['legacy', 'wide', 'lines'], default='legacy',
+                        help="vl: 2-digit (max 99 bytes) or negotiated 4-byte length prefixes; "
+                             "chat: unframed (legacy) or the CHAT/2 line protocol (lines) (default: legacy)")
+    parser.add_argument('--keep-alive', action='store_true',
+                        help="vl: reuse each client's connection instead of reconnecting per message")
+    parser.add_argument('--send-interval', type=float, default=0.1,
+                        help="chat: seconds between messages from each client (default: 0.1)")
+    parser.add_argument('--timeout', type=float, default=5.0, help="seconds before a connect or reply times out")
+    parser.add_argument('--json', metavar='PATH', help="write the report as JSON to PATH (- for stdout)")
+    parser.add_argument('--compare', metavar='PATH', help="show changes against a JSON report from an earlier run")
+    args = parser.parse_args()
+
+    args.message_sizes = [int(size) for size in args.message_sizes.split(',')]
+    if args.port is None:
+        args.port = 12000 if args.target == 'vl' else 12345
+    if args.target == 'vl' and args.framing == 'legacy' and max(args.message_sizes) > 99:
+        parser.error("legacy framing caps messages at 99 bytes; use --framing wide for larger ones")
+    if args.framing == 'wide' and args.target != 'vl':
+        parser.error("--framing wide is for vl only")
+    if args.framing == 'lines' and args.target != 'chat':
+        parser.error("--framing lines is for chat only")
+    if args.target == 'chat' and min(args.message_sizes) < 24:
+        parser.error("chat messages need at least 24 bytes for the timestamp")
+    return args
+
+
+def main():
+    args = parse_args()
+    raise_file_limit(args.clients)
+    report = asyncio.run(run(args))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    if args.json == '-':
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(report, baseline)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"Report written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()